@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Catalogo y carrito AJAX con vistas asincronas (ROOT_URLCONF = config.urls_asgi)
+os.environ.setdefault('VGL_ASGI', '1')
 
 application = get_asgi_application()
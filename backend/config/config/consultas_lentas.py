@@ -0,0 +1,246 @@
+"""
+Registro de consultas lentas.
+
+Con ``CONSULTAS_LENTAS_UMBRAL_MS`` configurado, un ``execute_wrapper`` fijo
+en cada conexion (como el de ``metricas``) mide las sentencias de la
+peticion que ``ConsultasLentasMiddleware`` deja en una ``ContextVar``; sin
+umbral (``None``, lo predeterminado) no se instala. Toda sentencia que tarda
+mas del umbral se guarda con:
+
+* la vista resuelta (``resolver_match.view_name``);
+* la linea del proyecto que la origino (la mas interna fuera de Django y de
+  las librerias); en vistas asincronas el ORM corre en otro hilo y la linea
+  se busca en la cadena de ``await`` de la tarea de la peticion;
+* la plantilla que se estaba renderizando, si la consulta salio de ella: un
+  acceso perezoso a una relacion en ``producto_detalle.html`` no aparece en
+  el codigo de la vista, pero aqui queda con el nombre de la plantilla.
+
+Las entradas van a un buffer circular de ``CONSULTAS_LENTAS_CAPACIDAD``
+elementos por proceso. La pila solo se recorre para las consultas que pasan
+el umbral; las demas cuestan un par de ``perf_counter``. ``consultas_lentas``
+(solo staff) las agrupa por SQL normalizado, de peor a mejor.
+"""
+import asyncio
+import re
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.shortcuts import redirect, render
+from django.template.base import Template
+from django.utils import timezone
+from django.views.decorators.http import require_POST
+
+from .metricas import instalar
+
+ConsultaLenta = namedtuple('ConsultaLenta', ['sql', 'normalizada', 'ms', 'vista', 'origen', 'plantilla', 'momento'])
+
+_LISTA_RE = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_CADENA_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMERO_RE = re.compile(r'(?<![\w"])-?\d+(?:\.\d+)?\b')
+_ESPACIOS_RE = re.compile(r'\s+')
+
+_PROYECTO = str(Path(settings.BASE_DIR).resolve())
+_LIBRERIAS = ('site-packages', 'dist-packages', f'{Path(sys.prefix).resolve()}')
+# Los execute_wrapper de la instrumentacion quedan en la pila de cada consulta
+_INSTRUMENTACION = {str(Path(__file__).resolve()), str(Path(__file__).resolve().with_name('metricas.py'))}
+_PLANTILLAS_DJANGO = str(Path(sys.modules['django.template.base'].__file__).resolve().parent)
+
+_lock = threading.Lock()
+_entradas = deque(maxlen=getattr(settings, 'CONSULTAS_LENTAS_CAPACIDAD', 500))
+
+
+def umbral_ms():
+    return getattr(settings, 'CONSULTAS_LENTAS_UMBRAL_MS', None)
+
+
+def normalizar(sql):
+    """Misma forma para la misma consulta: listas IN de cualquier largo y literales como '?'."""
+    sql = _LISTA_RE.sub('(...)', sql)
+    sql = _CADENA_RE.sub('?', sql)
+    sql = _NUMERO_RE.sub('?', sql)
+    return _ESPACIOS_RE.sub(' ', sql).strip()
+
+
+def _origen(marco):
+    archivo = marco.f_code.co_filename
+    if (archivo.startswith(_PROYECTO) and archivo not in _INSTRUMENTACION
+            and not any(parte in archivo for parte in _LIBRERIAS)):
+        return f'{Path(archivo).relative_to(_PROYECTO)}:{marco.f_lineno} ({marco.f_code.co_name})'
+    return None
+
+
+def _contexto_llamada():
+    """``(origen, plantilla)``: linea del proyecto mas interna y plantilla en curso."""
+    origen = plantilla = None
+    marco = sys._getframe(2)
+    while marco is not None and (origen is None or plantilla is None):
+        archivo = marco.f_code.co_filename
+        if plantilla is None and archivo.startswith(_PLANTILLAS_DJANGO) and marco.f_code.co_name == 'render':
+            instancia = marco.f_locals.get('self')
+            if isinstance(instancia, Template):
+                plantilla = instancia.name
+        if origen is None:
+            origen = _origen(marco)
+        marco = marco.f_back
+    return origen, plantilla
+
+
+def _origen_asincrono(tarea):
+    """
+    Linea del proyecto mas interna en la cadena de ``await`` de ``tarea``.
+
+    La tarea esta detenida esperando a este hilo, asi que sus marcos no cambian.
+    """
+    origen = None
+    esperado = tarea.get_coro()
+    while esperado is not None:
+        marco = getattr(esperado, 'cr_frame', None) or getattr(esperado, 'gi_frame', None)
+        if marco is None:
+            break
+        origen = _origen(marco) or origen
+        esperado = getattr(esperado, 'cr_await', None) or getattr(esperado, 'gi_yieldfrom', None)
+    return origen
+
+
+def registrar(sql, ms, vista, tarea=None):
+    origen, plantilla = _contexto_llamada()
+    if tarea is not None:
+        # La pila de este hilo no pasa por la vista
+        origen = _origen_asincrono(tarea) or origen
+    entrada = ConsultaLenta(sql, normalizar(sql), ms, vista, origen, plantilla, timezone.now())
+    with _lock:
+        _entradas.append(entrada)
+
+
+def entradas():
+    with _lock:
+        return list(_entradas)
+
+
+def vaciar():
+    with _lock:
+        _entradas.clear()
+
+
+def agrupar(lista):
+    """Una fila por SQL normalizado, de mayor a menor tiempo total."""
+    grupos = {}
+    for entrada in lista:
+        grupo = grupos.setdefault(entrada.normalizada, {
+            'normalizada': entrada.normalizada, 'ejemplo': entrada.sql, 'veces': 0,
+            'total_ms': 0.0, 'max_ms': 0.0, 'vistas': set(), 'origenes': set(), 'plantillas': set(),
+        })
+        grupo['veces'] += 1
+        grupo['total_ms'] += entrada.ms
+        if entrada.ms >= grupo['max_ms']:
+            grupo['max_ms'], grupo['ejemplo'] = entrada.ms, entrada.sql
+        grupo['vistas'].add(entrada.vista)
+        if entrada.origen:
+            grupo['origenes'].add(entrada.origen)
+        if entrada.plantilla:
+            grupo['plantillas'].add(entrada.plantilla)
+    filas = sorted(grupos.values(), key=lambda grupo: grupo['total_ms'], reverse=True)
+    for grupo in filas:
+        grupo['promedio_ms'] = grupo['total_ms'] / grupo['veces']
+        for clave in ('vistas', 'origenes', 'plantillas'):
+            grupo[clave] = sorted(grupo[clave])
+    return filas
+
+
+class _Vigilancia:
+    """Peticion en curso, su umbral y, si es asincrona, su tarea."""
+
+    __slots__ = ('request', 'umbral', 'tarea')
+
+    def __init__(self, request, umbral, tarea=None):
+        self.request = request
+        self.umbral = umbral
+        self.tarea = tarea
+
+
+_vigilancia = ContextVar('consultas_lentas_vigilancia', default=None)
+
+
+def _vigilar_sql(execute, sql, params, many, context):
+    vigilancia = _vigilancia.get()
+    if vigilancia is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        ms = (time.perf_counter() - inicio) * 1000
+        if ms >= vigilancia.umbral:
+            coincidencia = getattr(vigilancia.request, 'resolver_match', None)
+            registrar(sql, ms, coincidencia.view_name if coincidencia else '<sin_ruta>', vigilancia.tarea)
+
+
+def _al_conectar(sender, connection, **kwargs):
+    if umbral_ms() is not None:
+        instalar(connection, _vigilar_sql)
+
+
+class ConsultasLentasMiddleware:
+    """Sin ``CONSULTAS_LENTAS_UMBRAL_MS`` no mide nada."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.asincrono = iscoroutinefunction(get_response)
+        if self.asincrono:
+            markcoroutinefunction(self)
+        connection_created.connect(_al_conectar, dispatch_uid='consultas_lentas')
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self.__acall__(request)
+        umbral = umbral_ms()
+        if umbral is None:
+            return self.get_response(request)
+        for conexion in connections.all():
+            instalar(conexion, _vigilar_sql)
+        token = _vigilancia.set(_Vigilancia(request, umbral))
+        try:
+            return self.get_response(request)
+        finally:
+            _vigilancia.reset(token)
+
+    async def __acall__(self, request):
+        umbral = umbral_ms()
+        if umbral is None:
+            return await self.get_response(request)
+        token = _vigilancia.set(_Vigilancia(request, umbral, asyncio.current_task()))
+        try:
+            return await self.get_response(request)
+        finally:
+            _vigilancia.reset(token)
+
+
+@staff_member_required
+def consultas_lentas(request):
+    """Consultas lentas de este proceso agrupadas por SQL normalizado."""
+    lista = entradas()
+    return render(request, 'consultas_lentas.html', {
+        'grupos': agrupar(lista),
+        'total': len(lista),
+        'capacidad': _entradas.maxlen,
+        'umbral_ms': umbral_ms(),
+    })
+
+
+@staff_member_required
+@require_POST
+def vaciar_consultas_lentas(request):
+    vaciar()
+    return redirect('consultas_lentas')
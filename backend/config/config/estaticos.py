@@ -0,0 +1,142 @@
+"""
+Modo "build" de los archivos estaticos.
+
+Con ``VGL_ESTATICOS_COMPILADOS=1``, ``collectstatic`` deja en ``STATIC_ROOT``:
+
+* cada archivo con un hash de su contenido en el nombre
+  (``css/styles.3f2a9c1e0b7d.css``), igual que ``ManifestStaticFilesStorage``;
+* los paquetes de ``PAQUETES_ESTATICOS`` (varias hojas o scripts de una
+  pagina concatenados en un solo archivo, tambien con hash);
+* una copia ``.gz`` y, si esta instalado ``brotli``, una ``.br`` de cada
+  archivo de texto.
+
+``servir_estatico`` entrega esos archivos con la variante comprimida que
+acepte el navegador y, si el nombre lleva hash, con
+``Cache-Control: immutable`` por un año: quien vuelve no descarga nada.
+"""
+import gzip
+import mimetypes
+import os
+import posixpath
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import ImproperlyConfigured, SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import FileResponse, Http404
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # opcional: sin brotli solo se generan .gz
+    brotli = None
+
+EXTENSIONES_COMPRIMIBLES = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.map', '.xml')
+CACHE_INMUTABLE = 'public, max-age=31536000, immutable'
+CACHE_REVALIDAR = 'public, max-age=0, must-revalidate'
+
+# (extension del archivo precomprimido, Content-Encoding), en orden de preferencia
+VARIANTES = (('.br', 'br'), ('.gz', 'gzip'))
+
+
+def paquetes():
+    return getattr(settings, 'PAQUETES_ESTATICOS', {})
+
+
+class EstaticosComprimidos(ManifestStaticFilesStorage):
+    """Manifest con hash + paquetes por pagina + variantes .gz/.br."""
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+
+        for nombre, contenido in self._contenido_paquetes():
+            hashed = self.hashed_name(nombre, ContentFile(contenido))
+            # Tambien sin hash, como los demas archivos recolectados
+            for destino in (nombre, hashed):
+                if self.exists(destino):
+                    self.delete(destino)
+                self._save(destino, ContentFile(contenido))
+            self.hashed_files[self.hash_key(self.clean_name(nombre))] = hashed
+            yield nombre, hashed, True
+        self.save_manifest()
+
+        for hashed in sorted(set(self.hashed_files.values())):
+            if hashed.endswith(EXTENSIONES_COMPRIMIBLES):
+                self._comprimir(hashed)
+
+    def _contenido_paquetes(self):
+        """(nombre, bytes) de cada paquete, concatenando las versiones ya procesadas."""
+        for nombre, fuentes in paquetes().items():
+            directorio = posixpath.dirname(nombre)
+            partes = []
+            for fuente in fuentes:
+                # Las url() relativas ya reescritas solo siguen valiendo en el mismo directorio
+                if posixpath.dirname(fuente) != directorio:
+                    raise ImproperlyConfigured(
+                        f'El paquete {nombre} debe estar en el mismo directorio que {fuente}.'
+                    )
+                with self.open(self.stored_name(fuente)) as archivo:
+                    partes.append(archivo.read())
+            separador = b';\n' if nombre.endswith('.js') else b'\n'
+            yield nombre, separador.join(partes)
+
+    def _comprimir(self, nombre):
+        with self.open(nombre) as archivo:
+            contenido = archivo.read()
+        variantes = [('.gz', gzip.compress(contenido, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variantes.append(('.br', brotli.compress(contenido, quality=11)))
+        for extension, comprimido in variantes:
+            # Archivos diminutos pueden crecer al comprimirse
+            if len(comprimido) < len(contenido):
+                if self.exists(nombre + extension):
+                    self.delete(nombre + extension)
+                self._save(nombre + extension, ContentFile(comprimido))
+
+
+@lru_cache(maxsize=1)
+def nombres_con_hash():
+    """Nombres con hash del manifest (se leen una vez por proceso)."""
+    return frozenset(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+
+def _codificaciones_aceptadas(request):
+    aceptadas = set()
+    for parte in request.headers.get('Accept-Encoding', '').split(','):
+        codificacion, _, parametros = parte.strip().partition(';')
+        if parametros.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        aceptadas.add(codificacion.strip().lower())
+    return aceptadas
+
+
+def servir_estatico(request, ruta):
+    """Sirve ``STATIC_ROOT/ruta`` con la variante precomprimida y el Cache-Control adecuado."""
+    ruta = posixpath.normpath(ruta).lstrip('/')
+    try:
+        completa = safe_join(settings.STATIC_ROOT, ruta)
+    except SuspiciousFileOperation:
+        raise Http404(ruta)
+    if not os.path.isfile(completa):
+        raise Http404(ruta)
+
+    archivo, codificacion = completa, None
+    aceptadas = _codificaciones_aceptadas(request)
+    for extension, nombre_codificacion in VARIANTES:
+        if nombre_codificacion in aceptadas and os.path.isfile(completa + extension):
+            archivo, codificacion = completa + extension, nombre_codificacion
+            break
+
+    tipo, _ = mimetypes.guess_type(completa)
+    respuesta = FileResponse(open(archivo, 'rb'), content_type=tipo or 'application/octet-stream')
+    if codificacion:
+        respuesta.headers['Content-Encoding'] = codificacion
+    patch_vary_headers(respuesta, ['Accept-Encoding'])
+    respuesta.headers['Cache-Control'] = (
+        CACHE_INMUTABLE if ruta in nombres_con_hash() else CACHE_REVALIDAR
+    )
+    return respuesta
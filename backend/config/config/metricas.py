@@ -0,0 +1,346 @@
+"""
+Metricas de peticiones en formato de exposicion de Prometheus.
+
+``MetricasMiddleware`` registra, por nombre de ruta (``resolver_match.view_name``)
+y metodo:
+
+* ``vgl_peticiones_total``: peticiones por codigo de estado (``2xx``, ``4xx``...);
+* ``vgl_peticion_duracion_segundos``: histograma de latencia;
+* ``vgl_peticion_consultas_sql`` y ``vgl_peticion_sql_segundos``: histogramas
+  del numero de consultas y del tiempo en la base de datos por peticion;
+* ``vgl_respuesta_bytes``: histograma del tamaño de la respuesta.
+
+Cada proceso acumula en memoria (un lock y unas sumas por peticion) y, como
+mucho una vez por ``METRICAS_INTERVALO`` segundos, vuelca su estado a un
+archivo propio en ``METRICAS_DIRECTORIO`` (en las peticiones asincronas,
+desde un hilo: el event loop no espera al disco). La vista ``metricas`` suma los
+archivos de todos los procesos, asi que con varios workers cualquiera de
+ellos responde por todos. Los archivos de procesos terminados se conservan
+(los contadores no deben bajar); se borran al desplegar, junto con el
+directorio. Sin directorio configurado, cada proceso expone solo lo suyo.
+
+La vista solo responde al staff o a peticiones directas desde localhost.
+
+El tiempo en SQL se mide con un ``execute_wrapper`` fijo en cada conexion
+(``instalar``) que suma en el medidor de la peticion en curso, guardado en
+una ``ContextVar``: con vistas asincronas el ORM corre en otro hilo
+(``sync_to_async``), pero hereda el contexto de la peticion.
+"""
+import atexit
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+
+BUCKETS_DURACION = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_CONSULTAS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+BUCKETS_BYTES = (1_000, 5_000, 20_000, 100_000, 500_000, 2_000_000, 10_000_000)
+
+# nombre: (tipo, ayuda, etiquetas, buckets)
+METRICAS = {
+    'vgl_peticiones_total': (
+        'counter', 'Peticiones atendidas.', ('vista', 'metodo', 'estado'), None,
+    ),
+    'vgl_peticion_duracion_segundos': (
+        'histogram', 'Latencia de la peticion.', ('vista', 'metodo'), BUCKETS_DURACION,
+    ),
+    'vgl_peticion_consultas_sql': (
+        'histogram', 'Consultas SQL por peticion.', ('vista', 'metodo'), BUCKETS_CONSULTAS,
+    ),
+    'vgl_peticion_sql_segundos': (
+        'histogram', 'Tiempo en la base de datos por peticion.', ('vista', 'metodo'), BUCKETS_DURACION,
+    ),
+    'vgl_respuesta_bytes': (
+        'histogram', 'Tamaño del cuerpo de la respuesta.', ('vista', 'metodo'), BUCKETS_BYTES,
+    ),
+}
+
+VISTA_SIN_RUTA = '<sin_ruta>'
+VISTAS_EXCLUIDAS = {'metricas'}
+DIRECCIONES_LOCALES = {'127.0.0.1', '::1'}
+
+
+class Registro:
+    """
+    Estado de un proceso: ``{nombre: {etiquetas: valor}}``. Los contadores son
+    un numero; los histogramas, ``[cuenta por bucket..., +Inf, suma]``.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.valores = {nombre: {} for nombre in METRICAS}
+
+    def incrementar(self, nombre, etiquetas, cantidad=1):
+        serie = self.valores[nombre]
+        serie[etiquetas] = serie.get(etiquetas, 0) + cantidad
+
+    def observar(self, nombre, etiquetas, valor):
+        buckets = METRICAS[nombre][3]
+        serie = self.valores[nombre]
+        cuentas = serie.get(etiquetas)
+        if cuentas is None:
+            cuentas = serie[etiquetas] = [0] * (len(buckets) + 2)
+        # Solo el primer bucket que lo contiene (limite >= valor); se acumulan al exportar
+        cuentas[bisect_left(buckets, valor)] += 1
+        cuentas[-1] += valor
+
+    def peticion(self, vista, metodo, estado, duracion, consultas, tiempo_sql, tamano):
+        etiquetas = (vista, metodo)
+        with self.lock:
+            self.incrementar('vgl_peticiones_total', (vista, metodo, estado))
+            self.observar('vgl_peticion_duracion_segundos', etiquetas, duracion)
+            self.observar('vgl_peticion_consultas_sql', etiquetas, consultas)
+            self.observar('vgl_peticion_sql_segundos', etiquetas, tiempo_sql)
+            if tamano is not None:
+                self.observar('vgl_respuesta_bytes', etiquetas, tamano)
+
+    def exportar(self):
+        """Copia serializable: ``{nombre: [[etiquetas, valor], ...]}``."""
+        with self.lock:
+            return {
+                nombre: [[list(etiquetas), list(valor) if isinstance(valor, list) else valor]
+                         for etiquetas, valor in serie.items()]
+                for nombre, serie in self.valores.items()
+            }
+
+
+_registro = Registro()
+# Nombre unico por proceso: un pid reutilizado tras un reinicio no pisa al anterior
+_archivo = f'{os.getpid()}-{time.time_ns()}.json'
+_ultimo_volcado = 0.0
+_lock_volcado = threading.Lock()
+
+
+def _directorio():
+    return getattr(settings, 'METRICAS_DIRECTORIO', None)
+
+
+def toca_volcar():
+    """Si hay directorio y ya paso ``METRICAS_INTERVALO`` desde el ultimo volcado."""
+    return bool(_directorio()) and (
+        time.monotonic() - _ultimo_volcado >= getattr(settings, 'METRICAS_INTERVALO', 1.0)
+    )
+
+
+def volcar(forzar=False):
+    """Escribe el estado de este proceso en su archivo (reemplazo atomico)."""
+    global _ultimo_volcado
+    directorio = _directorio()
+    if not directorio:
+        return
+    ahora = time.monotonic()
+    if not forzar and not toca_volcar():
+        return
+    if not _lock_volcado.acquire(blocking=forzar):
+        return  # otro hilo ya esta volcando
+    try:
+        _ultimo_volcado = ahora
+        os.makedirs(directorio, exist_ok=True)
+        descriptor, temporal = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+        with os.fdopen(descriptor, 'w') as salida:
+            json.dump(_registro.exportar(), salida)
+        os.replace(temporal, os.path.join(directorio, _archivo))
+    finally:
+        _lock_volcado.release()
+
+
+atexit.register(volcar, forzar=True)
+
+
+def estados():
+    """Estados de todos los procesos (el propio, al dia)."""
+    directorio = _directorio()
+    if not directorio:
+        return [_registro.exportar()]
+    volcar(forzar=True)
+    resultado = []
+    for nombre in os.listdir(directorio):
+        if not nombre.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directorio, nombre)) as entrada:
+                resultado.append(json.load(entrada))
+        except (OSError, ValueError):
+            continue  # archivo borrado o a medio escribir por otro despliegue
+    return resultado
+
+
+def _sumar(estados):
+    total = {nombre: {} for nombre in METRICAS}
+    for estado in estados:
+        for nombre, filas in estado.items():
+            if nombre not in total:
+                continue
+            serie = total[nombre]
+            for etiquetas, valor in filas:
+                clave = tuple(etiquetas)
+                if isinstance(valor, list):
+                    acumulado = serie.setdefault(clave, [0] * len(valor))
+                    for i, cantidad in enumerate(valor):
+                        acumulado[i] += cantidad
+                else:
+                    serie[clave] = serie.get(clave, 0) + valor
+    return total
+
+
+def _escapar(valor):
+    return valor.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _etiquetas(nombres, valores, extra=''):
+    partes = [f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return '{' + ','.join(partes) + '}'
+
+
+def _numero(valor):
+    if isinstance(valor, float) and math.isinf(valor):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def exposicion(lista_estados):
+    """Texto en formato de exposicion de Prometheus (0.0.4)."""
+    lineas = []
+    for nombre, serie in _sumar(lista_estados).items():
+        tipo, ayuda, nombres, buckets = METRICAS[nombre]
+        lineas.append(f'# HELP {nombre} {ayuda}')
+        lineas.append(f'# TYPE {nombre} {tipo}')
+        for etiquetas, valor in sorted(serie.items()):
+            if tipo == 'counter':
+                lineas.append(f'{nombre}{_etiquetas(nombres, etiquetas)} {_numero(valor)}')
+                continue
+            acumulado = 0
+            for limite, cantidad in zip((*buckets, math.inf), valor):
+                acumulado += cantidad
+                le = f'le="{_numero(float(limite))}"'
+                lineas.append(f'{nombre}_bucket{_etiquetas(nombres, etiquetas, le)} {acumulado}')
+            lineas.append(f'{nombre}_sum{_etiquetas(nombres, etiquetas)} {_numero(float(valor[-1]))}')
+            lineas.append(f'{nombre}_count{_etiquetas(nombres, etiquetas)} {acumulado}')
+    return '\n'.join(lineas) + '\n'
+
+
+class _MedidorSQL:
+    """Consultas y tiempo en SQL de una peticion."""
+
+    __slots__ = ('consultas', 'segundos')
+
+    def __init__(self):
+        self.consultas = 0
+        self.segundos = 0.0
+
+
+_medidor = ContextVar('metricas_medidor', default=None)
+
+
+def _medir_sql(execute, sql, params, many, context):
+    medidor = _medidor.get()
+    if medidor is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        medidor.segundos += time.perf_counter() - inicio
+        medidor.consultas += 1
+
+
+def instalar(conexion, envoltorio):
+    """
+    Deja ``envoltorio`` fijo en ``conexion``, una sola vez.
+
+    Va al principio de la lista: ``execute_wrapper()`` quita el ultimo al
+    salir y no debe llevarse este si la conexion se abrio dentro de su bloque.
+    """
+    if envoltorio not in conexion.execute_wrappers:
+        conexion.execute_wrappers.insert(0, envoltorio)
+
+
+def _al_conectar(sender, connection, **kwargs):
+    instalar(connection, _medir_sql)
+
+
+class MetricasMiddleware:
+    """Mide cada peticion; va primero en ``MIDDLEWARE`` para incluir a los demas."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.asincrono = iscoroutinefunction(get_response)
+        if self.asincrono:
+            markcoroutinefunction(self)
+        # Las conexiones que se abran despues (otros hilos) se instalan solas
+        connection_created.connect(_al_conectar, dispatch_uid='metricas')
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self.__acall__(request)
+        for conexion in connections.all():
+            instalar(conexion, _medir_sql)
+        medidor = _MedidorSQL()
+        token = _medidor.set(medidor)
+        inicio = time.perf_counter()
+        try:
+            respuesta = self.get_response(request)
+        finally:
+            _medidor.reset(token)
+        self.registrar(request, respuesta, time.perf_counter() - inicio, medidor)
+        volcar()
+        return respuesta
+
+    async def __acall__(self, request):
+        medidor = _MedidorSQL()
+        token = _medidor.set(medidor)
+        inicio = time.perf_counter()
+        try:
+            respuesta = await self.get_response(request)
+        finally:
+            _medidor.reset(token)
+        self.registrar(request, respuesta, time.perf_counter() - inicio, medidor)
+        # Escribir el archivo bloquearia el event loop: se hace en otro hilo,
+        # y solo cuando toca (la comprobacion no cuesta un cambio de hilo)
+        if toca_volcar():
+            await sync_to_async(volcar, thread_sensitive=False)()
+        return respuesta
+
+    def registrar(self, request, respuesta, duracion, medidor):
+        """Suma la peticion al registro en memoria; no toca el disco."""
+        coincidencia = getattr(request, 'resolver_match', None)
+        vista = coincidencia.view_name if coincidencia else VISTA_SIN_RUTA
+        if vista in VISTAS_EXCLUIDAS:
+            return
+        if respuesta.streaming:
+            tamano = int(respuesta['Content-Length']) if respuesta.has_header('Content-Length') else None
+        else:
+            tamano = len(respuesta.content)
+        _registro.peticion(
+            vista, request.method, f'{respuesta.status_code // 100}xx',
+            duracion, medidor.consultas, medidor.segundos, tamano,
+        )
+
+
+def _acceso_permitido(request):
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    # Detras de un proxy REMOTE_ADDR es el proxy: entonces no cuenta como local
+    return (request.META.get('REMOTE_ADDR') in DIRECCIONES_LOCALES
+            and 'HTTP_X_FORWARDED_FOR' not in request.META)
+
+
+def metricas(request):
+    if not _acceso_permitido(request):
+        raise Http404
+    return HttpResponse(exposicion(estados()), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,40 @@
+"""
+Ejecutor de ``manage.py test``.
+
+Las pruebas vacian el cache (``cache.clear()``) en sus ``setUp``: con la
+configuracion normal eso borraria el cache real (el directorio ``cache/`` o
+toda la base de Redis, que ``KEY_PREFIX`` no protege). Durante la corrida el
+cache es un ``FileBasedCache`` en un directorio temporal, compartido entre
+procesos como el de produccion, que se borra al terminar.
+
+``MEDIA_ROOT`` tambien apunta al directorio temporal: guardar un producto
+genera sus derivadas WebP al confirmar y no deben ir al ``media/`` real.
+"""
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class EjecutorPruebas(DiscoverRunner):
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._temporal = Path(tempfile.mkdtemp(prefix='vgl-pruebas-'))
+        self._ajustes = override_settings(
+            CACHES={
+                'default': {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': self._temporal / 'cache',
+                }
+            },
+            MEDIA_ROOT=self._temporal / 'media',
+        )
+        self._ajustes.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._ajustes.disable()
+        shutil.rmtree(self._temporal, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,99 @@
+"""
+Presupuestos de rendimiento por vista.
+
+``rendimiento_base.json`` (junto a ``manage.py``) guarda, para cada escenario
+de la suite de rendimiento (``pedidos.tests.RendimientoVistasTests``), cuantas
+consultas SQL hace la vista y la mediana de su tiempo de respuesta sobre el
+conjunto de datos grande que siembra la suite.
+
+* Las consultas se comparan siempre: una vista que hace mas que su
+  presupuesto hace fallar los tests.
+* El tiempo depende de la maquina, asi que solo se compara con
+  ``VGL_RENDIMIENTO_LATENCIA=1``, con una tolerancia relativa
+  (``VGL_RENDIMIENTO_TOLERANCIA``, 0.3 por defecto) mas un margen fijo.
+* ``VGL_RENDIMIENTO_GRABAR=1`` reescribe el archivo con lo medido; se usa
+  tras una mejora (o un aumento justificado) y el diff queda en la revision.
+"""
+import json
+import math
+import os
+import statistics
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+ARCHIVO_BASE = settings.BASE_DIR / 'rendimiento_base.json'
+MARGEN_MS = 2.0
+
+
+def grabar_activado():
+    return os.environ.get('VGL_RENDIMIENTO_GRABAR') == '1'
+
+
+def latencia_activada():
+    return os.environ.get('VGL_RENDIMIENTO_LATENCIA') == '1'
+
+
+def tolerancia():
+    return float(os.environ.get('VGL_RENDIMIENTO_TOLERANCIA', '0.3'))
+
+
+def cargar_base(archivo=ARCHIVO_BASE):
+    try:
+        with open(archivo, encoding='utf-8') as entrada:
+            return json.load(entrada)
+    except FileNotFoundError:
+        return {}
+
+
+def grabar_base(mediciones, archivo=ARCHIVO_BASE):
+    """Escribe ``{escenario: {'consultas': n, 'ms': x}}`` ordenado, para diffs estables."""
+    with open(archivo, 'w', encoding='utf-8') as salida:
+        json.dump(mediciones, salida, indent=2, sort_keys=True)
+        salida.write('\n')
+
+
+def percentil(ordenados, p):
+    """Percentil ``p`` (0-100) por rango mas cercano de una lista ya ordenada."""
+    if not ordenados:
+        return 0.0
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+def medir(peticion, preparar=None, repeticiones=5):
+    """
+    Ejecuta ``peticion()`` una vez de calentamiento y ``repeticiones`` veces
+    medidas; antes de cada una llama a ``preparar()`` (fuera de la medicion).
+
+    Devuelve ``{'consultas': maximo de consultas, 'ms': mediana}`` y la ultima
+    respuesta.
+    """
+    tiempos = []
+    consultas = 0
+    for vuelta in range(repeticiones + 1):
+        if preparar is not None:
+            preparar()
+        with CaptureQueriesContext(connection) as capturadas:
+            inicio = time.perf_counter()
+            respuesta = peticion()
+            transcurrido = time.perf_counter() - inicio
+        if vuelta:
+            tiempos.append(transcurrido * 1000)
+            consultas = max(consultas, len(capturadas))
+    return {'consultas': consultas, 'ms': round(statistics.median(tiempos), 2)}, respuesta
+
+
+def excesos(nombre, medicion, base):
+    """Mensajes de lo que ``medicion`` supera de ``base``; lista vacia si cumple."""
+    if base is None:
+        return [f'{nombre}: sin presupuesto registrado (grabar con VGL_RENDIMIENTO_GRABAR=1)']
+    errores = []
+    if medicion['consultas'] > base['consultas']:
+        errores.append(f"{nombre}: {medicion['consultas']} consultas (presupuesto {base['consultas']})")
+    if latencia_activada():
+        limite = base['ms'] * (1 + tolerancia()) + MARGEN_MS
+        if medicion['ms'] > limite:
+            errores.append(f"{nombre}: {medicion['ms']:.1f} ms (base {base['ms']:.1f} ms, limite {limite:.1f} ms)")
+    return errores
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,6 +49,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'config.metricas.MetricasMiddleware',
+    'config.consultas_lentas.ConsultasLentasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -57,7 +60,8 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'config.urls'
+# config/asgi.py activa VGL_ASGI: catalogo y carrito AJAX con vistas asincronas
+ROOT_URLCONF = 'config.urls_asgi' if os.environ.get('VGL_ASGI') == '1' else 'config.urls'
 
 TEMPLATES = [
     {
@@ -70,6 +74,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'django.template.context_processors.media',
+                'productos.context_processors.carrito',
             ],
         },
     },
@@ -85,6 +90,18 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Las transacciones toman el bloqueo de escritura al empezar y
+            # esperan (hasta 20 s) en lugar de fallar con "database is locked"
+            # cuando hay checkouts concurrentes.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        'TEST': {
+            # Base en disco: la de memoria compartida no admite escrituras
+            # concurrentes y las pruebas de concurrencia fallarian por bloqueo.
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -125,6 +142,38 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# Modo "build" (config.estaticos): VGL_ESTATICOS_COMPILADOS=1 python manage.py collectstatic
+# genera nombres con hash, paquetes por pagina y variantes .gz/.br, y
+# /static/ se sirve desde STATIC_ROOT con Cache-Control immutable.
+ESTATICOS_COMPILADOS = os.environ.get('VGL_ESTATICOS_COMPILADOS') == '1'
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'config.estaticos.EstaticosComprimidos' if ESTATICOS_COMPILADOS
+            else 'django.contrib.staticfiles.storage.StaticFilesStorage'
+        ),
+    },
+}
+
+# Hojas y scripts que se sirven juntos en cada pagina ({% paquete %}). Las
+# fuentes deben estar en el mismo directorio que el paquete y en el orden de
+# la cascada; sin modo build el tag enlaza cada fuente por separado.
+PAQUETES_ESTATICOS = {
+    'css/paquete-inicio.css': ['css/styles.css', 'css/home.css', 'css/notifications.css', 'css/ui-utils.css'],
+    'css/paquete-catalogo.css': ['css/productos.css', 'css/styles.css', 'css/notifications.css', 'css/ui-utils.css'],
+    'css/paquete-detalle.css': ['css/producto_detalle.css', 'css/styles.css'],
+    'css/paquete-carrito.css': ['css/carrito.css', 'css/styles.css'],
+    'css/paquete-contacto.css': ['css/styles.css', 'css/contacto.css', 'css/notifications.css', 'css/ui-utils.css'],
+    'css/paquete-nosotros.css': ['css/styles.css', 'css/nosotros.css', 'css/notifications.css', 'css/ui-utils.css'],
+    'css/paquete-cuenta.css': ['css/styles.css', 'css/notifications.css', 'css/ui-utils.css'],
+    'js/paquete-comun.js': ['js/notifications.js', 'js/ui-utils.js'],
+}
 
 # Media files (User uploaded content)
 MEDIA_URL = '/media/'
@@ -135,6 +184,55 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 6
 }
 
+# Cache
+# Compartido entre procesos: la version del catalogo, la generacion de los
+# productos y los contadores de estadisticas_cache_catalogo tienen que ser
+# los mismos para todos los workers y para los comandos de manage.py (con
+# LocMemCache cada proceso tendria los suyos). Con mas de un worker hace
+# falta Redis (VGL_REDIS_URL, requiere el paquete redis): el candado de
+# productos.cache_fragmentos y los contadores de version usan add()/incr(),
+# que solo Redis hace atomicos entre procesos. Sin Redis, archivos en
+# VGL_CACHE_DIR, valido solo para un proceso (desarrollo, un worker).
+# manage.py test usa su propio cache temporal (config.pruebas).
+if os.environ.get('VGL_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['VGL_REDIS_URL'],
+            'KEY_PREFIX': 'vgluxebeauty',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('VGL_CACHE_DIR') or BASE_DIR / 'cache',
+        }
+    }
+
+TEST_RUNNER = 'config.pruebas.EjecutorPruebas'
+
+# Segundos que se conserva cada pagina del catalogo (productos.cache_catalogo)
+CATALOGO_CACHE_TIMEOUT = 300
+
+# Numeros de pedido que cada proceso reserva de una vez (pedidos.numeracion)
+PEDIDOS_BLOQUE_NUMEROS = 100
+
+# Metricas Prometheus (config.metricas). Con varios workers, un directorio
+# compartido: cada uno vuelca las suyas ahi como mucho cada METRICAS_INTERVALO
+# segundos y /metricas/ las suma. Vaciarlo al desplegar. Sin directorio, cada
+# proceso expone solo sus propias metricas.
+METRICAS_DIRECTORIO = os.environ.get('VGL_METRICAS_DIR') or None
+METRICAS_INTERVALO = 1.0
+
+# Registro de consultas lentas (config.consultas_lentas): umbral en ms y
+# tamaño del buffer circular de cada proceso. Sin VGL_CONSULTAS_LENTAS_MS (o
+# vacia) el umbral es None y no se instala nada en las conexiones
+CONSULTAS_LENTAS_UMBRAL_MS = (
+    float(os.environ['VGL_CONSULTAS_LENTAS_MS']) if os.environ.get('VGL_CONSULTAS_LENTAS_MS') else None
+)
+CONSULTAS_LENTAS_CAPACIDAD = 500
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/6.0/ref/settings/#default-auto-field
 
@@ -17,21 +17,33 @@ Including another URLconf
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.contrib.auth import views as auth_views
 from productos.views import home
+from .consultas_lentas import consultas_lentas, vaciar_consultas_lentas
+from .estaticos import servir_estatico
+from .metricas import metricas
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/', include('productos.urls')),
     path('', home, name='home'),
     path('', include('productos.urls')),
     path('usuarios/', include('usuarios.urls')),
     path('accounts/login/', auth_views.LoginView.as_view(template_name='registration/login.html'), name='auth_login'),
     path('accounts/logout/', auth_views.LogoutView.as_view(), name='auth_logout'),
     path('pedidos/', include('pedidos.urls')),
+    path('metricas/', metricas, name='metricas'),
+    path('consultas-lentas/', consultas_lentas, name='consultas_lentas'),
+    path('consultas-lentas/vaciar/', vaciar_consultas_lentas, name='vaciar_consultas_lentas'),
 ]
 
-if settings.DEBUG:
+if settings.ESTATICOS_COMPILADOS:
+    # Archivos de collectstatic con nombre hash, .gz/.br y Cache-Control immutable
+    urlpatterns += [
+        re_path(rf'^{settings.STATIC_URL.lstrip("/")}(?P<ruta>.+)$', servir_estatico),
+    ]
+elif settings.DEBUG:
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATICFILES_DIRS[0])
+
+if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
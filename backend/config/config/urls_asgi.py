@@ -0,0 +1,22 @@
+"""
+URLs del despliegue ASGI (``config/asgi.py``).
+
+Las mismas que ``config.urls``, salvo el catalogo y el carrito AJAX, que van
+a las vistas asincronas de ``productos.views_async`` con los mismos nombres.
+Al ir primero, ``resolve`` las encuentra antes que a las sincronas.
+"""
+from django.urls import path
+
+from productos import views_async
+
+from .urls import urlpatterns as urlpatterns_wsgi
+
+urlpatterns = [
+    path('productos/', views_async.productos, name='productos'),
+    path('producto/<int:id>/', views_async.producto_detalle, name='producto_detalle'),
+    path('carrito/agregar/<int:producto_id>/', views_async.agregar_al_carrito, name='agregar_al_carrito'),
+    path('carrito/actualizar/<int:item_id>/', views_async.actualizar_cantidad, name='actualizar_cantidad'),
+    path('carrito/eliminar/<int:item_id>/', views_async.eliminar_del_carrito, name='eliminar_del_carrito'),
+    path('carrito/contador/', views_async.contador_carrito, name='contador_carrito'),
+    *urlpatterns_wsgi,
+]
@@ -90,6 +90,7 @@ class CheckoutForm(forms.Form):
     )
 
     # Guardar dirección 
+    guardar_direccion = forms.BooleanField(required=False, initial=False)
 
     def __init__(self, *args, **kwargs):
         self.usuario = kwargs.pop('usuario', None)
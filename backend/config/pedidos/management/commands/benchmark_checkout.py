@@ -0,0 +1,93 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from pedidos.models import Pedido
+from productos.models import Carrito, ItemCarrito, Producto
+
+DATOS_CHECKOUT = {
+    'nombre_completo': 'Cliente Benchmark',
+    'telefono': '+56 9 1234 5678',
+    'direccion': 'Av. Siempre Viva 742',
+    'comuna': 'Providencia',
+    'region': 'Región Metropolitana',
+    'metodo_pago': 'webpay',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide latencia y numero de consultas de POST /pedidos/checkout/ segun el '
+        'tamaño del carrito. Cada checkout corre como en produccion, fuera de una '
+        'transaccion (la numeracion reserva bloques); al terminar se borran los '
+        'productos, usuarios, pedidos y sesiones creados. Los numeros de pedido '
+        'usados quedan como huecos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lineas', type=int, nargs='+', default=[1, 10, 50, 100])
+        parser.add_argument('--repeticiones', type=int, default=10)
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def handle(self, *args, **options):
+        repeticiones = options['repeticiones']
+        maximo = max(options['lineas'])
+        self.usuarios, self.sesiones = [], []
+
+        productos = Producto.objects.bulk_create(
+            Producto(
+                nombre=f'Benchmark {i}', categoria='Benchmark', descripcion='Producto de prueba',
+                precio=1000 + i, stock=10 ** 6, imagen='productos/perfume1.png',
+            )
+            for i in range(maximo)
+        )
+        try:
+            self.stdout.write(f'{"lineas":>7} {"p50 ms":>9} {"p95 ms":>9} {"consultas":>10}')
+            for lineas in options['lineas']:
+                tiempos, consultas = [], set()
+                for repeticion in range(repeticiones):
+                    cliente = self._cliente_con_carrito(f'bench-{lineas}-{repeticion}', productos[:lineas])
+                    with CaptureQueriesContext(connection) as capturadas:
+                        inicio = time.perf_counter()
+                        respuesta = cliente.post(reverse('checkout'), DATOS_CHECKOUT)
+                        tiempos.append((time.perf_counter() - inicio) * 1000)
+                    if respuesta.status_code != 302 or 'confirmacion' not in respuesta.url:
+                        self.stderr.write(f'Checkout fallido con {lineas} lineas: {respuesta.status_code}')
+                    consultas.add(len(capturadas))
+
+                tiempos.sort()
+                p95 = tiempos[max(0, int(len(tiempos) * 0.95) - 1)]
+                self.stdout.write(
+                    f'{lineas:>7} {statistics.median(tiempos):>9.2f} {p95:>9.2f} '
+                    f'{"/".join(str(c) for c in sorted(consultas)):>10}'
+                )
+        finally:
+            self._limpiar(productos)
+
+    def _cliente_con_carrito(self, username, productos):
+        usuario = User.objects.create_user(username)
+        self.usuarios.append(usuario.pk)
+        carrito = Carrito.objects.create(usuario=usuario)
+        ItemCarrito.objects.bulk_create(
+            ItemCarrito(carrito=carrito, producto=producto, cantidad=1) for producto in productos
+        )
+        cliente = Client()
+        cliente.force_login(usuario)
+        self.sesiones.append(cliente.session.session_key)
+        return cliente
+
+    def _limpiar(self, productos):
+        """Borra lo creado; los pedidos (y sus items) caen con los usuarios."""
+        with transaction.atomic():
+            pedidos = Pedido.objects.filter(usuario__in=self.usuarios).count()
+            Session.objects.filter(session_key__in=self.sesiones).delete()
+            User.objects.filter(pk__in=self.usuarios).delete()
+            Producto.objects.filter(pk__in=[producto.pk for producto in productos]).delete()
+        self.stdout.write(f'Pedidos creados (borrados): {pedidos}')
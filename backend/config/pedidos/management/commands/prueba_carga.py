@@ -0,0 +1,266 @@
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode, urljoin, urlsplit
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, Request, build_opener
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from config.rendimiento import percentil
+
+DATOS_CHECKOUT = {
+    'nombre_completo': 'Cliente Carga',
+    'telefono': '+56 9 1234 5678',
+    'direccion': 'Av. Siempre Viva 742',
+    'comuna': 'Providencia',
+    'region': 'Región Metropolitana',
+    'metodo_pago': 'webpay',
+}
+ORDENES = ('reciente', 'precio_menor', 'precio_mayor', 'nombre', 'mejor_valorados')
+
+PRODUCTO_RE = re.compile(r'/producto/(\d+)/')
+CATEGORIA_RE = re.compile(r'[?&]categoria=([^&"\']+)')
+ITEM_CARRITO_RE = re.compile(r'class="carrito-item" data-item-id="(\d+)"')
+AVISO_STOCK_RE = re.compile(r'suficiente stock|stock cambió')
+
+
+class SinRedirecciones(HTTPRedirectHandler):
+    """Las redirecciones se devuelven tal cual: a donde redirige el checkout es el resultado."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Registro:
+    """Latencias por endpoint, errores y resultados de los viajes; compartido entre hilos."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencias = defaultdict(list)
+        self.errores = Counter()
+        self.eventos = Counter()
+
+    def peticion(self, nombre, ms, error):
+        with self.lock:
+            self.latencias[nombre].append(ms)
+            if error:
+                self.errores[nombre] += 1
+
+    def evento(self, nombre):
+        with self.lock:
+            self.eventos[nombre] += 1
+
+
+class Viajero:
+    """Un visitante: su propio jar de cookies (sesion, CSRF) y su recorrido."""
+
+    def __init__(self, base, registro, rng, pausa, usuario, clave):
+        self.base = base
+        self.registro = registro
+        self.rng = rng
+        self.pausa = pausa
+        self.usuario = usuario
+        self.clave = clave
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies), SinRedirecciones)
+
+    def pensar(self):
+        if self.pausa > 0:
+            time.sleep(min(self.rng.expovariate(1 / self.pausa), self.pausa * 5))
+
+    def csrf(self):
+        return next((cookie.value for cookie in self.cookies if cookie.name == 'csrftoken'), '')
+
+    def pedir(self, nombre, ruta, datos=None, ajax=False):
+        """Devuelve ``(status, location, cuerpo)``; registra la latencia bajo ``nombre``."""
+        cabeceras = {'X-Requested-With': 'XMLHttpRequest'} if ajax else {}
+        cuerpo = None
+        if datos is not None:
+            datos = dict(datos, csrfmiddlewaretoken=self.csrf())
+            cuerpo = urlencode(datos).encode()
+            cabeceras['X-CSRFToken'] = self.csrf()
+            cabeceras['Referer'] = self.base + ruta
+        peticion = Request(urljoin(self.base, ruta), data=cuerpo, headers=cabeceras)
+
+        inicio = time.perf_counter()
+        try:
+            with self.opener.open(peticion, timeout=30) as respuesta:
+                status, location, contenido = respuesta.status, respuesta.headers.get('Location', ''), respuesta.read()
+        except HTTPError as exc:
+            status, location, contenido = exc.code, exc.headers.get('Location', ''), exc.read()
+        except (URLError, OSError):
+            status, location, contenido = 0, '', b''
+        ms = (time.perf_counter() - inicio) * 1000
+        self.registro.peticion(nombre, ms, error=status == 0 or status >= 400)
+        return status, urlsplit(location).path, contenido.decode('utf-8', 'replace')
+
+    def viaje(self):
+        """home -> catalogo filtrado -> detalles -> carrito -> login -> checkout."""
+        rng = self.rng
+        _, _, html = self.pedir('home', '/')
+        self.pensar()
+
+        _, _, html = self.pedir('productos', '/productos/')
+        categorias = sorted(set(CATEGORIA_RE.findall(html)))
+        filtros = {'orden': rng.choice(ORDENES)}
+        if categorias and rng.random() < 0.7:
+            filtros['categoria'] = rng.choice(categorias)
+        _, _, html = self.pedir('productos_filtrado', '/productos/?' + urlencode(filtros))
+        productos = list(dict.fromkeys(PRODUCTO_RE.findall(html)))
+        if not productos:
+            self.registro.evento('viajes sin productos')
+            return
+        self.pensar()
+
+        elegidos = rng.sample(productos, min(len(productos), rng.randint(1, 3)))
+        for producto in elegidos:
+            self.pedir('producto_detalle', f'/producto/{producto}/')
+            self.pensar()
+            status, _, respuesta = self.pedir('agregar_al_carrito', f'/carrito/agregar/{producto}/', {}, ajax=True)
+            if status == 200 and '"success": false' in respuesta:
+                self.registro.evento('sin stock al agregar')
+
+        _, _, html = self.pedir('ver_carrito', '/carrito/')
+        items = ITEM_CARRITO_RE.findall(html)
+        if items:
+            self.pedir('actualizar_cantidad', f'/carrito/actualizar/{rng.choice(items)}/', {'cantidad': 2})
+        self.pensar()
+
+        self.pedir('login', '/usuarios/login/')
+        status, _, _ = self.pedir(
+            'login_post', '/usuarios/login/?next=/pedidos/checkout/',
+            {'username': self.usuario, 'password': self.clave},
+        )
+        if status != 302:
+            self.registro.evento('login fallido')
+            return
+        self.pedir('checkout', '/pedidos/checkout/')
+        self.pensar()
+
+        status, destino, _ = self.pedir('checkout_post', '/pedidos/checkout/', DATOS_CHECKOUT)
+        if status == 302 and destino.startswith('/pedidos/confirmacion/'):
+            self.registro.evento('pedidos creados')
+            self.pedir('pedido_confirmacion', destino)
+        elif status == 302 and destino == '/carrito/':
+            # Stock insuficiente o carrito ya vacio (otro viaje con la misma
+            # cuenta compro primero): el checkout vuelve al carrito con un aviso
+            _, _, html = self.pedir('ver_carrito', destino)
+            if AVISO_STOCK_RE.search(html):
+                self.registro.evento('sin stock en checkout')
+            else:
+                self.registro.evento('carrito vacio en checkout')
+        elif status == 302:
+            # Cualquier otro error del checkout se muestra como mensaje en la pagina
+            _, _, html = self.pedir('checkout', destino)
+            if 'numero_pedido' in html:
+                self.registro.evento('colisiones de numero de pedido')
+            else:
+                self.registro.evento('checkout con error')
+        else:
+            self.registro.evento('checkout con error')
+
+
+class Command(BaseCommand):
+    help = (
+        'Prueba de carga de extremo a extremo contra un servidor en marcha: visitantes '
+        'concurrentes recorren home, catalogo filtrado, detalle, carrito, login y '
+        'checkout. Informa p50/p95/p99, throughput y errores por endpoint, ademas de '
+        'colisiones de numero de pedido y errores de stock. Crea pedidos reales.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000',
+                            help='Servidor a probar.')
+        parser.add_argument('--concurrencia', type=int, default=10,
+                            help='Visitantes simultaneos (un hilo cada uno).')
+        parser.add_argument('--duracion', type=float, default=60,
+                            help='Segundos de prueba; cada hilo termina su viaje en curso.')
+        parser.add_argument('--viajes', type=int, default=0,
+                            help='Si se indica, se detiene tras este numero de viajes en total.')
+        parser.add_argument('--pausa', type=float, default=1.0,
+                            help='Tiempo medio para pensar entre pasos (s, exponencial).')
+        parser.add_argument('--usuarios', nargs='*',
+                            help='Cuentas para el login (por defecto, las de sembrar_datos).')
+        parser.add_argument('--clave', default='vgl-sembrado',
+                            help='Contraseña de esas cuentas.')
+        parser.add_argument('--semilla', type=int, default=None)
+
+    def handle(self, *args, **options):
+        usuarios = options['usuarios'] or list(
+            User.objects.filter(username__startswith='cliente', is_active=True)
+            .order_by('pk').values_list('username', flat=True)[:1000]
+        )
+        if not usuarios:
+            raise CommandError('No hay cuentas para el login: usa --usuarios o ejecuta sembrar_datos.')
+
+        base = options['url'].rstrip('/')
+        registro = Registro()
+        rng_semillas = random.Random(options['semilla'])
+        fin = time.perf_counter() + options['duracion']
+        restantes = [options['viajes'] or None]
+        contador = threading.Lock()
+
+        def tomar_viaje():
+            with contador:
+                if restantes[0] is None:
+                    return time.perf_counter() < fin
+                if restantes[0] <= 0:
+                    return False
+                restantes[0] -= 1
+                return True
+
+        concurrencia = max(1, options['concurrencia'])
+
+        def trabajar(indice, semilla):
+            rng = random.Random(semilla)
+            # Cada hilo rota por su parte de las cuentas: con al menos tantas
+            # cuentas como hilos, dos viajes simultaneos no comparten carrito
+            cuentas = usuarios[indice::concurrencia] or usuarios
+            viaje = 0
+            while tomar_viaje():
+                usuario = cuentas[viaje % len(cuentas)]
+                viaje += 1
+                viajero = Viajero(base, registro, rng, options['pausa'], usuario, options['clave'])
+                try:
+                    viajero.viaje()
+                    registro.evento('viajes completados')
+                except Exception as exc:  # un viaje roto no detiene la prueba
+                    registro.evento(f'viajes interrumpidos ({type(exc).__name__})')
+
+        hilos = [
+            threading.Thread(target=trabajar, args=(indice, rng_semillas.getrandbits(32)), daemon=True)
+            for indice in range(concurrencia)
+        ]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.informar(registro, time.perf_counter() - inicio)
+
+    def informar(self, registro, duracion):
+        self.stdout.write(
+            f'{"endpoint":22} {"peticiones":>10} {"req/s":>8} {"p50 ms":>9} {"p95 ms":>9} '
+            f'{"p99 ms":>9} {"errores":>8}'
+        )
+        total = errores = 0
+        for nombre, latencias in sorted(registro.latencias.items()):
+            latencias.sort()
+            total += len(latencias)
+            errores += registro.errores[nombre]
+            self.stdout.write(
+                f'{nombre:22} {len(latencias):>10} {len(latencias) / duracion:>8.1f} '
+                f'{percentil(latencias, 50):>9.1f} {percentil(latencias, 95):>9.1f} '
+                f'{percentil(latencias, 99):>9.1f} {registro.errores[nombre] / len(latencias):>8.1%}'
+            )
+        self.stdout.write(
+            f'Total: {total} peticiones en {duracion:.1f}s ({total / duracion:.1f} req/s), '
+            f'{errores} con error HTTP o de red.'
+        )
+        for evento, cantidad in sorted(registro.eventos.items()):
+            self.stdout.write(f'  {evento}: {cantidad}')
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-18 10:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0002_contadorpedidos'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='direccionenvio',
+            index=models.Index(fields=['usuario', '-predeterminada', '-creada'], name='direccion_usuario_orden_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['usuario', '-creado'], name='pedido_usuario_creado_idx'),
+        ),
+    ]
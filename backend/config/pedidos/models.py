@@ -1,7 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from productos.models import Producto
-from django.utils import timezone
 
 
 
@@ -25,6 +26,9 @@ class DireccionEnvio(models.Model):
         verbose_name = "Dirección de Envío"
         verbose_name_plural = "Direcciones de Envío"
         ordering = ['-predeterminada', '-creada']
+        indexes = [
+            models.Index(fields=['usuario', '-predeterminada', '-creada'], name='direccion_usuario_orden_idx'),
+        ]
 
     def __str__(self):
         return f'{self.nombre_completo} - {self.comuna}, {self.region}'
@@ -35,6 +39,44 @@ class DireccionEnvio(models.Model):
             DireccionEnvio.objects.filter(usuario=self.usuario, predeterminada=True).update(predeterminada=False)
         super().save(*args, **kwargs)
 
+class ContadorPedidos(models.Model):
+    """Ultimo correlativo de numero de pedido entregado en cada dia (ver ``numeracion``)."""
+    fecha = models.DateField(unique=True)
+    ultimo = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Contador de Pedidos"
+        verbose_name_plural = "Contadores de Pedidos"
+
+    def __str__(self):
+        return f'{self.fecha}: {self.ultimo}'
+
+# Envio en CLP, gratis desde ENVIO_GRATIS_DESDE (checkout y sembrar_datos)
+COSTO_ENVIO = 5000
+ENVIO_GRATIS_DESDE = 50000
+
+
+def costo_envio(subtotal):
+    return 0 if subtotal >= ENVIO_GRATIS_DESDE else COSTO_ENVIO
+
+
+class PedidoQuerySet(models.QuerySet):
+
+    def con_total_items(self):
+        """
+        Anota ``num_items`` (unidades del pedido) con una subconsulta por fila.
+
+        Al ser correlacionada no agrupa ni cambia el orden de la consulta:
+        ``usuario, -creado`` sigue saliendo del indice y con LIMIT solo se
+        calcula para los pedidos de la pagina.
+        """
+        unidades = (
+            ItemPedido.objects.filter(pedido=OuterRef('pk')).order_by()
+            .values('pedido').annotate(total=Sum('cantidad')).values('total')
+        )
+        return self.annotate(num_items=Coalesce(Subquery(unidades), Value(0)))
+
+
 class Pedido(models.Model):
     """Pedido realizado por un usuario."""
 
@@ -94,18 +136,20 @@ class Pedido(models.Model):
         verbose_name = "Pedido"
         verbose_name_plural = "Pedidos"
         ordering = ['-creado']
+        indexes = [
+            models.Index(fields=['usuario', '-creado'], name='pedido_usuario_creado_idx'),
+        ]
+
+    objects = PedidoQuerySet.as_manager()
 
     def __str__(self):
         return f'Pedido #{self.numero_pedido} - {self.usuario.username}'
     
     def save(self, *args, **kwargs):
         if not self.numero_pedido:
-            # Generar número de pedido único
-            import random
-            import string
-            timestamp = timezone.now().strftime('%Y%m%d')
-            random_suffix = ''.join(random.choices(string.digits, k=4))
-            self.numero_pedido = f'VGL{timestamp}{random_suffix}'
+            # Correlativo del dia, unico entre procesos (sin reintentos)
+            from .numeracion import siguiente_numero_pedido
+            self.numero_pedido = siguiente_numero_pedido()
         super().save(*args, **kwargs)
 
     @property
@@ -121,6 +165,9 @@ class Pedido(models.Model):
     
     @property
     def total_items(self):
+        # Anotado en la consulta (con_total_items) o sumado de los items
+        if 'num_items' in self.__dict__:
+            return self.num_items
         return sum(item.cantidad for item in self.items.all())
         
 class ItemPedido(models.Model):
@@ -0,0 +1,109 @@
+"""
+Numeros de pedido ``VGL<AAAAMMDD><correlativo>`` sin colisiones.
+
+Cada dia tiene una fila en ``ContadorPedidos``. Un proceso reserva un bloque
+de correlativos con una sola sentencia atomica
+(``INSERT ... ON CONFLICT DO UPDATE SET ultimo = ultimo + n RETURNING ultimo``)
+y luego los entrega desde memoria. Dos procesos nunca reciben el mismo
+bloque, asi que no hace falta comprobar unicidad ni reintentar.
+
+Los bloques se piden en autocommit. Dentro de una transaccion no se piden:
+si la transaccion se deshace, el contador vuelve atras y otro proceso
+recibiria los mismos numeros. En ese caso se reserva un solo numero dentro de
+la propia transaccion (se deshace junto con el pedido). Por eso el checkout
+pide el numero antes de abrir su transaccion.
+
+Los numeros crecen dentro de cada proceso, pero puede haber huecos: los
+restos de bloque de un proceso que termina y los numeros de pedidos
+fallidos no se reutilizan.
+"""
+import os
+import threading
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .models import ContadorPedidos
+
+PREFIJO = 'VGL'
+
+
+def _tamano_bloque():
+    return getattr(settings, 'PEDIDOS_BLOQUE_NUMEROS', 100)
+
+
+def prefijo(fecha):
+    return f'{PREFIJO}{fecha:%Y%m%d}'
+
+
+def formatear(fecha, correlativo):
+    # 'VGL' + 8 digitos de fecha + al menos 6 de correlativo (max_length=20)
+    return f'{prefijo(fecha)}{correlativo:06d}'
+
+
+def reservar(fecha, cantidad, using='default'):
+    """
+    Reserva ``cantidad`` correlativos de ``fecha`` y devuelve ``(primero, ultimo)``.
+
+    Una sola sentencia, atomica en SQLite (>= 3.35) y PostgreSQL.
+    """
+    conexion = connections[using]
+    tabla = conexion.ops.quote_name(ContadorPedidos._meta.db_table)
+    sql = (
+        f'INSERT INTO {tabla} (fecha, ultimo) VALUES (%s, %s) '
+        f'ON CONFLICT (fecha) DO UPDATE SET ultimo = {tabla}.ultimo + excluded.ultimo '
+        f'RETURNING ultimo'
+    )
+    with conexion.cursor() as cursor:
+        cursor.execute(sql, [conexion.ops.adapt_datefield_value(fecha), cantidad])
+        ultimo = cursor.fetchone()[0]
+    return ultimo - cantidad + 1, ultimo
+
+
+class AsignadorNumeros:
+    """Entrega numeros de pedido desde un bloque reservado por el proceso."""
+
+    def __init__(self, tamano_bloque=None, using='default'):
+        self.tamano_bloque = tamano_bloque
+        self.using = using
+        self._lock = threading.Lock()
+        # (pid, fecha, prefijo, siguiente, ultimo); el pid descarta bloques heredados por fork
+        self._bloque = (None, None, '', 1, 0)
+
+    def _tomar(self, fecha):
+        """Siguiente numero del bloque vigente, o None si no queda."""
+        with self._lock:
+            pid, fecha_bloque, prefijo_bloque, siguiente, ultimo = self._bloque
+            if pid != os.getpid() or fecha_bloque != fecha or siguiente > ultimo:
+                return None
+            self._bloque = (pid, fecha_bloque, prefijo_bloque, siguiente + 1, ultimo)
+        return f'{prefijo_bloque}{siguiente:06d}'
+
+    def siguiente(self):
+        fecha = timezone.now().date()
+        numero = self._tomar(fecha)
+        if numero is not None:
+            return numero
+
+        if connections[self.using].in_atomic_block:
+            correlativo, _ = reservar(fecha, 1, using=self.using)
+            return formatear(fecha, correlativo)
+
+        # La reserva se hace sin el lock: otro hilo puede estar dentro de una
+        # transaccion esperando el lock mientras retiene la base de datos
+        primero, ultimo = reservar(fecha, self.tamano_bloque or _tamano_bloque(), using=self.using)
+        with self._lock:
+            pid, fecha_bloque, _, siguiente, ultimo_actual = self._bloque
+            if pid != os.getpid() or fecha_bloque != fecha or siguiente > ultimo_actual:
+                self._bloque = (os.getpid(), fecha, prefijo(fecha), primero + 1, ultimo)
+            # Si otro hilo ya repuso el bloque, el resto de este queda como hueco
+        return formatear(fecha, primero)
+
+
+_asignador = AsignadorNumeros()
+
+
+def siguiente_numero_pedido():
+    """Numero de pedido nuevo; conviene pedirlo fuera de ``transaction.atomic()``."""
+    return _asignador.siguiente()
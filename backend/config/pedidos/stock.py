@@ -0,0 +1,110 @@
+"""
+Reserva y devolucion de stock con UPDATE condicionales.
+
+``UPDATE ... SET stock = stock - n WHERE id IN (...) AND stock >= n`` es
+atomico en la base de datos: dos checkouts concurrentes no pueden vender la
+misma unidad, y solo se escriben las columnas ``stock`` y ``actualizado``
+del producto. Todas las lineas de un pedido se aplican en una sola
+sentencia con ``CASE id``.
+"""
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from productos.models import CAMPOS_SOLO_STOCK, Producto, productos_actualizados
+
+
+class StockInsuficiente(Exception):
+    """Algunos productos no tenian stock suficiente; ``faltantes`` los detalla."""
+
+    def __init__(self, faltantes):
+        self.faltantes = faltantes
+        super().__init__(', '.join(f['nombre'] for f in faltantes))
+
+    def mensajes(self):
+        if not self.faltantes:
+            # El stock cambio entre el UPDATE y la lectura posterior
+            return ['El stock cambió mientras se procesaba el pedido. Inténtalo de nuevo.']
+        return [
+            f"No hay suficiente stock de {f['nombre']} "
+            f"(pediste {f['solicitado']}, disponibles {f['disponible']})."
+            for f in self.faltantes
+        ]
+
+
+def _descontar(cantidades):
+    """
+    UPDATE ... SET stock = stock - CASE id ... END, actualizado = ahora
+    WHERE id IN (...) AND stock >= CASE id ... END
+
+    Se arma a mano: con cientos de lineas, compilar el equivalente
+    Case(When(...)) del ORM cuesta mas que ejecutar la sentencia.
+    Devuelve el numero de filas actualizadas.
+    """
+    tabla = connection.ops.quote_name(Producto._meta.db_table)
+    caso = 'CASE id ' + ' '.join(['WHEN %s THEN %s'] * len(cantidades)) + ' END'
+    parametros_caso = [valor for linea in cantidades.items() for valor in linea]
+    ids = list(cantidades)
+    ahora = connection.ops.adapt_datetimefield_value(timezone.now())
+    sql = (
+        f'UPDATE {tabla} SET stock = stock - {caso}, actualizado = %s '
+        f'WHERE id IN ({", ".join(["%s"] * len(ids))}) AND stock >= {caso}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, parametros_caso + [ahora] + ids + parametros_caso)
+        return cursor.rowcount
+
+
+def reservar_stock(lineas):
+    """
+    Descuenta el stock de cada ``(producto, cantidad)`` con un solo UPDATE.
+
+    Debe llamarse dentro de ``transaction.atomic()``. El UPDATE solo toca
+    las filas con stock suficiente; si el numero de filas actualizadas no
+    coincide con el de productos se lanza ``StockInsuficiente`` con todas
+    las lineas que no alcanzan y el bloque atomico deshace el descuento.
+    """
+    productos = {}
+    cantidades = {}
+    for producto, cantidad in lineas:
+        productos[producto.pk] = producto
+        cantidades[producto.pk] = cantidades.get(producto.pk, 0) + cantidad
+    if not cantidades:
+        return
+
+    punto = transaction.savepoint()
+    actualizados = _descontar(cantidades)
+
+    if actualizados != len(cantidades):
+        # Deshacer el descuento parcial y leer el stock para reportar que
+        # lineas no alcanzan
+        transaction.savepoint_rollback(punto)
+        stock_actual = dict(Producto.objects.filter(pk__in=cantidades).values_list('pk', 'stock'))
+        raise StockInsuficiente([
+            {
+                'producto_id': producto_id,
+                'nombre': productos[producto_id].nombre,
+                'solicitado': solicitado,
+                'disponible': stock_actual.get(producto_id, 0),
+            }
+            for producto_id, solicitado in cantidades.items()
+            if stock_actual.get(producto_id, 0) < solicitado
+        ])
+
+    transaction.savepoint_commit(punto)
+    # El UPDATE a mano no pasa por ProductoQuerySet.update(): avisar igual
+    productos_actualizados.send(sender=Producto, ids=list(cantidades), campos=CAMPOS_SOLO_STOCK)
+
+
+def devolver_stock(lineas):
+    """Devuelve al stock las cantidades de ``(producto_id, cantidad)`` con un solo UPDATE."""
+    cantidades = {}
+    for producto_id, cantidad in lineas:
+        cantidades[producto_id] = cantidades.get(producto_id, 0) + cantidad
+    if not cantidades:
+        return
+    # update() marca actualizado y olvida los productos cacheados (los listados siguen valiendo)
+    Producto.objects.filter(pk__in=cantidades).update(stock=F('stock') + Case(
+        *(When(pk=producto_id, then=Value(cantidad)) for producto_id, cantidad in cantidades.items()),
+        output_field=IntegerField(),
+    ))
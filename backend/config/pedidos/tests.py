@@ -1,3 +1,473 @@
-from django.test import TestCase
+import multiprocessing
+import os
+import threading
+import unittest
+from array import array
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import Client, LiveServerTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from config import rendimiento
+from productos.models import Carrito, ItemCarrito, Producto, Resena, Testimonio
+from productos.tests import AJAX, PlanesConsultaMixin
+from .models import ContadorPedidos, DireccionEnvio, ItemPedido, Pedido
+from .numeracion import AsignadorNumeros
+from .stock import StockInsuficiente, reservar_stock
+
+DATOS_CHECKOUT = {
+    'nombre_completo': 'Cliente Prueba',
+    'telefono': '+56 9 1234 5678',
+    'direccion': 'Av. Siempre Viva 742',
+    'comuna': 'Providencia',
+    'region': 'Región Metropolitana',
+    'metodo_pago': 'webpay',
+}
+
+
+def crear_producto(**kwargs):
+    datos = {
+        'nombre': 'Perfume', 'categoria': 'Perfumes', 'descripcion': 'Descripcion',
+        'precio': 10000, 'stock': 10, 'imagen': 'productos/perfume1.png',
+    }
+    datos.update(kwargs)
+    return Producto.objects.create(**datos)
+
+
+def generar_numeros(args):
+    """Proceso hijo: ``hilos`` hilos generan ``cantidad`` numeros en total."""
+    cantidad, hilos, tamano_bloque = args
+    asignador = AsignadorNumeros(tamano_bloque)
+    lotes = []
+
+    def trabajar(n):
+        try:
+            lotes.append([asignador.siguiente() for _ in range(n)])
+        finally:
+            connection.close()
+
+    trabajadores = [threading.Thread(target=trabajar, args=(cantidad // hilos,)) for _ in range(hilos)]
+    for trabajador in trabajadores:
+        trabajador.start()
+    for trabajador in trabajadores:
+        trabajador.join()
+    # 'VGL' fuera; fecha + correlativo (>= 6 digitos) como entero es inyectivo
+    return array('q', (int(numero[3:]) for lote in lotes for numero in lote))
+
+
+def crear_cliente_con_carrito(username, lineas):
+    """Usuario con sesion iniciada y un carrito con ``(producto, cantidad)``."""
+    usuario = User.objects.create_user(username)
+    carrito = Carrito.objects.create(usuario=usuario)
+    for producto, cantidad in lineas:
+        ItemCarrito.objects.create(carrito=carrito, producto=producto, cantidad=cantidad)
+    cliente = Client()
+    cliente.force_login(usuario)
+    return usuario, cliente
+
+
+class CheckoutStockTests(TestCase):
+
+    def test_checkout_descuenta_stock(self):
+        producto = crear_producto(stock=5)
+        antes = producto.actualizado
+        usuario, cliente = crear_cliente_con_carrito('ana', [(producto, 2)])
+
+        respuesta = cliente.post(reverse('checkout'), DATOS_CHECKOUT)
+
+        pedido = Pedido.objects.get(usuario=usuario)
+        self.assertRedirects(respuesta, reverse('pedido_confirmacion', args=[pedido.id]))
+        producto.refresh_from_db()
+        self.assertEqual(producto.stock, 3)
+        # El UPDATE de stock escrito a mano tambien marca el producto
+        self.assertGreater(producto.actualizado, antes)
+        self.assertFalse(ItemCarrito.objects.filter(carrito__usuario=usuario).exists())
+
+    def test_reserva_reporta_cada_producto_sin_stock_y_deshace_el_resto(self):
+        escaso = crear_producto(nombre='Escaso', stock=2)
+        agotado = crear_producto(nombre='Agotado', stock=0)
+        sobrado = crear_producto(nombre='Sobrado', stock=50)
+
+        with self.assertRaises(StockInsuficiente) as contexto:
+            with transaction.atomic():
+                reservar_stock([(sobrado, 1), (escaso, 3), (agotado, 1)])
+
+        self.assertEqual(
+            [(f['nombre'], f['solicitado'], f['disponible']) for f in contexto.exception.faltantes],
+            [('Escaso', 3, 2), ('Agotado', 1, 0)],
+        )
+        self.assertEqual(len(contexto.exception.mensajes()), 2)
+        sobrado.refresh_from_db()
+        self.assertEqual(sobrado.stock, 50)
+
+    def test_cancelar_pedido_devuelve_stock(self):
+        producto = crear_producto(stock=5)
+        usuario, cliente = crear_cliente_con_carrito('carla', [(producto, 2)])
+        cliente.post(reverse('checkout'), DATOS_CHECKOUT)
+        pedido = Pedido.objects.get(usuario=usuario)
+
+        cliente.get(reverse('cancelar_pedido', args=[pedido.id]))
+
+        producto.refresh_from_db()
+        self.assertEqual(producto.stock, 5)
+
+
+class CheckoutConsultasTests(TestCase):
+    """El numero de consultas del checkout no depende del numero de lineas."""
+
+    def consultas_checkout(self, username, lineas):
+        productos = [crear_producto(nombre=f'{username} {i}') for i in range(lineas)]
+        usuario, cliente = crear_cliente_con_carrito(username, [(p, 1) for p in productos])
+        with CaptureQueriesContext(connection) as get:
+            cliente.get(reverse('checkout'))
+        with CaptureQueriesContext(connection) as post:
+            respuesta = cliente.post(reverse('checkout'), DATOS_CHECKOUT)
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertEqual(ItemPedido.objects.filter(pedido__usuario=usuario).count(), lineas)
+        return len(get), len(post)
+
+    def test_consultas_constantes(self):
+        self.assertEqual(self.consultas_checkout('uno', 1), self.consultas_checkout('cien', 100))
+
+    def consultas_cancelacion(self, username, lineas):
+        productos = [crear_producto(nombre=f'{username} {i}', stock=5) for i in range(lineas)]
+        usuario, cliente = crear_cliente_con_carrito(username, [(p, 2) for p in productos])
+        cliente.post(reverse('checkout'), DATOS_CHECKOUT)
+        pedido = Pedido.objects.get(usuario=usuario)
+        with CaptureQueriesContext(connection) as consultas:
+            cliente.get(reverse('cancelar_pedido', args=[pedido.id]))
+        self.assertEqual(sorted(Producto.objects.filter(pk__in=[p.pk for p in productos])
+                                .values_list('stock', flat=True).distinct()), [5])
+        return len(consultas)
+
+    def test_cancelacion_con_consultas_constantes(self):
+        self.assertEqual(self.consultas_cancelacion('uno', 1), self.consultas_cancelacion('cien', 100))
+
+
+class CheckoutConcurrenteTests(TransactionTestCase):
+    """Checkouts en paralelo contra un producto escaso no pueden sobrevender."""
+
+    HILOS = 12
+    STOCK = 4
+
+    def test_checkouts_paralelos_no_sobrevenden(self):
+        producto = crear_producto(stock=self.STOCK)
+        clientes = [
+            crear_cliente_con_carrito(f'cliente{i}', [(producto, 1)])[1]
+            for i in range(self.HILOS)
+        ]
+        barrera = threading.Barrier(self.HILOS)
+        errores = []
+
+        def comprar(cliente):
+            try:
+                barrera.wait()
+                cliente.post(reverse('checkout'), DATOS_CHECKOUT)
+            except Exception as exc:  # pragma: no cover - se reporta abajo
+                errores.append(exc)
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=comprar, args=(cliente,)) for cliente in clientes]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(errores, [])
+        producto.refresh_from_db()
+        vendidos = sum(ItemPedido.objects.filter(producto=producto).values_list('cantidad', flat=True))
+        self.assertGreaterEqual(producto.stock, 0)
+        self.assertLessEqual(vendidos, self.STOCK)
+        self.assertEqual(vendidos + producto.stock, self.STOCK)
+        self.assertEqual(Pedido.objects.count(), vendidos)
+
+
+class NumeroPedidoTests(TestCase):
+
+    def test_formato_y_correlativo(self):
+        producto = crear_producto()
+        usuario, cliente = crear_cliente_con_carrito('diana', [(producto, 1)])
+        cliente.post(reverse('checkout'), DATOS_CHECKOUT)
+        pedido = Pedido.objects.get(usuario=usuario)
+
+        self.assertRegex(pedido.numero_pedido, r'^VGL\d{8}\d{6}$')
+        self.assertLessEqual(len(pedido.numero_pedido), 20)
+
+    def test_dentro_de_una_transaccion_no_reserva_bloques(self):
+        # Un bloque reservado dentro de una transaccion que luego se deshace
+        # volveria a entregarse a otro proceso
+        asignador = AsignadorNumeros(tamano_bloque=1000)
+        primero, segundo = asignador.siguiente(), asignador.siguiente()
+
+        self.assertEqual(int(segundo[-6:]), int(primero[-6:]) + 1)
+        self.assertEqual(ContadorPedidos.objects.get().ultimo, int(segundo[-6:]))
+
+
+class NumeroPedidoConcurrenteTests(TransactionTestCase):
+    """Varios procesos con varios hilos generan millones de numeros sin repetir."""
+
+    PROCESOS = 4
+    HILOS = 4
+    TOTAL = 2_000_000
+    BLOQUE = 1000
+
+    def test_numeros_unicos_entre_procesos(self):
+        # Cada hijo abre su propia conexion; no heredar la del padre
+        connection.close()
+        contexto = multiprocessing.get_context('fork')
+        por_proceso = self.TOTAL // self.PROCESOS
+        with contexto.Pool(self.PROCESOS) as pool:
+            resultados = pool.map(
+                generar_numeros,
+                [(por_proceso, self.HILOS, self.BLOQUE)] * self.PROCESOS,
+            )
+
+        generados = sum(len(numeros) for numeros in resultados)
+        unicos = set()
+        for numeros in resultados:
+            unicos.update(numeros)
+        self.assertEqual(generados, self.TOTAL)
+        self.assertEqual(len(unicos), self.TOTAL)
+        # Todos los numeros salieron de bloques reservados en el contador
+        reservados = sum(ContadorPedidos.objects.values_list('ultimo', flat=True))
+        self.assertLessEqual(self.TOTAL, reservados)
+
+
+class MisPedidosTests(TestCase):
+
+    def test_historial_paginado_con_unidades_anotadas(self):
+        productos = [crear_producto(nombre=f'Perfume {i}') for i in range(3)]
+        usuario = User.objects.create_user('fiel')
+        pedidos = Pedido.objects.bulk_create(
+            Pedido(numero_pedido=f'VGL-HISTORIAL-{i}', usuario=usuario, nombre_completo='Cliente Prueba',
+                   telefono='+56 9 1234 5678', direccion='Calle 1', comuna='Providencia',
+                   region='Región Metropolitana', subtotal=30000, total=30000)
+            for i in range(25)
+        )
+        ItemPedido.objects.bulk_create(
+            ItemPedido(pedido=pedido, producto=producto, nombre_producto=producto.nombre,
+                       precio_unitario=producto.precio, cantidad=i + 1)
+            for i, pedido in enumerate(pedidos)
+            for producto in productos[:1 + i % 3]
+        )
+        self.client.force_login(usuario)
+
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(reverse('mis_pedidos'), {'page': 3})
+
+        pagina = respuesta.context['pedidos']
+        self.assertEqual((pagina.number, pagina.paginator.num_pages, len(pagina)), (3, 3, 5))
+        # Cada pedido i tiene 1 + i % 3 lineas de i + 1 unidades
+        esperado = {pedido.pk: (1 + i % 3) * (i + 1) for i, pedido in enumerate(pedidos)}
+        self.assertEqual({pedido.pk: pedido.total_items for pedido in pagina},
+                         {pedido.pk: esperado[pedido.pk] for pedido in pagina})
+        self.assertContains(respuesta, 'Página 3 de 3')
+        # La direccion va rotulada como destino; los productos se ven en el detalle
+        self.assertContains(respuesta, 'Envío a Providencia, Región Metropolitana', count=5)
+        primero = pagina[0]
+        self.assertContains(respuesta, f'{primero.total_items} productos')
+        self.assertContains(respuesta, f'href="{reverse("detalle_pedido", args=[primero.id])}"', count=2)
+        # Las unidades salen de la subconsulta: ninguna consulta lee los items por separado
+        self.assertFalse(any(c['sql'].startswith('SELECT "pedidos_itempedido"') for c in consultas.captured_queries))
+        self.assertEqual(
+            [pedido.pk for pedido in pagina],
+            list(Pedido.objects.filter(usuario=usuario).order_by('-creado').values_list('pk', flat=True)[20:]),
+        )
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN es de SQLite')
+class PlanesConsultaPedidosTests(PlanesConsultaMixin, TestCase):
+    """Las consultas de las vistas de pedidos usan indices."""
+
+    def test_vistas_de_pedidos(self):
+        productos = [crear_producto(nombre=f'Perfume {i}') for i in range(3)]
+        usuario, cliente = crear_cliente_con_carrito('elena', [(producto, 1) for producto in productos])
+        cliente.post(reverse('checkout'), DATOS_CHECKOUT)
+        pedido = Pedido.objects.get(usuario=usuario)
+        ItemCarrito.objects.create(carrito=Carrito.objects.get(usuario=usuario), producto=productos[0])
+
+        for url in (
+            reverse('checkout'),
+            reverse('mis_pedidos'),
+            reverse('detalle_pedido', args=[pedido.id]),
+            reverse('pedido_confirmacion', args=[pedido.id]),
+            reverse('mis_direcciones'),
+        ):
+            with self.subTest(url=url):
+                self.comprobar_planes(url, cliente)
+
+
+class RendimientoVistasTests(TestCase):
+    """
+    Presupuesto de consultas (y, opcionalmente, de tiempo) de cada vista
+    sobre un conjunto de datos grande; ver ``config/rendimiento.py``.
+    """
+
+    PRODUCTOS = int(os.environ.get('VGL_RENDIMIENTO_PRODUCTOS', 5000))
+    # Categorias de tamaño muy desigual, como en la tienda
+    CATEGORIAS = ('Perfumes',) * 8 + ('Cremas',) * 4 + ('Maquillaje',) * 2 + ('Cabello', 'Accesorios')
+    PEDIDOS = 300
+    LINEAS_CARRITO = 20
+    STOCK = 10 ** 6
+
+    @classmethod
+    def setUpTestData(cls):
+        productos = Producto.objects.bulk_create(
+            Producto(
+                nombre=f'Producto {i}', categoria=cls.CATEGORIAS[i % len(cls.CATEGORIAS)],
+                descripcion='Descripcion del producto', precio=990 + (i * 7919) % 90000,
+                stock=cls.STOCK, imagen='productos/perfume1.png', activo=i % 20 != 0,
+                rating_avg=(i % 50) / 10, rating_count=i % 30,
+            )
+            for i in range(cls.PRODUCTOS)
+        )
+        cls.productos = [producto for producto in productos if producto.activo]
+        cls.producto = cls.productos[0]
+
+        resenadores = User.objects.bulk_create(User(username=f'resenador{i}') for i in range(100))
+        Resena.objects.bulk_create(
+            Resena(producto=cls.producto, usuario=usuario, calificacion=1 + i % 5,
+                   comentario='Comentario', aprobada=i % 4 != 0)
+            for i, usuario in enumerate(resenadores)
+        )
+        Testimonio.objects.bulk_create(
+            Testimonio(nombre=f'Cliente {i}', comentario='Excelente', destacado=i % 2 == 0)
+            for i in range(30)
+        )
+
+        cls.usuario = User.objects.create_user('medidor')
+        DireccionEnvio.objects.bulk_create(
+            DireccionEnvio(usuario=cls.usuario, nombre_completo='Cliente Prueba', telefono='+56 9 1234 5678',
+                           direccion=f'Calle {i}', comuna='Providencia', region='Región Metropolitana',
+                           predeterminada=i == 0)
+            for i in range(5)
+        )
+        pedidos = Pedido.objects.bulk_create(
+            Pedido(numero_pedido=f'VGL-RENDIMIENTO-{i}', usuario=cls.usuario, nombre_completo='Cliente Prueba',
+                   telefono='+56 9 1234 5678', direccion='Calle 1', comuna='Providencia',
+                   region='Región Metropolitana', subtotal=30000, total=30000)
+            for i in range(cls.PEDIDOS)
+        )
+        ItemPedido.objects.bulk_create(
+            ItemPedido(pedido=pedido, producto=producto, nombre_producto=producto.nombre,
+                       precio_unitario=producto.precio, cantidad=1)
+            for i, pedido in enumerate(pedidos)
+            for producto in cls.productos[i % 100:i % 100 + 3]
+        )
+        cls.pedido = pedidos[0]
+        cls.carrito = Carrito.objects.create(usuario=cls.usuario)
+
+    def setUp(self):
+        self.cliente = Client()
+        self.cliente.force_login(self.usuario)
+        self.llenar_carrito()
+
+    def llenar_carrito(self):
+        ItemCarrito.objects.filter(carrito=self.carrito).delete()
+        self.items = ItemCarrito.objects.bulk_create(
+            ItemCarrito(carrito=self.carrito, producto=producto, cantidad=1)
+            for producto in self.productos[1:self.LINEAS_CARRITO + 1]
+        )
+
+    def escenarios(self):
+        """``{nombre: (peticion, preparar)}``; ``preparar`` deja el estado igual antes de cada vuelta."""
+        anonimo, cliente = self.client, self.cliente
+        catalogo = reverse('productos')
+        ordenes = ('reciente', 'precio_menor', 'precio_mayor', 'nombre', 'mejor_valorados')
+
+        def get(cliente, url, **extra):
+            return lambda: cliente.get(url, **extra)
+
+        def sin_linea():
+            ItemCarrito.objects.filter(carrito=self.carrito, producto=self.producto).delete()
+
+        escenarios = {
+            'home': (get(anonimo, reverse('home')), None),
+            'home_usuario': (get(cliente, reverse('home')), None),
+            'productos': (get(anonimo, catalogo), None),
+            'productos_categoria': (get(anonimo, catalogo + '?categoria=Cremas'), None),
+            'productos_busqueda': (get(anonimo, catalogo + '?q=producto 12'), None),
+            'productos_pagina': (get(anonimo, catalogo + '?page=20'), None),
+            'productos_cursor': (get(anonimo, catalogo + '?paginacion=cursor&orden=precio_menor'), None),
+            'producto_detalle': (get(anonimo, reverse('producto_detalle', args=[self.producto.id])), None),
+            'ver_carrito': (get(cliente, reverse('ver_carrito')), None),
+            'contador_carrito': (get(cliente, reverse('contador_carrito'), **AJAX), None),
+            'agregar_al_carrito': (
+                lambda: cliente.post(reverse('agregar_al_carrito', args=[self.producto.id]), **AJAX),
+                sin_linea,
+            ),
+            'agregar_al_carrito_existente': (
+                lambda: cliente.post(reverse('agregar_al_carrito', args=[self.items[0].producto_id]), **AJAX),
+                None,
+            ),
+            'actualizar_cantidad': (
+                lambda: cliente.post(reverse('actualizar_cantidad', args=[self.items[0].id]), {'cantidad': 2}),
+                None,
+            ),
+            'eliminar_del_carrito': (
+                lambda: cliente.post(reverse('eliminar_del_carrito', args=[self.items[0].id]), **AJAX),
+                self.llenar_carrito,
+            ),
+            'vaciar_carrito': (get(cliente, reverse('vaciar_carrito')), self.llenar_carrito),
+            'checkout_get': (get(cliente, reverse('checkout')), None),
+            'checkout_post': (lambda: cliente.post(reverse('checkout'), DATOS_CHECKOUT), self.llenar_carrito),
+            'mis_pedidos': (get(cliente, reverse('mis_pedidos')), None),
+            'detalle_pedido': (get(cliente, reverse('detalle_pedido', args=[self.pedido.id])), None),
+            'mis_direcciones': (get(cliente, reverse('mis_direcciones')), None),
+        }
+        for orden in ordenes:
+            escenarios[f'productos_orden_{orden}'] = (get(anonimo, f'{catalogo}?orden={orden}'), None)
+            escenarios[f'productos_categoria_orden_{orden}'] = (
+                get(anonimo, f'{catalogo}?categoria=Perfumes&orden={orden}'), None,
+            )
+        return escenarios
+
+    def test_presupuestos(self):
+        base = rendimiento.cargar_base()
+        mediciones, errores = {}, []
+        for nombre, (peticion, preparar) in sorted(self.escenarios().items()):
+            def preparar_en_frio(preparar=preparar):
+                # Se mide el peor caso: sin nada en la cache del catalogo
+                cache.clear()
+                if preparar is not None:
+                    preparar()
+
+            medicion, respuesta = rendimiento.medir(peticion, preparar_en_frio)
+            self.assertIn(respuesta.status_code, (200, 302), nombre)
+            if nombre == 'productos_busqueda':
+                # Sin coincidencias (p. ej. indice sin triggers) se mediria una pagina vacia
+                self.assertTrue(respuesta.context['productos'], nombre)
+            mediciones[nombre] = medicion
+            errores += rendimiento.excesos(nombre, medicion, base.get(nombre))
+
+        if rendimiento.grabar_activado():
+            rendimiento.grabar_base(mediciones)
+        else:
+            self.assertEqual(errores, [], '\n'.join(errores))
+
+
+class PruebaCargaTests(LiveServerTestCase):
+    """El generador de carga completa viajes reales contra un servidor en marcha."""
+
+    def test_viajes_completos(self):
+        for i in range(5):
+            crear_producto(nombre=f'Perfume {i}', stock=1000)
+        for nombre in ('comprador1', 'comprador2'):
+            User.objects.create_user(nombre, password='clave-carga')
+        salida = StringIO()
+
+        call_command('prueba_carga', url=self.live_server_url, concurrencia=2, viajes=4, pausa=0,
+                     usuarios=['comprador1', 'comprador2'], clave='clave-carga', semilla=1, stdout=salida)
+
+        informe = salida.getvalue()
+        self.assertIn('pedidos creados: 4', informe)
+        self.assertIn('viajes completados: 4', informe)
+        self.assertRegex(informe, r'checkout_post\s+4\s')
+        self.assertNotIn('colisiones', informe)
+        self.assertEqual(Pedido.objects.count(), 4)
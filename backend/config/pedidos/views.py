@@ -1,26 +1,35 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.core.paginator import Paginator
 from django.db import transaction
 from django.utils import timezone
-from .models import Pedido, DireccionEnvio,  ItemPedido
+from .models import ENVIO_GRATIS_DESDE, Pedido, DireccionEnvio,  ItemPedido, costo_envio
 from .forms import DireccionEnvioForm, CheckoutForm
-from productos.models import Carrito
+from productos.models import Carrito, ItemCarrito
 from productos.views import obtener_carrito
+from productos.carrito import recordar_total_items
+from .stock import StockInsuficiente, devolver_stock, reservar_stock
+from .numeracion import siguiente_numero_pedido
+
+PEDIDOS_POR_PAGINA = 10
 
 # Create your views here.
 @login_required
 def checkout(request):
     """Vista del proceso de checkout."""
     carrito = obtener_carrito(request)
+    # El carrito se carga una sola vez (con sus productos) para toda la vista
+    items = list(carrito.items.select_related('producto').order_by('id'))
 
     # Verificar que el carrito no este vacio
-    if not carrito.items.exists():
+    if not items:
         messages.warning(request, 'Tu carrito esta vacio.')
         return redirect('ver_carrito')
     
-    # Verificar stock disponible
-    for item in carrito.items.all():
+    # Verificar stock disponible (aviso temprano; la reserva real se hace
+    # con UPDATE condicionales dentro de la transaccion del pedido)
+    for item in items:
         if item.cantidad > item.producto.stock:
             messages.error(request, f'No hay suficiente stock de {item.producto.nombre}')
             return redirect('ver_carrito')
@@ -33,6 +42,8 @@ def checkout(request):
 
         if form.is_valid():
             try:
+                # Fuera de la transaccion: asi se toma del bloque del proceso
+                numero_pedido = siguiente_numero_pedido()
                 with transaction.atomic():
                     # Obtener datos de dirección
                     if form.cleaned_data['usar_direccion_guardada']:
@@ -66,42 +77,49 @@ def checkout(request):
                                 **direccion_data
                             )
                     
-                    # Calcular totales (Chile - envío gratis sobre $50.000 CLP)
-                    subtotal = int(carrito.total_precio)
-                    costo_envio = 5000 if subtotal < 50000 else 0
-                    total = subtotal + costo_envio
+                    # Calcular totales (Chile - envío gratis desde ENVIO_GRATIS_DESDE)
+                    subtotal = sum(item.subtotal for item in items)
+                    envio = costo_envio(subtotal)
+                    total = subtotal + envio
 
                     # Crear el pedido
                     pedido = Pedido.objects.create(
+                        numero_pedido=numero_pedido,
                         usuario=request.user,
                         subtotal=subtotal,
-                        costo_envio=costo_envio,
+                        costo_envio=envio,
                         total=total,
                         metodo_pago=form.cleaned_data['metodo_pago'],
                         notas=form.cleaned_data['notas'],
                         **direccion_data
                     )
 
-                    # Crear items del pedido y actualizar stock
-                    for item in carrito.items.all():
-                        ItemPedido.objects.create(
+                    # Reservar stock (un UPDATE condicional, sin sobreventa)
+                    reservar_stock((item.producto, item.cantidad) for item in items)
+
+                    # Crear items del pedido (un solo INSERT)
+                    ItemPedido.objects.bulk_create([
+                        ItemPedido(
                             pedido=pedido,
                             producto=item.producto,
                             nombre_producto=item.producto.nombre,
                             precio_unitario=int(item.producto.precio),
                             cantidad=item.cantidad
                         )
+                        for item in items
+                    ])
 
-                        # Reducir stock
-                        item.producto.stock -= item.cantidad
-                        item.producto.save()
-
-                    # Vaciar el carrito
-                    carrito.items.all().delete()
+                    # Vaciar el carrito (solo las lineas compradas)
+                    ItemCarrito.objects.filter(pk__in=[item.pk for item in items]).delete()
+                    recordar_total_items(request, 0)
 
                     messages.success(request, f'¡Pedido #{pedido.numero_pedido} creado exitosamente!')
                     return redirect('pedido_confirmacion', pedido_id=pedido.id)
                     
+            except StockInsuficiente as e:
+                for mensaje in e.mensajes():
+                    messages.error(request, mensaje)
+                return redirect('ver_carrito')
             except Exception as e:
                 messages.error(request, f'Error al procesar el pedido: {str(e)}')
                 return redirect('checkout')
@@ -109,19 +127,19 @@ def checkout(request):
         form = CheckoutForm(usuario=request.user)
     
     # Calcular costos para preview
-    subtotal = int(carrito.total_precio)
-    costo_envio = 5000 if subtotal < 50000 else 0
-    total = subtotal + costo_envio
+    subtotal = sum(item.subtotal for item in items)
+    envio = costo_envio(subtotal)
+    total = subtotal + envio
 
     context = {
         'form': form,
         'carrito': carrito,
-        'items': carrito.items.all(),
+        'items': items,
         'subtotal': subtotal,
-        'costo_envio': costo_envio,
+        'costo_envio': envio,
         'total': total,
         'direcciones': direcciones,
-        'envio_gratis_desde': 50000,
+        'envio_gratis_desde': ENVIO_GRATIS_DESDE,
     }
 
     return render(request, 'pedidos/checkout.html', context)
@@ -141,11 +159,13 @@ def pedido_confirmacion(request, pedido_id):
 
 @login_required
 def mis_pedidos(request):
-    """Lista de pedidos del usuario"""
-    pedidos = Pedido.objects.filter(usuario=request.user).prefetch_related('items')
+    """Lista de pedidos del usuario, paginada; los items solo se leen en detalle_pedido"""
+    # Orden del indice (usuario, -creado); el numero de unidades lo calcula la base
+    pedidos = Pedido.objects.filter(usuario=request.user).order_by('-creado').con_total_items()
+    pagina = Paginator(pedidos, PEDIDOS_POR_PAGINA).get_page(request.GET.get('page'))
 
     context = {
-        'pedidos': pedidos,
+        'pedidos': pagina,
     }
 
     return render(request, 'pedidos/mis_pedidos.html', context)
@@ -169,9 +189,7 @@ def cancelar_pedido(request, pedido_id):
     if pedido.estado in ['pendiente', 'pagado']:
         with transaction.atomic():
             # Devolver stock
-            for item in pedido.items.all():
-                item.producto.stock += item.cantidad
-                item.producto.save()
+            devolver_stock(pedido.items.values_list('producto_id', 'cantidad'))
             
             pedido.estado = 'cancelado'
             pedido.save()
@@ -5,9 +5,10 @@ from .models import Producto, Testimonio, Resena, Carrito, ItemCarrito
 
 @admin.register(Producto)
 class ProductoAdmin(admin.ModelAdmin):
-    list_display = ('nombre', 'categoria', 'precio', 'stock', 'activo', 'creado')
+    list_display = ('nombre', 'categoria', 'precio', 'stock', 'rating_avg', 'rating_count', 'activo', 'creado')
     list_filter = ('categoria', 'activo', 'creado')
     search_fields = ('nombre', 'categoria')
+    readonly_fields = ('rating_avg', 'rating_count')
 
 @admin.register(Resena)
 class ResenaAdmin(admin.ModelAdmin):
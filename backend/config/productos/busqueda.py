@@ -0,0 +1,143 @@
+"""
+Indice de busqueda de productos.
+
+En SQLite se usa una tabla virtual FTS5 de contenido externo sobre
+``productos_producto``. Los triggers creados en la migracion 0005 la
+mantienen al dia en cada INSERT/UPDATE/DELETE (incluidos ``bulk_create`` y
+``QuerySet.update``), y el tokenizador ``unicode61 remove_diacritics 2``
+normaliza mayusculas y tildes ("perfume" encuentra "Perfumé").
+
+En SQLite, las migraciones que reconstruyen ``productos_producto`` (AddField,
+AlterField...) copian la tabla y borran la original, y con ella sus
+triggers: cada una de esas migraciones termina llamando a
+``asegurar_triggers``, que los vuelve a crear y reconstruye el indice si
+faltaban.
+
+En otros motores se cae al filtro ``icontains`` original.
+"""
+import re
+
+from django.db import connection, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+TABLA_INDICE = 'productos_busqueda'
+
+# Los mismos de la migracion 0005
+TRIGGERS = {
+    'productos_busqueda_ai': f"""
+        CREATE TRIGGER IF NOT EXISTS productos_busqueda_ai AFTER INSERT ON productos_producto BEGIN
+            INSERT INTO {TABLA_INDICE}(rowid, nombre, descripcion, categoria)
+            VALUES (new.id, new.nombre, new.descripcion, new.categoria);
+        END
+    """,
+    'productos_busqueda_ad': f"""
+        CREATE TRIGGER IF NOT EXISTS productos_busqueda_ad AFTER DELETE ON productos_producto BEGIN
+            INSERT INTO {TABLA_INDICE}({TABLA_INDICE}, rowid, nombre, descripcion, categoria)
+            VALUES ('delete', old.id, old.nombre, old.descripcion, old.categoria);
+        END
+    """,
+    'productos_busqueda_au': f"""
+        CREATE TRIGGER IF NOT EXISTS productos_busqueda_au
+        AFTER UPDATE OF nombre, descripcion, categoria ON productos_producto BEGIN
+            INSERT INTO {TABLA_INDICE}({TABLA_INDICE}, rowid, nombre, descripcion, categoria)
+            VALUES ('delete', old.id, old.nombre, old.descripcion, old.categoria);
+            INSERT INTO {TABLA_INDICE}(rowid, nombre, descripcion, categoria)
+            VALUES (new.id, new.nombre, new.descripcion, new.categoria);
+        END
+    """,
+}
+
+# Peso de cada columna en bm25: nombre, descripcion, categoria
+PESOS_BM25 = (10.0, 1.0, 4.0)
+
+_PALABRA_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def indice_disponible():
+    """True si el motor de base de datos soporta el indice FTS5."""
+    return connection.vendor == 'sqlite'
+
+
+def construir_consulta(texto):
+    """
+    Convierte el texto del usuario en una expresion MATCH segura.
+
+    Cada palabra se entrecomilla (para neutralizar la sintaxis de FTS5) y se
+    busca como prefijo; las palabras se combinan con AND implicito.
+    """
+    palabras = _PALABRA_RE.findall(texto or '')
+    return ' '.join(f'"{palabra}"*' for palabra in palabras)
+
+
+def filtrar(queryset, texto):
+    """Restringe ``queryset`` a los productos que coinciden con ``texto``."""
+    if not indice_disponible():
+        return queryset.filter(
+            Q(nombre__icontains=texto) | Q(descripcion__icontains=texto)
+        )
+
+    consulta = construir_consulta(texto)
+    if not consulta:
+        return queryset.none()
+
+    return queryset.filter(id__in=RawSQL(
+        f'SELECT rowid FROM {TABLA_INDICE} WHERE {TABLA_INDICE} MATCH %s',
+        (consulta,),
+    ))
+
+
+def ordenar_por_relevancia(queryset, texto):
+    """
+    Filtra por ``texto`` y ordena por relevancia (bm25, menor es mejor).
+
+    Se une la tabla del indice en el mismo SELECT para que SQLite recorra
+    primero las coincidencias de FTS5 y calcule bm25 una sola vez por fila.
+    Fuera de SQLite equivale a ``filtrar`` con el orden por defecto.
+    """
+    if not indice_disponible():
+        return filtrar(queryset, texto).order_by('-creado')
+
+    consulta = construir_consulta(texto)
+    if not consulta:
+        return queryset.none()
+
+    pesos = ', '.join(str(peso) for peso in PESOS_BM25)
+    return queryset.extra(
+        tables=[TABLA_INDICE],
+        where=[
+            f'{TABLA_INDICE}.rowid = productos_producto.id',
+            f'{TABLA_INDICE} MATCH %s',
+        ],
+        params=[consulta],
+        select={'relevancia': f'bm25({TABLA_INDICE}, {pesos})'},
+    ).order_by('relevancia', '-creado')
+
+
+def reconstruir_indice():
+    """Regenera el indice completo a partir de la tabla de productos."""
+    if not indice_disponible():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABLA_INDICE}({TABLA_INDICE}) VALUES ('rebuild')")
+        cursor.execute(f"INSERT INTO {TABLA_INDICE}({TABLA_INDICE}) VALUES ('optimize')")
+    return True
+
+
+def asegurar_triggers(using='default'):
+    """Crea los triggers que falten y, si faltaba alguno, reconstruye el indice."""
+    conexion = connections[using]
+    if conexion.vendor != 'sqlite':
+        return False
+    with conexion.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [TABLA_INDICE])
+        if cursor.fetchone() is None:
+            return False  # migracion 0005 sin aplicar
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'productos_producto'")
+        existentes = {nombre for nombre, in cursor.fetchall()}
+        faltantes = [sql for nombre, sql in TRIGGERS.items() if nombre not in existentes]
+        for sql in faltantes:
+            cursor.execute(sql)
+        if faltantes:
+            cursor.execute(f"INSERT INTO {TABLA_INDICE}({TABLA_INDICE}) VALUES ('rebuild')")
+    return bool(faltantes)
@@ -0,0 +1,165 @@
+"""
+Cache versionado de los listados del catalogo.
+
+Cada entrada se guarda bajo una clave que incluye el numero de version del
+catalogo. Al guardar o eliminar un ``Producto`` se incrementa la version
+(una sola operacion en el cache), con lo que todas las entradas anteriores
+dejan de ser alcanzables y expiran solas: no hay que recorrer claves.
+
+Los contadores de aciertos/fallos tambien viven en el cache, que
+``settings.CACHES`` configura compartido entre procesos (Redis o archivos):
+``estadisticas_cache_catalogo`` ve los de todos los workers.
+Junto a la version se guarda el momento del ultimo cambio, que la API usa
+como ``Last-Modified``. Los cambios que solo tocan el stock lo actualizan
+(``marcar_modificado``) sin subir la version: un checkout no vacia los
+listados ni las facetas, y el "sin stock" de un listado cacheado puede
+tardar hasta ``CATALOGO_CACHE_TIMEOUT`` en verse (el detalle y el checkout
+leen el stock al dia).
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+CLAVE_VERSION = 'catalogo:version'
+CLAVE_MODIFICADO = 'catalogo:modificado'
+CLAVE_ACIERTOS = 'catalogo:stats:aciertos'
+CLAVE_FALLOS = 'catalogo:stats:fallos'
+
+
+def _timeout():
+    return getattr(settings, 'CATALOGO_CACHE_TIMEOUT', 300)
+
+
+def version_catalogo():
+    """Version actual del catalogo (se inicializa en 1)."""
+    version = cache.get(CLAVE_VERSION)
+    if version is None:
+        cache.add(CLAVE_VERSION, 1, timeout=None)
+        version = cache.get(CLAVE_VERSION, 1)
+    return version
+
+
+def ultima_modificacion():
+    """
+    Momento del ultimo ``invalidar_catalogo`` o ``marcar_modificado``.
+
+    Si el cache lo perdio (reinicio) se toma el momento actual: la version
+    tambien vuelve a empezar y asi las ETag anteriores no coinciden.
+    """
+    momento = cache.get(CLAVE_MODIFICADO)
+    if momento is None:
+        cache.add(CLAVE_MODIFICADO, timezone.now(), timeout=None)
+        momento = cache.get(CLAVE_MODIFICADO)
+    return momento
+
+
+def marcar_modificado():
+    """Registra un cambio de productos que no invalida los listados (la API lo ve)."""
+    cache.set(CLAVE_MODIFICADO, timezone.now(), timeout=None)
+
+
+def invalidar_catalogo():
+    """Incrementa la version: invalida en O(1) todos los listados cacheados."""
+    marcar_modificado()
+    try:
+        return cache.incr(CLAVE_VERSION)
+    except ValueError:
+        # La clave no existe (cache vacio o reiniciado)
+        cache.add(CLAVE_VERSION, 1, timeout=None)
+        return cache.incr(CLAVE_VERSION)
+
+
+def _incrementar(clave):
+    try:
+        cache.incr(clave)
+    except ValueError:
+        if not cache.add(clave, 1, timeout=None):
+            cache.incr(clave)
+
+
+async def aversion_catalogo():
+    version = await cache.aget(CLAVE_VERSION)
+    if version is None:
+        await cache.aadd(CLAVE_VERSION, 1, timeout=None)
+        version = await cache.aget(CLAVE_VERSION, 1)
+    return version
+
+
+async def _aincrementar(clave):
+    try:
+        await cache.aincr(clave)
+    except ValueError:
+        if not await cache.aadd(clave, 1, timeout=None):
+            await cache.aincr(clave)
+
+
+def _clave(version, partes):
+    resumen = hashlib.md5(repr(partes).encode('utf-8')).hexdigest()
+    return f'catalogo:v{version}:{resumen}'
+
+
+def clave_listado(*partes):
+    """Clave para una combinacion de filtros ya normalizada."""
+    return _clave(version_catalogo(), partes)
+
+
+def obtener(partes, calcular):
+    """
+    Devuelve el valor cacheado para ``partes`` o lo calcula con ``calcular()``.
+
+    ``partes`` debe ser una tupla normalizada (ver ``normalizar_filtros``).
+    """
+    clave = clave_listado(*partes)
+    valor = cache.get(clave)
+    if valor is not None:
+        _incrementar(CLAVE_ACIERTOS)
+        return valor
+
+    _incrementar(CLAVE_FALLOS)
+    valor = calcular()
+    cache.set(clave, valor, timeout=_timeout())
+    return valor
+
+
+async def aobtener(partes, acalcular):
+    """Version asincrona de ``obtener``: ``acalcular()`` devuelve una corrutina."""
+    clave = _clave(await aversion_catalogo(), partes)
+    valor = await cache.aget(clave)
+    if valor is not None:
+        await _aincrementar(CLAVE_ACIERTOS)
+        return valor
+
+    await _aincrementar(CLAVE_FALLOS)
+    valor = await acalcular()
+    await cache.aset(clave, valor, timeout=_timeout())
+    return valor
+
+
+def normalizar_filtros(categoria, busqueda, orden, pagina):
+    """Normaliza los parametros GET para que peticiones equivalentes compartan clave."""
+    categoria = (categoria or '').strip()
+    busqueda = ' '.join((busqueda or '').lower().split())
+    try:
+        pagina = max(int(pagina), 1)
+    except (TypeError, ValueError):
+        pagina = 1
+    return (categoria, busqueda, orden, pagina)
+
+
+def estadisticas():
+    """Aciertos, fallos y tasa de aciertos acumulados."""
+    aciertos = cache.get(CLAVE_ACIERTOS, 0)
+    fallos = cache.get(CLAVE_FALLOS, 0)
+    total = aciertos + fallos
+    return {
+        'version': version_catalogo(),
+        'aciertos': aciertos,
+        'fallos': fallos,
+        'tasa_aciertos': aciertos / total if total else 0.0,
+    }
+
+
+def reiniciar_estadisticas():
+    cache.delete_many([CLAVE_ACIERTOS, CLAVE_FALLOS])
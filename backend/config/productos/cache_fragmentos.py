@@ -0,0 +1,81 @@
+"""
+Fragmentos de la portada cacheados ya renderizados.
+
+``views.home`` arma las secciones de productos y testimonios con
+``obtener(nombre, generar)``. La clave incluye una version por fragmento que
+``invalidar`` incrementa cuando las señales de ``models`` confirman un
+cambio en ``Producto`` o ``Testimonio``, como en ``cache_catalogo``.
+
+Proteccion contra estampidas: cada entrada guarda su propio vencimiento y
+vive el doble en el cache. Cuando vence, solo la peticion que consigue el
+candado (``cache.add``, atomico) la vuelve a renderizar; las demas siguen
+sirviendo la copia vencida mientras tanto. Si no hay copia (primer uso o
+recien invalidado) esperan a que el fragmento aparezca, y solo tras
+``ESPERA_MAXIMA`` segundos lo renderizan por su cuenta.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+INICIO_PRODUCTOS = 'inicio_productos'
+INICIO_TESTIMONIOS = 'inicio_testimonios'
+
+ESPERA_MAXIMA = 2
+PAUSA = 0.02
+# Mas que cualquier renderizado; si el proceso muere el candado expira solo
+CANDADO_TIMEOUT = 30
+
+
+def _timeout():
+    return getattr(settings, 'FRAGMENTOS_CACHE_TIMEOUT', 600)
+
+
+def _clave_version(nombre):
+    return f'fragmento:{nombre}:version'
+
+
+def _version(nombre):
+    clave = _clave_version(nombre)
+    version = cache.get(clave)
+    if version is None:
+        cache.add(clave, 1, timeout=None)
+        version = cache.get(clave, 1)
+    return version
+
+
+def obtener(nombre, generar):
+    """HTML del fragmento ``nombre``; ``generar()`` lo renderiza si hace falta."""
+    clave = f'fragmento:{nombre}:v{_version(nombre)}'
+    candado = f'{clave}:candado'
+    limite = time.monotonic() + ESPERA_MAXIMA
+    while True:
+        entrada = cache.get(clave)
+        if entrada is not None and entrada[1] > time.time():
+            return entrada[0]
+
+        if cache.add(candado, 1, timeout=CANDADO_TIMEOUT):
+            try:
+                html = generar()
+                # Vencimiento en tiempo de reloj: lo comparten todos los procesos
+                cache.set(clave, (html, time.time() + _timeout()), timeout=_timeout() * 2)
+                return html
+            finally:
+                cache.delete(candado)
+
+        if entrada is not None:
+            # Otra peticion la esta regenerando
+            return entrada[0]
+        if time.monotonic() >= limite:
+            return generar()
+        time.sleep(PAUSA)
+
+
+def invalidar(nombre):
+    """Incrementa la version: la siguiente peticion renderiza el fragmento de nuevo."""
+    clave = _clave_version(nombre)
+    try:
+        return cache.incr(clave)
+    except ValueError:
+        cache.add(clave, 1, timeout=None)
+        return cache.incr(clave)
@@ -0,0 +1,81 @@
+"""
+Cache de lectura de cada producto (``producto_detalle``).
+
+``obtener(id)`` devuelve el ``Producto`` cacheado o lo lee de la base y lo
+guarda (read-through); los productos inexistentes no se cachean. Las
+señales de ``models`` borran la entrada de cada producto modificado al
+confirmar la escritura, tanto con ``save()``/``delete()`` como con las
+escrituras en bloque (``productos_actualizados``). Cuando no se sabe que
+productos cambiaron, o son mas de ``MAX_INVALIDAR_POR_ID``, se incrementa
+la generacion, que forma parte de todas las claves, como la version de
+``cache_catalogo``: una sola escritura en lugar de una por producto.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+CLAVE_GENERACION = 'producto:generacion'
+
+# Con mas productos modificados se olvidan todos de una vez
+MAX_INVALIDAR_POR_ID = 50
+
+
+def _timeout():
+    return getattr(settings, 'PRODUCTO_CACHE_TIMEOUT', 300)
+
+
+def _generacion():
+    generacion = cache.get(CLAVE_GENERACION)
+    if generacion is None:
+        cache.add(CLAVE_GENERACION, 1, timeout=None)
+        generacion = cache.get(CLAVE_GENERACION, 1)
+    return generacion
+
+
+async def _ageneracion():
+    generacion = await cache.aget(CLAVE_GENERACION)
+    if generacion is None:
+        await cache.aadd(CLAVE_GENERACION, 1, timeout=None)
+        generacion = await cache.aget(CLAVE_GENERACION, 1)
+    return generacion
+
+
+def _clave(generacion, producto_id):
+    return f'producto:g{generacion}:{producto_id}'
+
+
+def obtener(producto_id):
+    """``Producto`` con id ``producto_id`` (activo o no), o None si no existe."""
+    from .models import Producto
+
+    clave = _clave(_generacion(), producto_id)
+    producto = cache.get(clave)
+    if producto is None:
+        producto = Producto.objects.filter(pk=producto_id).first()
+        if producto is not None:
+            cache.set(clave, producto, timeout=_timeout())
+    return producto
+
+
+async def aobtener(producto_id):
+    from .models import Producto
+
+    clave = _clave(await _ageneracion(), producto_id)
+    producto = await cache.aget(clave)
+    if producto is None:
+        producto = await Producto.objects.filter(pk=producto_id).afirst()
+        if producto is not None:
+            await cache.aset(clave, producto, timeout=_timeout())
+    return producto
+
+
+def invalidar(ids):
+    """Olvida los productos ``ids``; con ``None`` (o demasiados), todos."""
+    if ids is None or len(ids) > MAX_INVALIDAR_POR_ID:
+        try:
+            cache.incr(CLAVE_GENERACION)
+        except ValueError:
+            cache.add(CLAVE_GENERACION, 1, timeout=None)
+            cache.incr(CLAVE_GENERACION)
+        return
+    generacion = _generacion()
+    cache.delete_many([_clave(generacion, producto_id) for producto_id in ids])
@@ -0,0 +1,279 @@
+"""
+Utilidades del carrito que no escriben en la base de datos.
+
+El numero de articulos se guarda en la sesion cada vez que el carrito
+cambia y al iniciar sesion, para que el contador del header (y la vista
+``contador_carrito``) pueda responder sin crear sesiones ni filas de
+``Carrito``. Es el total visto desde esta sesion: si el usuario cambia su
+carrito desde otro dispositivo, el contador de aqui no lo refleja hasta que
+el carrito cambie en esta sesion o vuelva a iniciarla (la pagina del
+carrito y el checkout siempre leen la base).
+
+Los visitantes anonimos no tienen fila en ``Carrito``: sus lineas viven en
+la sesion (``CarritoSesion``, ``{producto_id: cantidad}``) y solo pasan a
+``Carrito``/``ItemCarrito`` al iniciar sesion, con un unico upsert que suma
+las cantidades a las del carrito del usuario (``fusionar_carrito_sesion``).
+Como el checkout exige haber iniciado sesion, no hay otro punto en el que
+haga falta persistirlas.
+"""
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .models import Carrito, ItemCarrito, Producto, ResumenCarrito
+
+CLAVE_SESION_TOTAL = 'carrito_total_items'
+CLAVE_SESION_CARRITO = 'carrito'
+
+
+class LineaSesion:
+    """Linea de un carrito anonimo; su ``id`` es el del producto."""
+
+    def __init__(self, carrito, producto, cantidad):
+        self.carrito = carrito
+        self.producto = producto
+        self.id = self.pk = producto.pk
+        self.cantidad = cantidad
+
+    @property
+    def subtotal(self):
+        return self.producto.precio * self.cantidad
+
+    def save(self):
+        self.carrito._guardar_linea(self.producto.pk, self.cantidad)
+
+    def delete(self):
+        self.carrito._quitar_linea(self.producto.pk)
+
+    # Misma interfaz que ItemCarrito en las vistas asincronas; no hay E/S
+    async def asave(self):
+        self.save()
+
+    async def adelete(self):
+        self.delete()
+
+
+class CarritoSesion:
+    """
+    Carrito de un visitante anonimo guardado en la sesion.
+
+    Ofrece los mismos metodos que usan las vistas sobre ``Carrito``
+    (``obtener_o_crear_item``, ``item``, ``items_con_producto``, ``vaciar``,
+    ``resumen`` y sus versiones asincronas), pero sin filas en la base de
+    datos. Las versiones asincronas suponen la sesion ya cargada (ver
+    ``views_async.obtener_carrito``).
+    """
+
+    id = None
+    usuario = None
+
+    def __init__(self, session):
+        self.session = session
+
+    @property
+    def lineas(self):
+        """``{'producto_id': cantidad}`` en orden de llegada (solo lectura)."""
+        return self.session.get(CLAVE_SESION_CARRITO, {})
+
+    def _guardar_linea(self, producto_id, cantidad):
+        lineas = dict(self.lineas)
+        lineas[str(producto_id)] = cantidad
+        self.session[CLAVE_SESION_CARRITO] = lineas
+        self.invalidar_resumen()
+
+    def _quitar_linea(self, producto_id):
+        lineas = dict(self.lineas)
+        if lineas.pop(str(producto_id), None) is not None:
+            self.session[CLAVE_SESION_CARRITO] = lineas
+        self.invalidar_resumen()
+
+    def obtener_o_crear_item(self, producto):
+        cantidad = self.lineas.get(str(producto.pk))
+        if cantidad is None:
+            self._guardar_linea(producto.pk, 1)
+            return LineaSesion(self, producto, 1), True
+        return LineaSesion(self, producto, cantidad), False
+
+    async def aobtener_o_crear_item(self, producto):
+        return self.obtener_o_crear_item(producto)
+
+    def item(self, item_id):
+        cantidad = self.lineas.get(str(item_id))
+        if cantidad is None:
+            return None
+        producto = Producto.objects.filter(pk=item_id).first()
+        if producto is None:
+            return None
+        return LineaSesion(self, producto, cantidad)
+
+    async def aitem(self, item_id):
+        cantidad = self.lineas.get(str(item_id))
+        if cantidad is None:
+            return None
+        producto = await Producto.objects.filter(pk=item_id).afirst()
+        if producto is None:
+            return None
+        return LineaSesion(self, producto, cantidad)
+
+    def items_con_producto(self):
+        return self._items
+
+    @cached_property
+    def _items(self):
+        # Una consulta para todos los productos; se omiten los que ya no existen
+        return self._lineas_con(Producto.objects.in_bulk(self._ids()))
+
+    def _ids(self):
+        return [int(pk) for pk in self.lineas]
+
+    def _lineas_con(self, productos):
+        return [
+            LineaSesion(self, productos[int(pk)], cantidad)
+            for pk, cantidad in self.lineas.items()
+            if int(pk) in productos
+        ]
+
+    def vaciar(self):
+        self.session.pop(CLAVE_SESION_CARRITO, None)
+        self.invalidar_resumen()
+
+    @cached_property
+    def resumen(self):
+        items = self._items
+        return ResumenCarrito(
+            total_items=sum(item.cantidad for item in items),
+            total_precio=sum(item.subtotal for item in items),
+        )
+
+    async def aresumen(self):
+        """Recalcula ``resumen`` con el ORM asincrono y lo deja memoizado."""
+        self.invalidar_resumen()
+        self.__dict__['_items'] = self._lineas_con(await Producto.objects.ain_bulk(self._ids()))
+        return self.resumen
+
+    def invalidar_resumen(self):
+        self.__dict__.pop('resumen', None)
+        self.__dict__.pop('_items', None)
+
+    @property
+    def total_items(self):
+        return self.resumen.total_items
+
+    @property
+    def total_precio(self):
+        return self.resumen.total_precio
+
+
+def fusionar_carrito_sesion(request, usuario):
+    """
+    Pasa el carrito anonimo de la sesion al carrito de ``usuario``.
+
+    Un solo ``INSERT ... SELECT ... ON CONFLICT DO UPDATE`` suma cada
+    cantidad a la linea existente o crea la linea; el SELECT sobre productos
+    descarta los que se eliminaron mientras estaban en el carrito.
+    Deja en la sesion el total de articulos del carrito resultante para el
+    contador del header. Devuelve el numero de lineas fusionadas.
+    """
+    lineas = request.session.pop(CLAVE_SESION_CARRITO, None) or {}
+    cantidades = {int(pk): cantidad for pk, cantidad in lineas.items() if cantidad > 0}
+    if cantidades:
+        fusionadas = _fusionar_lineas(usuario, cantidades)
+    else:
+        fusionadas = 0
+    recordar_total_items(request, _total_items_usuario(usuario))
+    return fusionadas
+
+
+def _fusionar_lineas(usuario, cantidades):
+    carrito, _ = Carrito.objects.get_or_create(usuario=usuario)
+
+    tabla_items = connection.ops.quote_name(ItemCarrito._meta.db_table)
+    tabla_productos = connection.ops.quote_name(Producto._meta.db_table)
+    caso = 'CASE id ' + ' '.join(['WHEN %s THEN %s'] * len(cantidades)) + ' END'
+    parametros_caso = [valor for linea in cantidades.items() for valor in linea]
+    ids = list(cantidades)
+    sql = (
+        f'INSERT INTO {tabla_items} (carrito_id, producto_id, cantidad, fecha_agregado) '
+        f'SELECT %s, id, {caso}, %s FROM {tabla_productos} '
+        f'WHERE id IN ({", ".join(["%s"] * len(ids))}) '
+        f'ON CONFLICT (carrito_id, producto_id) '
+        f'DO UPDATE SET cantidad = {tabla_items}.cantidad + excluded.cantidad'
+    )
+    ahora = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [carrito.pk, *parametros_caso, ahora, *ids])
+        fusionadas = cursor.rowcount
+    carrito.tocar()
+    return fusionadas
+
+
+def recordar_total_items(request, total):
+    """Guarda en la sesion el total de articulos tras modificar el carrito."""
+    request.session[CLAVE_SESION_TOTAL] = total
+
+
+def resumen_actualizado(request, carrito):
+    """
+    Resumen del carrito tras modificarlo, compartido por todas las vistas.
+
+    Descarta el resumen memoizado, lo recalcula con una consulta y, si el
+    carrito es de un usuario, deja el total de articulos en la sesion para
+    el contador del header y marca la actividad del carrito (``tocar``).
+    """
+    carrito.invalidar_resumen()
+    resumen = carrito.resumen
+    if carrito.id is not None:
+        # El carrito anonimo se cuenta desde sus propias lineas en la sesion
+        recordar_total_items(request, resumen.total_items)
+        carrito.tocar()
+    return resumen
+
+
+async def aresumen_actualizado(request, carrito):
+    """Version asincrona de ``resumen_actualizado``."""
+    resumen = await carrito.aresumen()
+    if carrito.id is not None:
+        recordar_total_items(request, resumen.total_items)
+        await carrito.atocar()
+    return resumen
+
+
+def total_items_sin_escrituras(request):
+    """
+    Numero de articulos del carrito actual, sin efectos secundarios.
+
+    Nunca crea la sesion ni el carrito: un visitante sin sesion tiene 0
+    articulos y uno anonimo con sesion suma las lineas guardadas en ella. Si
+    la sesion de un usuario no trae el total (p. ej. sesion anterior a este
+    cambio) se calcula con una consulta de solo lectura y no se guarda, para
+    no marcar la sesion como modificada.
+    """
+    if not request.user.is_authenticated:
+        if not request.session.session_key:
+            return 0
+        return sum(CarritoSesion(request.session).lineas.values())
+
+    total = request.session.get(CLAVE_SESION_TOTAL)
+    if total is None:
+        total = _total_items_usuario(request.user)
+    return total
+
+
+def _total_items_usuario(usuario):
+    items = ItemCarrito.objects.filter(carrito__usuario=usuario)
+    return items.aggregate(total=Sum('cantidad'))['total'] or 0
+
+
+async def atotal_items_sin_escrituras(request, usuario):
+    """Version asincrona de ``total_items_sin_escrituras`` para ``usuario`` (``request.auser()``)."""
+    if not usuario.is_authenticated:
+        if not request.session.session_key:
+            return 0
+        return sum((await request.session.aget(CLAVE_SESION_CARRITO, {})).values())
+
+    total = await request.session.aget(CLAVE_SESION_TOTAL)
+    if total is None:
+        items = ItemCarrito.objects.filter(carrito__usuario=usuario)
+        total = (await items.aaggregate(total=Sum('cantidad')))['total'] or 0
+    return total
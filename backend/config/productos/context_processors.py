@@ -0,0 +1,10 @@
+from django.utils.functional import SimpleLazyObject
+
+from .carrito import total_items_sin_escrituras
+
+
+def carrito(request):
+    """Expone ``carrito_total_items`` a las plantillas (se calcula solo si se usa)."""
+    return {
+        'carrito_total_items': SimpleLazyObject(lambda: total_items_sin_escrituras(request)),
+    }
@@ -0,0 +1,82 @@
+"""
+Facetas del catalogo: categorias activas con su numero de productos.
+
+Se calculan con una sola consulta agrupada y se guardan en memoria del
+proceso junto con la version del catalogo (``cache_catalogo``). Mientras la
+version no cambie, pintar la barra lateral no hace ninguna consulta; cuando
+un producto se guarda o elimina la version sube y la siguiente peticion
+las reconstruye. El resultado tambien se deja en el cache compartido para
+que los demas procesos no tengan que ir a la base de datos.
+"""
+from django.core.cache import cache
+from django.db.models import Count
+
+from . import cache_catalogo
+from .models import Producto
+
+# Las facetas de versiones viejas quedan inalcanzables; se dejan expirar
+TIMEOUT_CACHE = 24 * 60 * 60
+
+# (version, datos); se reemplaza de una vez para no mezclar versiones entre hilos
+_facetas_en_memoria = (None, None)
+
+
+def _filas():
+    return (
+        Producto.objects.filter(activo=True)
+        .order_by()
+        .values('categoria')
+        .annotate(total=Count('id'))
+        .order_by('categoria')
+    )
+
+
+def _resumir(filas):
+    categorias = [{'nombre': fila['categoria'], 'total': fila['total']} for fila in filas]
+    return {
+        'categorias': categorias,
+        'total': sum(categoria['total'] for categoria in categorias),
+    }
+
+
+def calcular():
+    """Calcula las facetas con una unica consulta GROUP BY categoria."""
+    return _resumir(_filas())
+
+
+def obtener():
+    """Facetas vigentes: memoria del proceso -> cache compartido -> base de datos."""
+    global _facetas_en_memoria
+
+    version = cache_catalogo.version_catalogo()
+    version_en_memoria, datos = _facetas_en_memoria
+    if version_en_memoria == version:
+        return datos
+
+    clave = f'catalogo:v{version}:facetas'
+    datos = cache.get(clave)
+    if datos is None:
+        datos = calcular()
+        cache.set(clave, datos, timeout=TIMEOUT_CACHE)
+
+    _facetas_en_memoria = (version, datos)
+    return datos
+
+
+async def aobtener():
+    """Version asincrona de ``obtener``."""
+    global _facetas_en_memoria
+
+    version = await cache_catalogo.aversion_catalogo()
+    version_en_memoria, datos = _facetas_en_memoria
+    if version_en_memoria == version:
+        return datos
+
+    clave = f'catalogo:v{version}:facetas'
+    datos = await cache.aget(clave)
+    if datos is None:
+        datos = _resumir([fila async for fila in _filas()])
+        await cache.aset(clave, datos, timeout=TIMEOUT_CACHE)
+
+    _facetas_en_memoria = (version, datos)
+    return datos
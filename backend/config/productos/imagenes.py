@@ -0,0 +1,129 @@
+"""
+Derivadas responsivas de las imagenes subidas (productos y testimonios).
+
+Para cada original se generan copias WebP de varios anchos en
+``derivadas/<ruta original sin extension>-<ancho>w.webp`` dentro del mismo
+storage. Nunca se amplia: se crean los anchos de ``ANCHOS`` menores que el
+original y, si este no pasa del mayor, una copia a su ancho real. El nombre
+de cada archivo lleva el ancho real, que es el que anuncia el ``srcset``.
+
+Se generan al guardar el modelo (ver ``models.py``) y con el comando
+``generar_derivadas`` para las imagenes existentes; nunca durante una
+peticion. Mientras no existan, ``srcset`` devuelve '' y la plantilla usa el
+original. El ``srcset`` se memoriza por proceso; el proceso que (re)genera
+derivadas olvida los memorizados.
+
+Este modulo no importa modelos: el comando lo usa desde procesos hijos.
+"""
+import io
+import posixpath
+import re
+from functools import lru_cache
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+ANCHOS = (160, 320, 640, 1024)
+CALIDAD_WEBP = 80
+DIRECTORIO = 'derivadas'
+
+
+def ruta_derivada(nombre, ancho):
+    base, _ = posixpath.splitext(nombre)
+    return f'{DIRECTORIO}/{base}-{ancho}w.webp'
+
+
+def _anchos_para(ancho_original):
+    """Anchos de ``ANCHOS`` menores que el original, mas el original si no pasa del mayor."""
+    anchos = [ancho for ancho in ANCHOS if ancho < ancho_original]
+    if ancho_original <= ANCHOS[-1]:
+        anchos.append(ancho_original)
+    return anchos
+
+
+def _derivadas_en_disco(nombre, storage):
+    """Anchos de las derivadas de ``nombre`` que hay en ``storage``."""
+    base, _ = posixpath.splitext(nombre)
+    directorio, prefijo = posixpath.split(f'{DIRECTORIO}/{base}')
+    patron = re.compile(re.escape(prefijo) + r'-(\d+)w\.webp')
+    try:
+        _, archivos = storage.listdir(directorio)
+    except FileNotFoundError:
+        return []
+    return sorted(int(m[1]) for m in map(patron.fullmatch, archivos) if m)
+
+
+def derivadas_existentes(nombre, storage=None):
+    """
+    Anchos de las derivadas completas de ``nombre``, o [] si faltan.
+
+    La mas chica se escribe al final y nunca pasa de ``ANCHOS[0]``: si esta,
+    el juego esta completo.
+    """
+    anchos = _derivadas_en_disco(nombre, storage or default_storage)
+    return anchos if anchos and anchos[0] <= ANCHOS[0] else []
+
+
+def generar_derivadas(nombre, storage=None, forzar=False):
+    """
+    Crea las derivadas de ``nombre`` si faltan y devuelve sus anchos.
+
+    Con ``forzar`` se regeneran todas aunque ya existan.
+    """
+    storage = storage or default_storage
+    if not forzar and (existentes := derivadas_existentes(nombre, storage)):
+        return existentes
+
+    with storage.open(nombre, 'rb') as archivo:
+        imagen = Image.open(archivo)
+        imagen = ImageOps.exif_transpose(imagen)
+        if imagen.mode not in ('RGB', 'RGBA'):
+            imagen = imagen.convert('RGBA' if 'A' in imagen.getbands() or 'transparency' in imagen.info else 'RGB')
+        anchos = _anchos_para(imagen.width)
+        # Las de una version anterior del original pueden tener otros anchos
+        for ancho in _derivadas_en_disco(nombre, storage):
+            storage.delete(ruta_derivada(nombre, ancho))
+        # Se reduce de la mas grande a la mas chica, partiendo de la anterior;
+        # la mas chica (la que marca "generado") se escribe al final
+        for ancho in sorted(anchos, reverse=True):
+            alto = max(1, round(imagen.height * ancho / imagen.width))
+            if ancho < imagen.width:
+                imagen = imagen.resize((ancho, alto), Image.Resampling.LANCZOS)
+            contenido = io.BytesIO()
+            imagen.save(contenido, 'WEBP', quality=CALIDAD_WEBP, method=4)
+            storage.save(ruta_derivada(nombre, ancho), ContentFile(contenido.getvalue()))
+    return sorted(anchos)
+
+
+def srcset(nombre):
+    """
+    ``srcset`` WebP de ``nombre`` ("url 160w, url 320w, ..."), o '' si aun no hay.
+
+    No genera nada: solo mira que derivadas hay en disco. Solo se memoriza el
+    resultado valido; mientras falten se vuelve a mirar en cada peticion.
+    """
+    if not nombre:
+        return ''
+    try:
+        return _srcset_generado(nombre)
+    except LookupError:
+        # Sin derivadas (todavia): la plantilla usa el original
+        return ''
+
+
+@lru_cache(maxsize=4096)
+def _srcset_generado(nombre):
+    # lru_cache no guarda las excepciones
+    anchos = derivadas_existentes(nombre)
+    if not anchos:
+        raise LookupError(nombre)
+    return ', '.join(
+        f'{default_storage.url(ruta_derivada(nombre, ancho))} {ancho}w'
+        for ancho in anchos
+    )
+
+
+def olvidar_srcset():
+    """Descarta los srcset memorizados (lru_cache no permite borrar una sola clave)."""
+    _srcset_generado.cache_clear()
@@ -0,0 +1,90 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from productos import busqueda
+from productos.models import Producto
+
+CATEGORIAS = ['Perfumes', 'Cremas', 'Maquillaje', 'Cuidado Capilar', 'Accesorios', 'Sets de Regalo']
+PALABRAS_BASE = [
+    'perfumé', 'crema', 'hidratante', 'floral', 'cítrico', 'intenso', 'suave', 'noche',
+    'día', 'vainilla', 'rosa', 'jazmín', 'ámbar', 'coco', 'tropical', 'caribeño',
+    'mujer', 'hombre', 'unisex', 'edición', 'limitada', 'clásico', 'esencia', 'piel',
+]
+SILABAS = ['la', 'ver', 'mo', 'chan', 'dor', 'ni', 'sa', 'lu', 'xe', 'ta', 'ri', 'bel', 'on', 'ca']
+CONSULTAS = ['perfume', 'Crema hidratante', 'jazmin', 'edicion limitada', 'lavermo', 'xyz']
+
+
+def _vocabulario(rnd, tamano=5_000):
+    """Palabras base mas marcas sinteticas; se muestrean con pesos tipo Zipf."""
+    marcas = {''.join(rnd.choices(SILABAS, k=rnd.randint(2, 4))) for _ in range(tamano)}
+    palabras = PALABRAS_BASE + sorted(marcas)
+    pesos = [1 / (rango + 1) for rango in range(len(palabras))]
+    return palabras, pesos
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide la latencia de busqueda (indice FTS5 vs icontains) sobre un catalogo '
+        'sintetico. Los datos se crean dentro de una transaccion que se revierte.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--productos', type=int, default=100_000)
+        parser.add_argument('--repeticiones', type=int, default=20)
+
+    def handle(self, *args, **options):
+        total = options['productos']
+        repeticiones = options['repeticiones']
+        rnd = random.Random(42)
+
+        palabras, pesos = _vocabulario(rnd)
+
+        with transaction.atomic():
+            self.stdout.write(f'Creando {total} productos sinteticos...')
+            Producto.objects.bulk_create(
+                (
+                    Producto(
+                        nombre=' '.join(rnd.choices(palabras, pesos, k=3)).capitalize(),
+                        categoria=rnd.choice(CATEGORIAS),
+                        descripcion=' '.join(rnd.choices(palabras, pesos, k=25)),
+                        precio=rnd.randint(3_000, 150_000),
+                        stock=rnd.randint(0, 50),
+                        imagen='productos/perfume1.png',
+                    )
+                    for _ in range(total)
+                ),
+                batch_size=5_000,
+            )
+
+            activos = Producto.objects.filter(activo=True)
+            self.stdout.write(f'{"consulta":20} {"relevancia":>22} {"indice+reciente":>22} {"icontains":>22}')
+            for consulta in CONSULTAS:
+                relevancia = self._medir(repeticiones, lambda: list(
+                    busqueda.ordenar_por_relevancia(activos, consulta)[:12]
+                ))
+                reciente = self._medir(repeticiones, lambda: list(
+                    busqueda.filtrar(activos, consulta).order_by('-creado')[:12]
+                ))
+                icontains = self._medir(repeticiones, lambda: list(
+                    activos.filter(Q(nombre__icontains=consulta) | Q(descripcion__icontains=consulta))
+                    .order_by('-creado')[:12]
+                ))
+                self.stdout.write(f'{consulta:20} {relevancia} {reciente} {icontains}')
+
+            transaction.set_rollback(True)
+
+    def _medir(self, repeticiones, funcion):
+        """Devuelve 'p50/p95' en milisegundos."""
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            funcion()
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        tiempos.sort()
+        p95 = tiempos[max(0, int(len(tiempos) * 0.95) - 1)]
+        return f'{statistics.median(tiempos):8.2f}/{p95:8.2f} ms'
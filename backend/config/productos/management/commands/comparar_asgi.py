@@ -0,0 +1,239 @@
+import asyncio
+import io
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+
+from config.metricas import instalar
+from config.rendimiento import percentil
+from productos.models import Producto
+from productos.views import ORDENES_CATALOGO
+
+ENDPOINTS = ('contador', 'productos', 'producto_detalle')
+
+
+def llamar_wsgi(aplicacion, ruta, host):
+    """Una peticion GET al ``WSGIHandler``, como la haria el servidor; devuelve el status."""
+    ruta, _, query = ruta.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': ruta, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': host, 'SERVER_PORT': '80', 'HTTP_HOST': host, 'REMOTE_ADDR': '127.0.0.1',
+        'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.multithread': True,
+        'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    estado = []
+    respuesta = aplicacion(environ, lambda status, cabeceras, exc_info=None: estado.append(status))
+    try:
+        for _ in respuesta:
+            pass
+    finally:
+        # request_finished: cierra la conexion a la base como con un servidor real
+        respuesta.close()
+    return int(estado[0].split()[0])
+
+
+async def llamar_asgi(aplicacion, ruta, host):
+    """Una peticion GET al ``ASGIHandler`` en este bucle de eventos; devuelve el status."""
+    ruta, _, query = ruta.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': ruta, 'raw_path': ruta.encode(), 'query_string': query.encode(),
+        'root_path': '', 'headers': [(b'host', host.encode())],
+        'client': ('127.0.0.1', 50000), 'server': (host, 80),
+    }
+    pendientes = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    estado = []
+
+    async def recibir():
+        if pendientes:
+            return pendientes.pop()
+        # Django escucha la desconexion mientras responde; se cancela al terminar
+        await asyncio.Future()
+
+    async def enviar(mensaje):
+        if mensaje['type'] == 'http.response.start':
+            estado.append(mensaje['status'])
+
+    await aplicacion(scope, recibir, enviar)
+    return estado[0]
+
+
+def pedir_http(url):
+    try:
+        with urlopen(url, timeout=30) as respuesta:
+            respuesta.read()
+            return respuesta.status
+    except HTTPError as exc:
+        return exc.code
+    except (URLError, OSError):
+        return 0
+
+
+def latencia_simulada(segundos):
+    """``execute_wrapper`` que espera ``segundos`` antes de cada consulta (base remota)."""
+    def esperar(execute, sql, params, many, context):
+        time.sleep(segundos)
+        return execute(sql, params, many, context)
+    return esperar
+
+
+class Rutas:
+    """Mezcla de peticiones: contador del header, catalogo filtrado y detalle."""
+
+    def __init__(self, endpoints, productos, categorias):
+        self.endpoints = endpoints
+        self.productos = productos
+        self.categorias = categorias
+
+    def elegir(self, rng):
+        endpoint = rng.choice(self.endpoints)
+        if endpoint == 'contador':
+            return '/carrito/contador/'
+        if endpoint == 'producto_detalle':
+            return f'/producto/{rng.choice(self.productos)}/'
+        filtros = {'orden': rng.choice(ORDENES_CATALOGO[:-1]), 'page': rng.randint(1, 3)}
+        if self.categorias and rng.random() < 0.7:
+            filtros['categoria'] = rng.choice(self.categorias)
+        return '/productos/?' + urlencode(filtros)
+
+
+async def medir(pedir, rutas, conexiones, duracion, semilla):
+    """``conexiones`` clientes en bucle, cada uno espera su respuesta antes de la siguiente."""
+    latencias = []
+    errores = 0
+    fin = time.perf_counter() + duracion
+
+    async def conexion(rng):
+        nonlocal errores
+        while time.perf_counter() < fin:
+            ruta = rutas.elegir(rng)
+            inicio = time.perf_counter()
+            try:
+                estado = await pedir(ruta)
+            except Exception:
+                estado = 0
+            latencias.append((time.perf_counter() - inicio) * 1000)
+            if estado == 0 or estado >= 400:
+                errores += 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(conexion(random.Random(semilla + i)) for i in range(conexiones)))
+    return sorted(latencias), errores, time.perf_counter() - inicio
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara el throughput con conexiones concurrentes entre el despliegue WSGI '
+        '(config.wsgi, vistas sincronas, hilos de trabajo limitados) y el ASGI '
+        '(config.asgi, catalogo y carrito AJAX asincronos) sobre el contador del '
+        'carrito, el catalogo y el detalle de producto. Sin --wsgi/--asgi llama a '
+        'los handlers en este proceso; con ellas, a servidores en marcha. Solo lee.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conexiones', type=int, nargs='+', default=[1, 10, 50],
+                            help='Niveles de conexiones simultaneas a probar.')
+        parser.add_argument('--duracion', type=float, default=10,
+                            help='Segundos por nivel y despliegue.')
+        parser.add_argument('--hilos', type=int, default=4,
+                            help='Hilos de trabajo del WSGI en proceso (como gunicorn --threads).')
+        parser.add_argument('--latencia-bd', type=float, default=0,
+                            help='Milisegundos añadidos a cada consulta, para simular una base remota '
+                                 '(solo en proceso).')
+        parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+        parser.add_argument('--wsgi', metavar='URL', help='Servidor WSGI en marcha (p. ej. gunicorn).')
+        parser.add_argument('--asgi', metavar='URL', help='Servidor ASGI en marcha (p. ej. uvicorn).')
+        parser.add_argument('--host', default='localhost',
+                            help='Cabecera Host de las peticiones en proceso (ALLOWED_HOSTS).')
+        parser.add_argument('--semilla', type=int, default=0)
+
+    def handle(self, *args, **options):
+        productos = list(Producto.objects.filter(activo=True).values_list('id', flat=True)[:500])
+        if not productos:
+            raise CommandError('No hay productos activos: ejecuta sembrar_datos.')
+        categorias = sorted(set(Producto.objects.filter(activo=True).values_list('categoria', flat=True)))
+        rutas = Rutas(options['endpoints'], productos, categorias)
+
+        despliegues = self.despliegues(options)
+        esperar = None
+        if options['latencia_bd'] and not (options['wsgi'] or options['asgi']):
+            esperar = latencia_simulada(options['latencia_bd'] / 1000)
+            for conexion in connections.all():
+                instalar(conexion, esperar)
+            connection_created.connect(
+                lambda sender, connection, **kwargs: instalar(connection, esperar),
+                weak=False, dispatch_uid='comparar_asgi',
+            )
+
+        self.stdout.write(
+            f'{"despliegue":10} {"conexiones":>10} {"peticiones":>10} {"req/s":>9} '
+            f'{"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"errores":>8}'
+        )
+        throughput = {}
+        try:
+            for conexiones in options['conexiones']:
+                for nombre, pedir, ajustes in despliegues:
+                    with ajustes:
+                        asyncio.run(medir(pedir, rutas, min(conexiones, 5), 0.5, options['semilla']))  # calentar caches
+                        latencias, errores, duracion = asyncio.run(
+                            medir(pedir, rutas, conexiones, options['duracion'], options['semilla'])
+                        )
+                    throughput[nombre, conexiones] = len(latencias) / duracion
+                    self.stdout.write(
+                        f'{nombre:10} {conexiones:>10} {len(latencias):>10} {len(latencias) / duracion:>9.1f} '
+                        f'{percentil(latencias, 50):>9.1f} {percentil(latencias, 95):>9.1f} '
+                        f'{percentil(latencias, 99):>9.1f} {errores / max(len(latencias), 1):>8.1%}'
+                    )
+        finally:
+            if esperar is not None:
+                connection_created.disconnect(dispatch_uid='comparar_asgi')
+                for conexion in connections.all():
+                    if esperar in conexion.execute_wrappers:
+                        conexion.execute_wrappers.remove(esperar)
+
+        for conexiones in options['conexiones']:
+            if ('WSGI', conexiones) in throughput and ('ASGI', conexiones) in throughput:
+                self.stdout.write(
+                    f'{conexiones} conexiones: ASGI/WSGI = '
+                    f'{throughput["ASGI", conexiones] / max(throughput["WSGI", conexiones], 1e-9):.2f}x'
+                )
+
+    def despliegues(self, options):
+        """``[(nombre, pedir(ruta) -> corrutina con el status, ajustes)]``."""
+        sin_ajustes = nullcontext()
+        if options['wsgi'] or options['asgi']:
+            # Mismo cliente para ambos: un hilo por conexion simultanea
+            clientes = ThreadPoolExecutor(max_workers=max(options['conexiones']))
+
+            def remoto(base):
+                base = base.rstrip('/')
+                return lambda ruta: asyncio.get_running_loop().run_in_executor(clientes, pedir_http, base + ruta)
+
+            return [
+                (nombre, remoto(url), sin_ajustes)
+                for nombre, url in (('WSGI', options['wsgi']), ('ASGI', options['asgi'])) if url
+            ]
+
+        host = options['host']
+        wsgi = get_wsgi_application()
+        trabajadores = ThreadPoolExecutor(max_workers=options['hilos'])
+        asgi = get_asgi_application()
+        return [
+            ('WSGI', lambda ruta: asyncio.get_running_loop().run_in_executor(
+                trabajadores, llamar_wsgi, wsgi, ruta, host), sin_ajustes),
+            ('ASGI', lambda ruta: llamar_asgi(asgi, ruta, host),
+             override_settings(ROOT_URLCONF='config.urls_asgi')),
+        ]
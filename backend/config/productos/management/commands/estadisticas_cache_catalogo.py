@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from productos import cache_catalogo
+
+
+class Command(BaseCommand):
+    help = ('Muestra los aciertos/fallos del cache de listados del catalogo, sumados entre '
+            'todos los workers (leidos del cache compartido de settings.CACHES).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reiniciar', action='store_true',
+                            help='Pone los contadores a cero despues de mostrarlos.')
+
+    def handle(self, *args, **options):
+        stats = cache_catalogo.estadisticas()
+        self.stdout.write(
+            f"Version del catalogo: {stats['version']}\n"
+            f"Aciertos: {stats['aciertos']}\n"
+            f"Fallos: {stats['fallos']}\n"
+            f"Tasa de aciertos: {stats['tasa_aciertos']:.1%}"
+        )
+        if options['reiniciar']:
+            cache_catalogo.reiniciar_estadisticas()
+            self.stdout.write(self.style.SUCCESS('Contadores reiniciados.'))
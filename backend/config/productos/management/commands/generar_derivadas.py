@@ -0,0 +1,59 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from productos import imagenes
+
+
+def _procesar(nombre, forzar):
+    """Se ejecuta en un proceso hijo: devuelve (anchos, error)."""
+    try:
+        return imagenes.generar_derivadas(nombre, forzar=forzar), None
+    except (OSError, ValueError) as exc:
+        return [], str(exc)
+
+
+class Command(BaseCommand):
+    help = 'Genera las derivadas WebP de las imagenes de productos y testimonios existentes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--procesos', type=int, default=os.cpu_count() or 1,
+                            help='Procesos en paralelo (por defecto, uno por CPU).')
+        parser.add_argument('--forzar', action='store_true',
+                            help='Regenera las derivadas aunque ya existan.')
+
+    def handle(self, *args, **options):
+        # Los modelos se importan aqui: los procesos hijos solo necesitan productos.imagenes
+        from productos.models import Producto, Testimonio
+
+        nombres = set(Producto.objects.exclude(imagen='').values_list('imagen', flat=True))
+        nombres.update(
+            Testimonio.objects.exclude(imagen='').exclude(imagen__isnull=True)
+            .values_list('imagen', flat=True)
+        )
+        nombres = sorted(nombres)
+        # Que los hijos no hereden conexiones abiertas
+        connections.close_all()
+
+        inicio = time.perf_counter()
+        errores = 0
+        procesos = max(1, options['procesos'])
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            resultados = pool.map(_procesar, nombres, repeat(options['forzar']),
+                                  chunksize=max(1, len(nombres) // (procesos * 4)))
+            for nombre, (anchos, error) in zip(nombres, resultados):
+                if error:
+                    errores += 1
+                    self.stderr.write(f'{nombre}: {error}')
+                elif options['verbosity'] > 1:
+                    self.stdout.write(f'{nombre}: {", ".join(f"{a}w" for a in anchos)}')
+
+        duracion = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(nombres) - errores} imagenes procesadas ({errores} con error) '
+            f'con {procesos} procesos en {duracion:.2f}s.'
+        ))
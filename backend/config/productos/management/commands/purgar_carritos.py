@@ -0,0 +1,102 @@
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from productos.models import Carrito, ItemCarrito
+
+MOTORES_SESION_EN_BD = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Borra por lotes los carritos abandonados y las sesiones expiradas. '
+        'Cada lote es una transaccion corta, asi que se puede ejecutar desde cron '
+        'mientras el sitio recibe checkouts.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias-anonimos', type=int, default=7,
+                            help='Antiguedad de los carritos sin usuario a borrar (dias).')
+        parser.add_argument('--dias-usuarios', type=int, default=90,
+                            help='Antiguedad de los carritos de usuarios a borrar (dias).')
+        parser.add_argument('--lote', type=int, default=500,
+                            help='Filas por transaccion.')
+        parser.add_argument('--pausa', type=float, default=0.05,
+                            help='Segundos de espera entre lotes, para dejar pasar otras escrituras.')
+        parser.add_argument('--max-segundos', type=float, default=60,
+                            help='Tiempo maximo de la ejecucion; lo que falte queda para la siguiente.')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        self.limite = inicio + options['max_segundos']
+        self.lote = max(1, options['lote'])
+        self.pausa = options['pausa']
+        ahora = timezone.now()
+
+        borrados = Counter()
+        borrados += self.en_lotes(self.borrar_carritos(
+            Carrito.objects.filter(usuario__isnull=True),
+            ahora - timedelta(days=options['dias_anonimos']),
+        ))
+        borrados += self.en_lotes(self.borrar_carritos(
+            Carrito.objects.filter(usuario__isnull=False),
+            ahora - timedelta(days=options['dias_usuarios']),
+        ))
+        if settings.SESSION_ENGINE in MOTORES_SESION_EN_BD:
+            borrados += self.en_lotes(self.borrar_sesiones(ahora))
+
+        duracion = time.perf_counter() - inicio
+        pendiente = ' (tiempo agotado, quedan filas)' if time.perf_counter() >= self.limite else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"Borrados: {borrados['carritos']} carritos, {borrados['items']} items, "
+            f"{borrados['sesiones']} sesiones en {duracion:.2f}s{pendiente}."
+        ))
+
+    def en_lotes(self, borrar_lote):
+        """Ejecuta ``borrar_lote`` en transacciones cortas hasta que no quede nada o se acabe el tiempo."""
+        total = Counter()
+        while time.perf_counter() < self.limite:
+            with transaction.atomic():
+                borrados, filas = borrar_lote()
+            total += borrados
+            if filas < self.lote:
+                break
+            time.sleep(self.pausa)
+        return total
+
+    def borrar_carritos(self, carritos, corte):
+        def borrar_lote():
+            # Usa el indice de actualizado; se vuelve a filtrar por fecha al borrar
+            # por si el carrito tuvo actividad despues de la seleccion
+            ids = list(
+                carritos.filter(actualizado__lt=corte)
+                .order_by('actualizado').values_list('pk', flat=True)[:self.lote]
+            )
+            if not ids:
+                return Counter(), 0
+            vencidos = Carrito.objects.filter(pk__in=ids, actualizado__lt=corte)
+            items, _ = ItemCarrito.objects.filter(carrito__in=vencidos).delete()
+            _, por_modelo = vencidos.delete()
+            return Counter(carritos=por_modelo.get(Carrito._meta.label, 0), items=items), len(ids)
+        return borrar_lote
+
+    def borrar_sesiones(self, ahora):
+        def borrar_lote():
+            claves = list(
+                Session.objects.filter(expire_date__lt=ahora)
+                .order_by('expire_date').values_list('pk', flat=True)[:self.lote]
+            )
+            if not claves:
+                return Counter(), 0
+            borradas, _ = Session.objects.filter(pk__in=claves).delete()
+            return Counter(sesiones=borradas), len(claves)
+        return borrar_lote
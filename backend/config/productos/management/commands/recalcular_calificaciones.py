@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from productos.models import actualizar_calificacion
+
+
+class Command(BaseCommand):
+    help = 'Recalcula rating_avg y rating_count de los productos a partir de las reseñas aprobadas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('producto_ids', nargs='*', type=int,
+                            help='Ids de productos a recalcular (por defecto, todos).')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        actualizados = actualizar_calificacion(*options['producto_ids'])
+        duracion = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f'{actualizados} productos recalculados en {duracion:.2f}s.'
+        ))
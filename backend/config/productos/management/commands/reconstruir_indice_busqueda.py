@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from productos import busqueda
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el indice de busqueda de texto completo de productos.'
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        if not busqueda.indice_disponible():
+            self.stdout.write(self.style.WARNING(
+                'El motor de base de datos no soporta FTS5; la busqueda usa icontains.'
+            ))
+            return
+
+        busqueda.reconstruir_indice()
+        duracion = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(f'Indice reconstruido en {duracion:.2f}s.'))
@@ -0,0 +1,365 @@
+import random
+import time
+from bisect import bisect
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from pedidos import numeracion
+from pedidos.models import DireccionEnvio, ItemPedido, Pedido, costo_envio
+from productos.models import (
+    Carrito, ItemCarrito, Producto, Resena, Testimonio, actualizar_calificacion,
+)
+from usuarios.models import Perfil
+
+CATEGORIAS = (
+    'Perfumes', 'Cremas', 'Maquillaje', 'Cabello', 'Labiales', 'Sérums', 'Protector Solar',
+    'Uñas', 'Desodorantes', 'Brochas', 'Accesorios', 'Sets de Regalo', 'Hombre',
+    'Aceites', 'Exfoliantes', 'Velas',
+)
+MARCAS = ('Lumière', 'Aurora', 'Bella Flor', 'Nácar', 'Orquídea', 'Vainilla Real', 'Selva', 'Marea')
+TIPOS = ('Esencia', 'Crema', 'Bálsamo', 'Gel', 'Loción', 'Mascarilla', 'Spray', 'Elixir', 'Polvo', 'Tónico')
+COMUNAS = (
+    ('Providencia', 'Región Metropolitana'), ('Las Condes', 'Región Metropolitana'),
+    ('Maipú', 'Región Metropolitana'), ('Santiago', 'Región Metropolitana'),
+    ('Viña del Mar', 'Valparaíso'), ('Valparaíso', 'Valparaíso'),
+    ('Concepción', 'Biobío'), ('Temuco', 'Araucanía'), ('Antofagasta', 'Antofagasta'),
+    ('La Serena', 'Coquimbo'), ('Puerto Montt', 'Los Lagos'),
+)
+RED_SOCIAL = ('Instagram', 'Facebook', 'Twitter', 'TikTok', 'otro')
+
+# (valor, peso)
+CALIFICACIONES = ((1, 4), (2, 5), (3, 11), (4, 30), (5, 50))
+LINEAS_POR_PEDIDO = ((1, 45), (2, 28), (3, 14), (4, 8), (5, 5))
+DIRECCIONES_POR_USUARIO = ((0, 30), (1, 50), (2, 15), (3, 5))
+METODOS_PAGO = (('webpay', 55), ('mercadopago', 20), ('transferencia', 15), ('khipu', 6), ('efectivo', 4))
+# Estado segun la antiguedad del pedido: los recientes siguen en curso
+ESTADOS_RECIENTES = (('pendiente', 25), ('pagado', 30), ('procesando', 25), ('enviado', 15), ('cancelado', 5))
+ESTADOS_ANTIGUOS = (('entregado', 88), ('cancelado', 8), ('enviado', 4))
+DIAS_RECIENTES = 7
+
+COLUMNAS_PEDIDO = (
+    'numero_pedido', 'usuario', 'nombre_completo', 'telefono', 'direccion', 'comuna', 'region', 'pais',
+    'estado', 'metodo_pago', 'subtotal', 'costo_envio', 'descuento', 'total',
+    'creado', 'actualizado', 'fecha_pago',
+)
+COLUMNAS_ITEM_PEDIDO = ('pedido', 'producto', 'nombre_producto', 'precio_unitario', 'cantidad', 'creado')
+
+
+def pesos_zipf(cantidad, exponente):
+    """Pesos acumulados ``1 / rango**exponente``: pocos elementos concentran casi todo."""
+    return list(accumulate(1 / (rango ** exponente) for rango in range(1, cantidad + 1)))
+
+
+class Elector:
+    """``elegir(rng)`` segun pesos fijos, sin recalcular los acumulados en cada llamada."""
+
+    def __init__(self, pares):
+        self.valores = [valor for valor, _ in pares]
+        self.acumulados = list(accumulate(peso for _, peso in pares))
+
+    def elegir(self, rng):
+        return self.valores[bisect(self.acumulados, rng.random() * self.acumulados[-1])]
+
+
+@contextmanager
+def fechas_manuales(*modelos):
+    """Desactiva ``auto_now``/``auto_now_add`` para poder sembrar fechas pasadas."""
+    originales = []
+    for modelo in modelos:
+        for campo in modelo._meta.concrete_fields:
+            if isinstance(campo, models.DateField) and (campo.auto_now or campo.auto_now_add):
+                originales.append((campo, campo.auto_now, campo.auto_now_add))
+                campo.auto_now = campo.auto_now_add = False
+    try:
+        yield
+    finally:
+        for campo, auto_now, auto_now_add in originales:
+            campo.auto_now, campo.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = (
+        'Siembra datos sinteticos a escala de produccion (productos, usuarios, reseñas, '
+        'testimonios, carritos, direcciones y pedidos) con inserciones masivas. '
+        'Categorias con cola larga, popularidad de productos y frecuencia de compra '
+        'por cliente con ley de potencias.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--productos', type=int, default=5000)
+        parser.add_argument('--usuarios', type=int, default=20000)
+        parser.add_argument('--resenas', type=int, default=50000)
+        parser.add_argument('--testimonios', type=int, default=200)
+        parser.add_argument('--carritos', type=int, default=5000,
+                            help='Carritos con items; un tercio son de visitantes anonimos.')
+        parser.add_argument('--pedidos', type=int, default=100000)
+        parser.add_argument('--dias', type=int, default=365,
+                            help='Las fechas se reparten en los ultimos N dias.')
+        parser.add_argument('--clave', default='vgl-sembrado',
+                            help='Contraseña de los usuarios sembrados (para pruebas de carga).')
+        parser.add_argument('--semilla', type=int, default=1,
+                            help='Semilla aleatoria; la misma semilla da los mismos datos.')
+        parser.add_argument('--lote', type=int, default=10000,
+                            help='Filas por transaccion.')
+        parser.add_argument('--forzar', action='store_true',
+                            help='Permite ejecutarlo con DEBUG=False.')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['forzar']:
+            raise CommandError('Con DEBUG=False se requiere --forzar: siembra usuarios con una clave conocida.')
+        inicio = time.perf_counter()
+        self.rng = random.Random(options['semilla'])
+        self.lote = max(1, options['lote'])
+        self.ahora = timezone.now()
+        self.dias = max(1, options['dias'])
+        self.totales = Counter()
+
+        with fechas_manuales(Producto, Resena, Testimonio, Carrito, DireccionEnvio):
+            self.sembrar_productos(options['productos'])
+            self.sembrar_usuarios(options['usuarios'], options['clave'])
+            self.sembrar_resenas(options['resenas'])
+            self.sembrar_testimonios(options['testimonios'])
+            self.sembrar_direcciones()
+            self.sembrar_carritos(options['carritos'])
+            self.sembrar_pedidos(options['pedidos'])
+
+        if options['resenas'] and self.productos:
+            # bulk_create no emite señales: el resumen de calificaciones se recalcula de una vez
+            actualizar_calificacion(*self.productos)
+
+        duracion = time.perf_counter() - inicio
+        resumen = ', '.join(f'{cantidad} {nombre}' for nombre, cantidad in self.totales.items())
+        self.stdout.write(self.style.SUCCESS(f'Sembrados: {resumen} en {duracion:.1f}s.'))
+
+    # -- utilidades -------------------------------------------------------
+
+    def fecha_pasada(self, dias=None):
+        return self.ahora - timedelta(seconds=self.rng.random() * (dias or self.dias) * 86400)
+
+    def insertar(self, nombre, modelo, filas):
+        """``bulk_create`` por lotes, cada uno en su transaccion; devuelve los objetos con pk."""
+        creados = []
+        lote = []
+        for fila in filas:
+            lote.append(fila)
+            if len(lote) >= self.lote:
+                creados += self._insertar_lote(modelo, lote)
+                lote = []
+        if lote:
+            creados += self._insertar_lote(modelo, lote)
+        self.totales[nombre] += len(creados)
+        return creados
+
+    def _insertar_lote(self, modelo, lote):
+        with transaction.atomic():
+            return modelo.objects.bulk_create(lote)
+
+    def elegir_productos(self, cantidad):
+        """``cantidad`` productos distintos segun su popularidad."""
+        elegidos = set()
+        while len(elegidos) < min(cantidad, len(self.productos)):
+            elegidos.add(self.productos[bisect(self.popularidad, self.rng.random() * self.popularidad[-1])])
+        return elegidos
+
+    # -- tablas -----------------------------------------------------------
+
+    def sembrar_productos(self, cantidad):
+        rng = self.rng
+        categorias = pesos_zipf(len(CATEGORIAS), 1.3)
+        self.catalogo = {}
+        creados = self.insertar('productos', Producto, (
+            Producto(
+                nombre=f'{rng.choice(MARCAS)} {rng.choice(TIPOS)} {i}',
+                categoria=CATEGORIAS[bisect(categorias, rng.random() * categorias[-1])],
+                descripcion=f'{rng.choice(TIPOS)} de la linea {rng.choice(MARCAS)}.',
+                # Precios log-normales terminados en 990, como en la tienda
+                precio=max(990, int(rng.lognormvariate(9.6, 0.7)) // 1000 * 1000 + 990),
+                stock=0 if rng.random() < 0.05 else int(rng.expovariate(1 / 40)) + 1,
+                imagen='productos/perfume1.png',
+                activo=rng.random() >= 0.04,
+                creado=self.fecha_pasada(self.dias * 2),
+                # actualizar_calificacion los vuelve a marcar al final
+                actualizado=self.ahora,
+            )
+            for i in range(cantidad)
+        ))
+        for producto in creados:
+            self.catalogo[producto.pk] = (producto.nombre, producto.precio)
+        # Pocos productos concentran la mayoria de las ventas y reseñas
+        self.productos = [producto.pk for producto in creados]
+        rng.shuffle(self.productos)
+        self.popularidad = pesos_zipf(len(self.productos), 1.1)
+
+    def sembrar_usuarios(self, cantidad, clave):
+        desde = (User.objects.aggregate(maximo=Max('pk'))['maximo'] or 0) + 1
+        # Un solo hash para todos: calcularlo por usuario tomaria horas
+        clave = make_password(clave)
+        usuarios = self.insertar('usuarios', User, (
+            User(username=f'cliente{desde + i}', email=f'cliente{desde + i}@example.com',
+                 password=clave, date_joined=self.fecha_pasada(self.dias * 2))
+            for i in range(cantidad)
+        ))
+        # El perfil lo crea una señal que bulk_create no emite
+        self.insertar('perfiles', Perfil, (Perfil(usuario_id=usuario.pk) for usuario in usuarios))
+        self.usuarios = [usuario.pk for usuario in usuarios]
+        self.rng.shuffle(self.usuarios)
+        # Frecuencia de compra por cliente: unos pocos compran muchisimo
+        self.frecuencia = pesos_zipf(len(self.usuarios), 0.8)
+
+    def sembrar_resenas(self, cantidad):
+        if not (self.productos and self.usuarios):
+            return
+        rng = self.rng
+        calificaciones = Elector(CALIFICACIONES)
+        self.insertar('reseñas', Resena, (
+            Resena(
+                producto_id=self.productos[bisect(self.popularidad, rng.random() * self.popularidad[-1])],
+                usuario_id=rng.choice(self.usuarios),
+                calificacion=calificaciones.elegir(rng),
+                comentario='Reseña sembrada.',
+                aprobada=rng.random() < 0.75,
+                fecha=self.fecha_pasada(),
+            )
+            for _ in range(cantidad)
+        ))
+
+    def sembrar_testimonios(self, cantidad):
+        rng = self.rng
+        calificaciones = Elector(CALIFICACIONES)
+        self.insertar('testimonios', Testimonio, (
+            Testimonio(
+                nombre=f'Cliente {i}', comentario='Testimonio sembrado.',
+                red_social=rng.choice(RED_SOCIAL), calificacion=calificaciones.elegir(rng),
+                destacado=rng.random() < 0.1, activo=rng.random() < 0.95,
+                fecha=self.fecha_pasada(),
+            )
+            for i in range(cantidad)
+        ))
+
+    def sembrar_direcciones(self):
+        rng = self.rng
+        por_usuario = Elector(DIRECCIONES_POR_USUARIO)
+        self.direcciones = {}
+
+        def direcciones():
+            for usuario in self.usuarios:
+                for n in range(por_usuario.elegir(rng)):
+                    comuna, region = rng.choice(COMUNAS)
+                    direccion = DireccionEnvio(
+                        usuario_id=usuario, nombre_completo=f'Cliente {usuario}',
+                        telefono=f'+56 9 {rng.randrange(10 ** 8):08d}',
+                        direccion=f'Calle {rng.randrange(1, 200)} #{rng.randrange(1, 9999)}',
+                        comuna=comuna, region=region, predeterminada=n == 0,
+                        creada=self.fecha_pasada(),
+                    )
+                    self.direcciones.setdefault(usuario, direccion)
+                    yield direccion
+
+        self.insertar('direcciones', DireccionEnvio, direcciones())
+
+    def sembrar_carritos(self, cantidad):
+        if not self.productos:
+            return
+        rng = self.rng
+        con_usuario = rng.sample(self.usuarios, min(len(self.usuarios), cantidad * 2 // 3))
+        carritos = self.insertar('carritos', Carrito, [
+            Carrito(usuario_id=usuario, creado=self.fecha_pasada(30), actualizado=self.fecha_pasada(30))
+            for usuario in con_usuario
+        ] + [
+            Carrito(session_key=f'{rng.getrandbits(160):040x}', creado=self.fecha_pasada(30),
+                    actualizado=self.fecha_pasada(30))
+            for _ in range(cantidad - len(con_usuario))
+        ])
+        lineas = Elector(LINEAS_POR_PEDIDO)
+        self.insertar('items de carrito', ItemCarrito, (
+            ItemCarrito(carrito_id=carrito.pk, producto_id=producto, cantidad=rng.randint(1, 3))
+            for carrito in carritos
+            for producto in self.elegir_productos(lineas.elegir(rng))
+        ))
+
+    def sembrar_pedidos(self, cantidad):
+        """
+        Pedidos e items con ``executemany`` de tuplas: con millones de filas
+        compilar cada objeto con el ORM cuesta mucho mas que el INSERT.
+        """
+        if not (self.productos and self.usuarios):
+            return
+        tabla_pedidos = connection.ops.quote_name(Pedido._meta.db_table)
+        for desde in range(0, cantidad, self.lote):
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute(f'SELECT MAX(id) FROM {tabla_pedidos}')
+                    anterior = cursor.fetchone()[0] or 0
+                    pedidos, items = self._lote_pedidos(min(self.lote, cantidad - desde))
+                    self.insertar_sql(cursor, Pedido, COLUMNAS_PEDIDO, pedidos)
+                    # Los ids los asigna la base de datos; se recuperan por numero de pedido
+                    cursor.execute(
+                        f'SELECT numero_pedido, id FROM {tabla_pedidos} WHERE id > %s', [anterior],
+                    )
+                    ids = dict(cursor.fetchall())
+                    self.insertar_sql(cursor, ItemPedido, COLUMNAS_ITEM_PEDIDO, [
+                        (ids[numero], *item) for numero, item in items
+                    ])
+            self.totales['pedidos'] += len(pedidos)
+            self.totales['items de pedido'] += len(items)
+
+    def insertar_sql(self, cursor, modelo, campos, filas):
+        columnas = ', '.join(connection.ops.quote_name(modelo._meta.get_field(campo).column) for campo in campos)
+        marcadores = ', '.join(['%s'] * len(campos))
+        cursor.executemany(
+            f'INSERT INTO {connection.ops.quote_name(modelo._meta.db_table)} ({columnas}) VALUES ({marcadores})',
+            filas,
+        )
+
+    def _lote_pedidos(self, cantidad):
+        """Tuplas de ``COLUMNAS_PEDIDO`` y ``(numero_pedido, resto de COLUMNAS_ITEM_PEDIDO)``."""
+        rng = self.rng
+        lineas = Elector(LINEAS_POR_PEDIDO)
+        recientes, antiguos = Elector(ESTADOS_RECIENTES), Elector(ESTADOS_ANTIGUOS)
+        metodos = Elector(METODOS_PAGO)
+        adaptar = connection.ops.adapt_datetimefield_value
+        limite_recientes = self.ahora - timedelta(days=DIAS_RECIENTES)
+        fechas = sorted(self.fecha_pasada() for _ in range(cantidad))
+
+        # Numeros reales del contador del dia: los checkouts posteriores no chocan
+        por_dia = Counter(timezone.localdate(fecha) for fecha in fechas)
+        siguiente = {dia: numeracion.reservar(dia, total)[0] for dia, total in por_dia.items()}
+
+        pedidos, items = [], []
+        for creado in fechas:
+            dia = timezone.localdate(creado)
+            numero = numeracion.formatear(dia, siguiente[dia])
+            siguiente[dia] += 1
+            fecha = adaptar(creado)
+            usuario = self.usuarios[bisect(self.frecuencia, rng.random() * self.frecuencia[-1])]
+            direccion = self.direcciones.get(usuario)
+            if direccion:
+                calle, comuna, region = direccion.direccion, direccion.comuna, direccion.region
+            else:
+                calle, (comuna, region) = 'Sin direccion guardada', rng.choice(COMUNAS)
+
+            subtotal = 0
+            for producto in self.elegir_productos(lineas.elegir(rng)):
+                nombre, precio = self.catalogo[producto]
+                unidades = 1 + int(rng.expovariate(2))
+                subtotal += precio * unidades
+                items.append((numero, (producto, nombre, precio, unidades, fecha)))
+            envio = costo_envio(subtotal)
+            estado = (recientes if creado > limite_recientes else antiguos).elegir(rng)
+            pagado = estado in ('pagado', 'procesando', 'enviado', 'entregado')
+            pedidos.append((
+                numero, usuario, f'Cliente {usuario}', '+56 9 0000 0000', calle, comuna, region, 'Chile',
+                estado, metodos.elegir(rng), subtotal, envio, 0, subtotal + envio,
+                fecha, fecha, fecha if pagado else None,
+            ))
+        return pedidos, items
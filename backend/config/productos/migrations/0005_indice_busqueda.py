@@ -0,0 +1,62 @@
+from django.db import migrations
+
+
+CREAR_INDICE = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS productos_busqueda USING fts5(
+        nombre, descripcion, categoria,
+        content='productos_producto', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS productos_busqueda_ai AFTER INSERT ON productos_producto BEGIN
+        INSERT INTO productos_busqueda(rowid, nombre, descripcion, categoria)
+        VALUES (new.id, new.nombre, new.descripcion, new.categoria);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS productos_busqueda_ad AFTER DELETE ON productos_producto BEGIN
+        INSERT INTO productos_busqueda(productos_busqueda, rowid, nombre, descripcion, categoria)
+        VALUES ('delete', old.id, old.nombre, old.descripcion, old.categoria);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS productos_busqueda_au
+    AFTER UPDATE OF nombre, descripcion, categoria ON productos_producto BEGIN
+        INSERT INTO productos_busqueda(productos_busqueda, rowid, nombre, descripcion, categoria)
+        VALUES ('delete', old.id, old.nombre, old.descripcion, old.categoria);
+        INSERT INTO productos_busqueda(rowid, nombre, descripcion, categoria)
+        VALUES (new.id, new.nombre, new.descripcion, new.categoria);
+    END
+    """,
+    "INSERT INTO productos_busqueda(productos_busqueda) VALUES ('rebuild')",
+]
+
+ELIMINAR_INDICE = [
+    'DROP TRIGGER IF EXISTS productos_busqueda_au',
+    'DROP TRIGGER IF EXISTS productos_busqueda_ad',
+    'DROP TRIGGER IF EXISTS productos_busqueda_ai',
+    'DROP TABLE IF EXISTS productos_busqueda',
+]
+
+
+def _ejecutar(sentencias):
+    def operacion(apps, schema_editor):
+        # El indice FTS5 solo existe en SQLite; otros motores usan icontains
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for sql in sentencias:
+            schema_editor.execute(sql)
+    return operacion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0004_carrito_itemcarrito'),
+    ]
+
+    operations = [
+        migrations.RunPython(_ejecutar(CREAR_INDICE), _ejecutar(ELIMINAR_INDICE)),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 6.0.1 on 2026-10-18 10:03
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def calcular_calificaciones(apps, schema_editor):
+    Producto = apps.get_model('productos', 'Producto')
+    Resena = apps.get_model('productos', 'Resena')
+    aprobadas = Resena.objects.filter(producto=OuterRef('pk'), aprobada=True).order_by().values('producto')
+    Producto.objects.update(
+        rating_avg=Coalesce(Subquery(aprobadas.annotate(promedio=Avg('calificacion')).values('promedio')), Value(0.0)),
+        rating_count=Coalesce(Subquery(aprobadas.annotate(total=Count('id')).values('total')), Value(0)),
+    )
+
+
+# Copia congelada de los triggers de 0005: la migracion no depende de como
+# cambie productos.busqueda
+TRIGGERS_BUSQUEDA = [
+    """
+    CREATE TRIGGER IF NOT EXISTS productos_busqueda_ai AFTER INSERT ON productos_producto BEGIN
+        INSERT INTO productos_busqueda(rowid, nombre, descripcion, categoria)
+        VALUES (new.id, new.nombre, new.descripcion, new.categoria);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS productos_busqueda_ad AFTER DELETE ON productos_producto BEGIN
+        INSERT INTO productos_busqueda(productos_busqueda, rowid, nombre, descripcion, categoria)
+        VALUES ('delete', old.id, old.nombre, old.descripcion, old.categoria);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS productos_busqueda_au
+    AFTER UPDATE OF nombre, descripcion, categoria ON productos_producto BEGIN
+        INSERT INTO productos_busqueda(productos_busqueda, rowid, nombre, descripcion, categoria)
+        VALUES ('delete', old.id, old.nombre, old.descripcion, old.categoria);
+        INSERT INTO productos_busqueda(rowid, nombre, descripcion, categoria)
+        VALUES (new.id, new.nombre, new.descripcion, new.categoria);
+    END
+    """,
+    "INSERT INTO productos_busqueda(productos_busqueda) VALUES ('rebuild')",
+]
+
+
+def restaurar_triggers(apps, schema_editor):
+    # En SQLite AddField reconstruye productos_producto y se lleva los
+    # triggers del indice de busqueda creados en 0005
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in TRIGGERS_BUSQUEDA:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0005_indice_busqueda'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='rating_avg',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(restaurar_triggers, migrations.RunPython.noop),
+        migrations.RunPython(calcular_calificaciones, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 6.0.1 on 2026-10-18 10:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0006_rating_producto'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='carrito',
+            name='session_key',
+            field=models.CharField(blank=True, db_index=True, max_length=40, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='carrito',
+            index=models.Index(fields=['actualizado'], name='carrito_actualizado_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 6.0.1 on 2026-10-18 10:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0007_indices_carrito'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['categoria', 'creado'], name='producto_cat_creado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['categoria', 'precio'], name='producto_cat_precio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['creado'], name='producto_activo_creado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['precio'], name='producto_activo_precio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['nombre'], name='producto_activo_nombre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['rating_avg', 'rating_count', 'creado'], name='producto_activo_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='resena',
+            index=models.Index(condition=models.Q(('aprobada', True)), fields=['producto', '-fecha'], name='resena_aprobadas_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='testimonio',
+            index=models.Index(condition=models.Q(('activo', True), ('destacado', True)), fields=['-fecha'], name='testimonio_portada_idx'),
+        ),
+    ]
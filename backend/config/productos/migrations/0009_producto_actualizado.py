@@ -0,0 +1,65 @@
+# Generated by Django 6.0.1 on 2026-10-18 14:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def desde_creado(apps, schema_editor):
+    # Sin historial: los productos existentes no cambiaron desde que se crearon
+    Producto = apps.get_model('productos', 'Producto')
+    Producto.objects.update(actualizado=models.F('creado'))
+
+
+# Copia congelada de los triggers de 0005: la migracion no depende de como
+# cambie productos.busqueda
+TRIGGERS_BUSQUEDA = [
+    """
+    CREATE TRIGGER IF NOT EXISTS productos_busqueda_ai AFTER INSERT ON productos_producto BEGIN
+        INSERT INTO productos_busqueda(rowid, nombre, descripcion, categoria)
+        VALUES (new.id, new.nombre, new.descripcion, new.categoria);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS productos_busqueda_ad AFTER DELETE ON productos_producto BEGIN
+        INSERT INTO productos_busqueda(productos_busqueda, rowid, nombre, descripcion, categoria)
+        VALUES ('delete', old.id, old.nombre, old.descripcion, old.categoria);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS productos_busqueda_au
+    AFTER UPDATE OF nombre, descripcion, categoria ON productos_producto BEGIN
+        INSERT INTO productos_busqueda(productos_busqueda, rowid, nombre, descripcion, categoria)
+        VALUES ('delete', old.id, old.nombre, old.descripcion, old.categoria);
+        INSERT INTO productos_busqueda(rowid, nombre, descripcion, categoria)
+        VALUES (new.id, new.nombre, new.descripcion, new.categoria);
+    END
+    """,
+    "INSERT INTO productos_busqueda(productos_busqueda) VALUES ('rebuild')",
+]
+
+
+def restaurar_triggers(apps, schema_editor):
+    # AddField reconstruye productos_producto en SQLite y se lleva los
+    # triggers del indice de busqueda (ver 0006)
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in TRIGGERS_BUSQUEDA:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0008_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='actualizado',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(restaurar_triggers, migrations.RunPython.noop),
+        migrations.RunPython(desde_creado, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,67 @@
-from django.db import models
+from collections import namedtuple
+from contextvars import ContextVar
+from functools import partial
+
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+from django.db.models import Avg, Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from . import cache_catalogo, cache_fragmentos, cache_productos, imagenes
+
+# Escrituras de productos que no pasan por save(): QuerySet.update(),
+# bulk_update() y el UPDATE de stock. ``ids`` es la lista de productos
+# modificados, o None si pueden ser todos (o demasiados para listarlos);
+# ``campos``, los campos escritos.
+productos_actualizados = Signal()
+
+# Campos que los listados del catalogo pueden mostrar desactualizados
+# (ver cache_catalogo)
+CAMPOS_SOLO_STOCK = frozenset({'stock', 'actualizado'})
 
 # Create your models here.
 
-from django.db import models
+class ProductoQuerySet(models.QuerySet):
+    """
+    Las escrituras en bloque tambien mantienen ``actualizado``.
+
+    ``update()`` no emite ``post_save``: despues de actualizar avisa con
+    ``productos_actualizados`` (con los ids leidos antes del UPDATE, salvo
+    que no haya filtro o pasen de ``cache_productos.MAX_INVALIDAR_POR_ID``).
+    ``update()`` sin argumentos solo marca los productos como modificados.
+    """
+
+    def update(self, **kwargs):
+        kwargs.setdefault('actualizado', timezone.now())
+        ids = None
+        if self.query.where:
+            ids = list(self.values_list('pk', flat=True)[:cache_productos.MAX_INVALIDAR_POR_ID + 1])
+            if len(ids) > cache_productos.MAX_INVALIDAR_POR_ID:
+                ids = None
+        filas = super().update(**kwargs)
+        if filas:
+            productos_actualizados.send(sender=self.model, ids=ids, campos=frozenset(kwargs))
+        return filas
+
+    update.alters_data = True
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        # bulk_update termina en update(), que emite la señal
+        objs = list(objs)
+        ahora = timezone.now()
+        for obj in objs:
+            obj.actualizado = ahora
+        if 'actualizado' not in fields:
+            fields = [*fields, 'actualizado']
+        return super().bulk_update(objs, fields, batch_size=batch_size)
+
+    bulk_update.alters_data = True
+
 
 class Producto(models.Model):
     nombre = models.CharField(max_length=120)
@@ -14,10 +72,78 @@ class Producto(models.Model):
     imagen = models.ImageField(upload_to="productos/")
     activo = models.BooleanField(default=True)
     creado = models.DateTimeField(auto_now_add=True)
+    # Ultima escritura del producto por cualquier camino (ver ProductoQuerySet);
+    # es el Last-Modified de producto_detalle
+    actualizado = models.DateTimeField(auto_now=True)
+
+    # Resumen de reseñas aprobadas (desnormalizado, ver actualizar_calificacion)
+    rating_avg = models.FloatField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+
+    objects = ProductoQuerySet.as_manager()
+
+    class Meta:
+        # Indices parciales (solo activos): en SQLite el filtro activo=True se
+        # compila como WHERE "activo", que un indice (activo, ...) no aprovecha
+        # pero un indice con condicion "activo" si
+        indexes = [
+            models.Index(fields=['categoria', 'creado'], condition=Q(activo=True), name='producto_cat_creado_idx'),
+            models.Index(fields=['categoria', 'precio'], condition=Q(activo=True), name='producto_cat_precio_idx'),
+            models.Index(fields=['creado'], condition=Q(activo=True), name='producto_activo_creado_idx'),
+            models.Index(fields=['precio'], condition=Q(activo=True), name='producto_activo_precio_idx'),
+            models.Index(fields=['nombre'], condition=Q(activo=True), name='producto_activo_nombre_idx'),
+            models.Index(fields=['rating_avg', 'rating_count', 'creado'], condition=Q(activo=True),
+                         name='producto_activo_rating_idx'),
+        ]
 
     def __str__(self):
         return self.nombre
     
+# Productos a recalcular al terminar un ResenaQuerySet.delete() (None fuera de el)
+_calificaciones_diferidas = ContextVar('calificaciones_diferidas', default=None)
+
+
+class ResenaQuerySet(models.QuerySet):
+    """
+    Las escrituras en bloque tambien mantienen el resumen de calificaciones.
+
+    ``update()`` no emite ``post_save``: recalcula con
+    ``actualizar_calificacion`` los productos de las reseñas afectadas, los
+    de antes y los de despues del UPDATE. ``delete()`` si emite
+    ``post_delete`` por cada reseña; ``resena_eliminada`` solo anota el
+    producto y se recalcula una vez al final. En los dos casos el recalculo
+    va en la misma transaccion que la escritura.
+    """
+
+    def update(self, **kwargs):
+        with transaction.atomic(using=self.db, savepoint=False):
+            resenas = dict(self.order_by().values_list('pk', 'producto_id'))
+            filas = super().update(**kwargs)
+            if filas:
+                afectados = set(resenas.values())
+                if 'producto' in kwargs or 'producto_id' in kwargs:
+                    afectados.update(Resena.objects.filter(pk__in=resenas).values_list('producto_id', flat=True))
+                actualizar_calificacion(*afectados)
+        return filas
+
+    update.alters_data = True
+
+    def delete(self):
+        afectados = set()
+        with transaction.atomic(using=self.db, savepoint=False):
+            token = _calificaciones_diferidas.set(afectados)
+            try:
+                resultado = super().delete()
+            finally:
+                _calificaciones_diferidas.reset(token)
+            if afectados:
+                actualizar_calificacion(*afectados)
+        return resultado
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class Resena(models.Model):
     producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='resenas')
     usuario = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -26,13 +152,29 @@ class Resena(models.Model):
     fecha = models.DateTimeField(auto_now_add=True)
     aprobada = models.BooleanField(default=False) #Requiere aprobacion del admin
 
+    objects = ResenaQuerySet.as_manager()
+
     class Meta:
         ordering = ['-fecha']
         verbose_name = 'Reseña'
         verbose_name_plural = 'Reseñas'
+        indexes = [
+            models.Index(fields=['producto', '-fecha'], condition=Q(aprobada=True), name='resena_aprobadas_idx'),
+        ]
     
     def __str__(self):
         return f'{self.usuario.username} - {self.producto.nombre} - ({self.calificacion} ★ )'
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Estado cargado, para saber en post_save si cambia el resumen del producto
+        instance._estado_original = instance._estado_calificacion()
+        return instance
+
+    def _estado_calificacion(self):
+        datos = self.__dict__
+        return (datos.get('producto_id'), datos.get('aprobada'), datos.get('calificacion'))
     
     def estrellas_html(self):
         estrellas_llenas = '★' * self.calificacion
@@ -59,6 +201,9 @@ class Testimonio(models.Model):
         ordering = ['-fecha']
         verbose_name = 'Testimonio'
         verbose_name_plural = 'Testimonios'
+        indexes = [
+            models.Index(fields=['-fecha'], condition=Q(activo=True, destacado=True), name='testimonio_portada_idx'),
+        ]
 
     def __str__(self):
         return f'{self.nombre} - ({self.red_social}) ({self.calificacion} ★ )'
@@ -68,28 +213,90 @@ class Testimonio(models.Model):
         estrellas_vacias = '☆' * (5 - self.calificacion)
         return estrellas_llenas + estrellas_vacias
 
+ResumenCarrito = namedtuple('ResumenCarrito', ['total_items', 'total_precio'])
+
 class Carrito(models.Model):
         usuario = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
-        session_key = models.CharField(max_length=40, null=True, blank=True)
+        session_key = models.CharField(max_length=40, null=True, blank=True, db_index=True)
         creado = models.DateTimeField(auto_now_add=True)
+        # Ultima actividad (ver tocar()); purgar_carritos borra por este campo
         actualizado = models.DateTimeField(auto_now=True)
 
         class Meta:
             verbose_name = 'Carrito'
             verbose_name_plural = 'Carritos'
+            indexes = [
+                models.Index(fields=['actualizado'], name='carrito_actualizado_idx'),
+            ]
 
         def __str__(self):
             if self.usuario:
                 return f'Carrito de {self.usuario.username}'
             return f'Carrito {self.id}'
         
+        @cached_property
+        def resumen(self):
+            """
+            Totales del carrito en una sola consulta agregada.
+
+            Queda memoizado en la instancia (y obtener_carrito reutiliza la
+            instancia durante la peticion); llamar a invalidar_resumen()
+            despues de modificar los items.
+            """
+            return ResumenCarrito(**self.items.aggregate(**self._totales()))
+
+        @staticmethod
+        def _totales():
+            return {
+                'total_items': Coalesce(Sum('cantidad'), 0),
+                'total_precio': Coalesce(Sum(F('cantidad') * F('producto__precio')), 0),
+            }
+
+        async def aresumen(self):
+            """Recalcula ``resumen`` con el ORM asincrono y lo deja memoizado."""
+            totales = await self.items.aaggregate(**self._totales())
+            self.__dict__['resumen'] = ResumenCarrito(**totales)
+            return self.resumen
+
+        def invalidar_resumen(self):
+            self.__dict__.pop('resumen', None)
+
+        def tocar(self):
+            """Marca actividad: los cambios en los items no guardan el carrito."""
+            self.actualizado = timezone.now()
+            Carrito.objects.filter(pk=self.pk).update(actualizado=self.actualizado)
+
+        async def atocar(self):
+            self.actualizado = timezone.now()
+            await Carrito.objects.filter(pk=self.pk).aupdate(actualizado=self.actualizado)
+
         @property
         def total_items(self):
-            return sum(item.cantidad for item in self.items.all())
+            return self.resumen.total_items
         
         @property
         def total_precio(self):
-            return sum(item.subtotal for item in self.items.all())
+            return self.resumen.total_precio
+
+        # Misma interfaz que carrito.CarritoSesion (carrito anonimo)
+        def obtener_o_crear_item(self, producto):
+            return ItemCarrito.objects.get_or_create(carrito=self, producto=producto, defaults={'cantidad': 1})
+
+        async def aobtener_o_crear_item(self, producto):
+            return await ItemCarrito.objects.aget_or_create(carrito=self, producto=producto, defaults={'cantidad': 1})
+
+        def item(self, item_id):
+            """Item ``item_id`` de este carrito (con su producto), o None."""
+            return self.items.select_related('producto').filter(pk=item_id).first()
+
+        async def aitem(self, item_id):
+            return await self.items.select_related('producto').filter(pk=item_id).afirst()
+
+        def items_con_producto(self):
+            return self.items.select_related('producto').all()
+
+        def vaciar(self):
+            self.items.all().delete()
         
 class ItemCarrito(models.Model):
     carrito = models.ForeignKey(Carrito, on_delete=models.CASCADE, related_name='items')
@@ -107,4 +314,119 @@ class ItemCarrito(models.Model):
     
     @property
     def subtotal(self):
-        return self.producto.precio * self.cantidad
\ No newline at end of file
+        return self.producto.precio * self.cantidad
+
+
+def actualizar_calificacion(*producto_ids):
+    """
+    Recalcula rating_avg y rating_count a partir de las reseñas aprobadas.
+
+    Se resuelve en un solo UPDATE con subconsultas; sin ids recalcula todo
+    el catalogo.
+    """
+    productos = Producto.objects.all()
+    if producto_ids:
+        productos = productos.filter(pk__in=producto_ids)
+    aprobadas = Resena.objects.filter(producto=OuterRef('pk'), aprobada=True).order_by()
+    actualizados = productos.update(
+        rating_avg=Coalesce(
+            Subquery(aprobadas.values('producto').annotate(promedio=Avg('calificacion')).values('promedio')),
+            Value(0.0),
+        ),
+        rating_count=Coalesce(
+            Subquery(aprobadas.values('producto').annotate(total=Count('id')).values('total')),
+            Value(0),
+        ),
+    )
+    return actualizados
+
+
+# Señales para mantener el resumen de calificaciones de Producto
+@receiver(post_save, sender=Resena)
+def resena_guardada(sender, instance, created, **kwargs):
+    original = getattr(instance, '_estado_original', (None, False, None))
+    actual = instance._estado_calificacion()
+    # Solo importan las reseñas que estaban o quedan aprobadas
+    if not (original[1] or actual[1]):
+        return
+    if original == actual:
+        # Mismo resumen, pero la reseña se ve en la pagina del producto
+        Producto.objects.filter(pk=instance.producto_id).update()
+        return
+    afectados = {instance.producto_id}
+    if original[0]:
+        afectados.add(original[0])
+    actualizar_calificacion(*afectados)
+    instance._estado_original = actual
+
+@receiver(post_delete, sender=Resena)
+def resena_eliminada(sender, instance, **kwargs):
+    if instance.aprobada:
+        diferidas = _calificaciones_diferidas.get()
+        if diferidas is not None:
+            diferidas.add(instance.producto_id)
+        else:
+            actualizar_calificacion(instance.producto_id)
+
+# Señales para invalidar los listados cacheados del catalogo y el cache de
+# cada producto (al confirmar: antes otra peticion volveria a cachear lo viejo)
+def _invalidar_productos(ids):
+    transaction.on_commit(cache_catalogo.invalidar_catalogo)
+    transaction.on_commit(partial(cache_productos.invalidar, ids))
+
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+def producto_modificado(sender, instance, **kwargs):
+    _invalidar_productos([instance.pk])
+
+@receiver(productos_actualizados, sender=Producto)
+def productos_modificados_en_bloque(sender, ids, campos=None, **kwargs):
+    if campos is not None and campos <= CAMPOS_SOLO_STOCK:
+        # Stock (checkout) o solo "modificado": los listados siguen valiendo
+        transaction.on_commit(cache_catalogo.marcar_modificado)
+        transaction.on_commit(partial(cache_productos.invalidar, ids))
+        return
+    _invalidar_productos(ids)
+
+# Fragmentos de la portada (ver views.home). La portada no muestra el stock:
+# un checkout no obliga a renderizarla de nuevo, cualquier otro UPDATE en
+# bloque (precio, calificaciones...) si
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+@receiver(productos_actualizados, sender=Producto)
+def producto_en_portada_modificado(sender, campos=None, **kwargs):
+    if campos is not None and campos <= CAMPOS_SOLO_STOCK:
+        return
+    transaction.on_commit(partial(cache_fragmentos.invalidar, cache_fragmentos.INICIO_PRODUCTOS))
+
+@receiver(post_save, sender=Testimonio)
+@receiver(post_delete, sender=Testimonio)
+def testimonio_modificado(sender, **kwargs):
+    transaction.on_commit(partial(cache_fragmentos.invalidar, cache_fragmentos.INICIO_TESTIMONIOS))
+
+
+def _generar_derivadas(nombre):
+    try:
+        imagenes.generar_derivadas(nombre)
+    except (OSError, ValueError):
+        # Imagen ilegible: la plantilla usa el original y el comando
+        # generar_derivadas la reintenta
+        pass
+    else:
+        imagenes.olvidar_srcset()
+
+
+@receiver(post_save, sender=Producto)
+@receiver(post_save, sender=Testimonio)
+def imagen_guardada(sender, instance, **kwargs):
+    # Derivadas WebP al confirmar; si ya existen solo cuesta listar el directorio
+    if instance.imagen:
+        transaction.on_commit(partial(_generar_derivadas, instance.imagen.name))
+
+# Al iniciar sesion el carrito pasa a ser el del usuario: se le suman las
+# lineas anonimas y la sesion guarda su nuevo total (ver productos.carrito)
+@receiver(user_logged_in)
+def fusionar_carrito_al_iniciar_sesion(sender, request, user, **kwargs):
+    if request is not None and hasattr(request, 'session'):
+        from .carrito import fusionar_carrito_sesion
+        fusionar_carrito_sesion(request, user)
@@ -0,0 +1,218 @@
+"""
+Paginacion por cursor (keyset) para el catalogo.
+
+En lugar de ``COUNT(*)`` + ``OFFSET n``, cada pagina se pide con un cursor
+opaco que contiene los valores de orden de la ultima (o primera) fila
+mostrada. La consulta filtra con una comparacion lexicografica sobre esos
+valores y siempre desempata por ``id``, asi que el coste no depende de la
+profundidad y el orden es estable aunque haya precios o nombres repetidos.
+"""
+from django.core import signing
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .models import Producto
+
+# Orden de cada modo del catalogo; el ultimo campo siempre es id
+ORDENES_KEYSET = {
+    'reciente': ('-creado', '-id'),
+    'precio_menor': ('precio', 'id'),
+    'precio_mayor': ('-precio', '-id'),
+    'nombre': ('nombre', 'id'),
+    'mejor_valorados': ('-rating_avg', '-rating_count', '-creado', '-id'),
+}
+
+SALT_CURSOR = 'productos.paginacion.cursor'
+
+SIGUIENTE = 'sig'
+ANTERIOR = 'ant'
+
+
+class CursorInvalido(Exception):
+    pass
+
+
+class PaginaKeyset:
+    """Pagina sin total: solo sabe si hay pagina anterior/siguiente."""
+
+    def __init__(self, objetos, cursor_siguiente, cursor_anterior):
+        self.object_list = objetos
+        self.cursor_siguiente = cursor_siguiente
+        self.cursor_anterior = cursor_anterior
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.cursor_siguiente is not None
+
+    def has_previous(self):
+        return self.cursor_anterior is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def _nombre_campo(campo):
+    return campo.lstrip('-')
+
+
+def codificar_cursor(objeto, campos, direccion):
+    valores = [
+        Producto._meta.get_field(_nombre_campo(campo)).value_to_string(objeto)
+        for campo in campos
+    ]
+    return signing.dumps({'v': valores, 'd': direccion}, salt=SALT_CURSOR, compress=True)
+
+
+def decodificar_cursor(cursor, campos):
+    """Devuelve (valores, direccion); lanza CursorInvalido si no es valido."""
+    try:
+        datos = signing.loads(cursor, salt=SALT_CURSOR)
+        valores = [
+            Producto._meta.get_field(_nombre_campo(campo)).to_python(valor)
+            for campo, valor in zip(campos, datos['v'], strict=True)
+        ]
+        direccion = datos['d']
+    except (signing.BadSignature, KeyError, TypeError, ValueError) as exc:
+        raise CursorInvalido(str(exc)) from exc
+    if direccion not in (SIGUIENTE, ANTERIOR):
+        raise CursorInvalido(direccion)
+    return valores, direccion
+
+
+def _invertir(campo):
+    return campo[1:] if campo.startswith('-') else f'-{campo}'
+
+
+def _filtro_posterior(campos, valores):
+    """
+    Q para "filas que van despues de ``valores``" segun ``campos``.
+
+    (a, b, id) > (x, y, z)  ==  a > x  OR  (a = x AND b > y)  OR  (a = x AND b = y AND id > z)
+    """
+    filtro = Q()
+    iguales = {}
+    for campo, valor in zip(campos, valores):
+        nombre = _nombre_campo(campo)
+        operador = 'lt' if campo.startswith('-') else 'gt'
+        filtro |= Q(**iguales, **{f'{nombre}__{operador}': valor})
+        iguales[nombre] = valor
+    return filtro
+
+
+def _consulta_pagina(queryset, orden, cursor, por_pagina):
+    """``(consulta, campos, direccion)`` de la pagina pedida con ``cursor``."""
+    campos = ORDENES_KEYSET[orden]
+    direccion = SIGUIENTE
+    if cursor:
+        valores, direccion = decodificar_cursor(cursor, campos)
+        if direccion == ANTERIOR:
+            campos_consulta = tuple(_invertir(campo) for campo in campos)
+        else:
+            campos_consulta = campos
+        queryset = queryset.filter(_filtro_posterior(campos_consulta, valores))
+    else:
+        campos_consulta = campos
+
+    return queryset.order_by(*campos_consulta)[:por_pagina + 1], campos, direccion
+
+
+def _pagina(filas, campos, direccion, cursor, por_pagina):
+    hay_mas = len(filas) > por_pagina
+    filas = filas[:por_pagina]
+    if direccion == ANTERIOR:
+        filas.reverse()
+
+    if not filas:
+        return PaginaKeyset([], None, None)
+
+    if direccion == SIGUIENTE:
+        hay_siguiente, hay_anterior = hay_mas, bool(cursor)
+    else:
+        hay_siguiente, hay_anterior = True, hay_mas
+
+    return PaginaKeyset(
+        filas,
+        codificar_cursor(filas[-1], campos, SIGUIENTE) if hay_siguiente else None,
+        codificar_cursor(filas[0], campos, ANTERIOR) if hay_anterior else None,
+    )
+
+
+def paginar(queryset, orden, cursor=None, por_pagina=12):
+    """
+    Devuelve una ``PaginaKeyset`` del ``queryset`` segun el modo ``orden``.
+
+    Solo ejecuta una consulta (``LIMIT por_pagina + 1``), sin COUNT.
+    """
+    consulta, campos, direccion = _consulta_pagina(queryset, orden, cursor, por_pagina)
+    return _pagina(list(consulta), campos, direccion, cursor, por_pagina)
+
+
+async def apaginar(queryset, orden, cursor=None, por_pagina=12):
+    """Version asincrona de ``paginar``."""
+    consulta, campos, direccion = _consulta_pagina(queryset, orden, cursor, por_pagina)
+    return _pagina([fila async for fila in consulta], campos, direccion, cursor, por_pagina)
+
+
+class ProductoCursorPagination(BasePagination):
+    """Paginacion por cursor para la API de productos (parametros ``orden`` y ``cursor``)."""
+
+    page_size = 12
+    page_size_query_param = 'limite'
+    max_page_size = 48
+    cursor_query_param = 'cursor'
+    orden_query_param = 'orden'
+
+    @classmethod
+    def orden(cls, request):
+        orden = request.query_params.get(cls.orden_query_param, 'reciente')
+        return orden if orden in ORDENES_KEYSET else 'reciente'
+
+    def por_pagina(self, request):
+        try:
+            return min(max(int(request.query_params[self.page_size_query_param]), 1), self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        try:
+            self.pagina = paginar(
+                queryset, self.orden(request),
+                cursor=request.query_params.get(self.cursor_query_param),
+                por_pagina=self.por_pagina(request),
+            )
+        except CursorInvalido:
+            raise NotFound('Cursor inválido.')
+        return list(self.pagina)
+
+    def _enlace(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self._enlace(self.pagina.cursor_siguiente),
+            'previous': self._enlace(self.pagina.cursor_anterior),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -2,6 +2,15 @@ from rest_framework import serializers
 from .models import Producto
 
 class ProductoSerializer(serializers.ModelSerializer):
+    """Con ``campos`` (``?fields=`` en la API) solo se serializan esos campos."""
+
     class Meta:
         model = Producto
-        fields = ["id", "nombre", "categoria","precio","imagen" ]
\ No newline at end of file
+        fields = ["id", "nombre", "categoria", "descripcion", "precio", "stock", "imagen",
+                  "rating_avg", "rating_count", "creado"]
+
+    def __init__(self, *args, campos=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if campos is not None:
+            for nombre in set(self.fields) - set(campos):
+                self.fields.pop(nombre)
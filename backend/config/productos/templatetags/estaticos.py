@@ -0,0 +1,23 @@
+from django import template
+from django.conf import settings
+from django.templatetags.static import static
+from django.utils.html import format_html_join
+
+from config.estaticos import paquetes
+
+register = template.Library()
+
+
+@register.simple_tag
+def paquete(nombre):
+    """
+    ``<link>`` o ``<script>`` del paquete ``nombre`` de PAQUETES_ESTATICOS.
+
+    En modo build apunta al archivo unico con hash; si no, a cada fuente.
+    """
+    fuentes = [nombre] if settings.ESTATICOS_COMPILADOS else paquetes()[nombre]
+    if nombre.endswith('.js'):
+        etiqueta = '<script src="{}"></script>'
+    else:
+        etiqueta = '<link rel="stylesheet" href="{}">'
+    return format_html_join('\n    ', etiqueta, ((static(fuente),) for fuente in fuentes))
@@ -0,0 +1,18 @@
+from django import template
+
+from productos import imagenes
+
+register = template.Library()
+
+
+@register.simple_tag
+def srcset(imagen):
+    """
+    ``srcset`` WebP de un ImageField, o '' si no tiene imagen.
+
+    Uso: ``{% srcset producto.imagen as fuentes %}`` y luego
+    ``<source type="image/webp" srcset="{{ fuentes }}" sizes="...">``.
+    """
+    if not imagen:
+        return ''
+    return imagenes.srcset(imagen.name)
@@ -1,3 +1,1294 @@
-from django.test import TestCase
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import unittest
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import Avg, F
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from PIL import Image
+
+from config import consultas_lentas, estaticos, metricas
+from . import busqueda, cache_catalogo, cache_fragmentos, cache_productos, facetas, imagenes, paginacion
+from . import views_async
+from .carrito import CLAVE_SESION_CARRITO, CLAVE_SESION_TOTAL, fusionar_carrito_sesion
+from .models import Carrito, ItemCarrito, Producto, Resena, Testimonio
+
+AJAX = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+# AsyncClient pasa los kwargs al scope ASGI; las cabeceras van aparte
+AJAX_ASYNC = {'headers': {'X-Requested-With': 'XMLHttpRequest'}}
+
+
+def crear_productos(cantidad, **kwargs):
+    datos = {'categoria': 'Perfumes', 'descripcion': 'Descripcion', 'stock': 10, 'imagen': 'productos/perfume1.png'}
+    datos.update(kwargs)
+    return [
+        Producto.objects.create(nombre=f'Producto {i}', precio=1000 * (i + 1), **datos)
+        for i in range(cantidad)
+    ]
+
+
+# Lineas de EXPLAIN QUERY PLAN que indican recorrer la tabla entera u ordenar
+# todas sus filas en una tabla temporal
+RECORRIDO_COMPLETO = re.compile(r'^SCAN (TABLE )?"?\w+"?( AS \w+)?$|TEMP B-TREE FOR ORDER BY')
+INDICE_BUSQUEDA = re.compile(r'^SCAN productos_busqueda VIRTUAL TABLE INDEX')
+
+
+class PlanesConsultaMixin:
+    """Ejecuta una vista y revisa el plan de cada SELECT que hizo."""
+
+    def planes(self, consultas):
+        with connection.cursor() as cursor:
+            for consulta in consultas:
+                sql = consulta['sql']
+                if not sql.startswith('SELECT'):
+                    continue
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                yield sql, [fila[3] for fila in cursor.fetchall()]
+
+    def comprobar_planes(self, url, cliente=None):
+        """
+        Una busqueda recorre las coincidencias del indice FTS5 y no puede
+        ordenarlas con un indice de la tabla: en esos planes se admite la
+        tabla temporal del ORDER BY (solo ordena las coincidencias), pero no
+        recorrer tablas enteras. Devuelve la respuesta.
+        """
+        cliente = cliente or self.client
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = cliente.get(url)
+        self.assertEqual(respuesta.status_code, 200, url)
+        for sql, plan in self.planes(consultas.captured_queries):
+            busqueda = any(INDICE_BUSQUEDA.search(paso) for paso in plan)
+            malos = [paso for paso in plan if RECORRIDO_COMPLETO.search(paso)
+                     and not (busqueda and 'TEMP B-TREE' in paso)]
+            self.assertEqual(malos, [], f'{url}: {sql}')
+        return respuesta
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN es de SQLite')
+class PlanesConsultaTests(PlanesConsultaMixin, TestCase):
+    """Las consultas principales de cada vista del catalogo usan indices."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.productos = crear_productos(30)
+        crear_productos(10, categoria='Cremas', activo=False)
+        cls.usuario = User.objects.create_user('planes')
+        Resena.objects.create(producto=cls.productos[0], usuario=cls.usuario, calificacion=5,
+                              comentario='Muy bueno', aprobada=True)
+        Testimonio.objects.create(nombre='Ana', comentario='Excelente', destacado=True)
+
+    def test_catalogo(self):
+        for url in (
+            reverse('home'),
+            reverse('productos'),
+            reverse('productos') + '?categoria=Perfumes',
+            *(reverse('productos') + f'?orden={orden}' for orden in
+              ('reciente', 'precio_menor', 'precio_mayor', 'nombre', 'mejor_valorados')),
+            *(reverse('productos') + f'?categoria=Perfumes&orden={orden}' for orden in
+              ('reciente', 'precio_menor', 'precio_mayor')),
+            reverse('productos') + '?paginacion=cursor&orden=precio_menor',
+            reverse('api_productos') + '?categoria=Perfumes&orden=precio_menor&fields=id,precio',
+        ):
+            with self.subTest(url=url):
+                cache.clear()
+                self.comprobar_planes(url)
+
+    def test_busqueda(self):
+        # Con resultados: un indice vacio daria planes triviales
+        for url in (
+            reverse('productos') + '?q=producto',
+            reverse('productos') + '?q=producto&orden=precio_menor',
+            reverse('productos') + '?q=producto&paginacion=cursor&orden=precio_menor',
+        ):
+            with self.subTest(url=url):
+                cache.clear()
+                self.assertTrue(self.comprobar_planes(url).context['productos'], url)
+        cache.clear()
+        respuesta = self.comprobar_planes(reverse('api_productos') + '?q=producto&fields=id')
+        self.assertTrue(respuesta.json()['results'])
+
+    def test_detalle_y_carrito(self):
+        self.client.force_login(self.usuario)
+        self.client.post(reverse('agregar_al_carrito', args=[self.productos[0].id]), **AJAX)
+        self.comprobar_planes(reverse('producto_detalle', args=[self.productos[0].id]))
+        self.comprobar_planes(reverse('ver_carrito'))
+
+
+@unittest.skipUnless(busqueda.indice_disponible(), 'el indice FTS5 es de SQLite')
+class BusquedaTests(TestCase):
+    """Indice FTS5: normalizacion y mantenimiento con cada escritura."""
+
+    def buscar(self, texto):
+        return sorted(busqueda.filtrar(Producto.objects.all(), texto).values_list('nombre', flat=True))
+
+    def test_ignora_mayusculas_y_tildes(self):
+        Producto.objects.create(nombre='Perfumé Cítrico', categoria='Perfumes', descripcion='Aroma fresco',
+                                precio=1000, stock=1, imagen='productos/perfume1.png')
+        crear_productos(2, categoria='Cremas')
+
+        for texto in ('perfume', 'PERFUMÉ', 'citrico', 'CÍTR', 'perf citr'):
+            with self.subTest(texto=texto):
+                self.assertEqual(self.buscar(texto), ['Perfumé Cítrico'])
+        self.assertEqual(self.buscar('aroma'), ['Perfumé Cítrico'])
+        self.assertEqual(self.buscar('perfume floral'), [])
+        # La sintaxis de FTS5 en el texto del usuario no rompe la consulta
+        self.assertEqual(self.buscar('"perfume" -('), ['Perfumé Cítrico'])
+        self.assertEqual(self.buscar('¿?'), [])
+
+    def test_indice_al_dia_con_cada_escritura(self):
+        producto = crear_productos(1)[0]
+        self.assertEqual(self.buscar('producto'), ['Producto 0'])
+
+        producto.nombre = 'Serum facial'
+        producto.save()
+        self.assertEqual(self.buscar('producto'), [])
+        self.assertEqual(self.buscar('serum'), ['Serum facial'])
+
+        Producto.objects.filter(pk=producto.pk).update(descripcion='Vitamina C')
+        self.assertEqual(self.buscar('vitamina'), ['Serum facial'])
+        self.assertEqual(self.buscar('descripcion'), [])
+
+        Producto.objects.bulk_create([Producto(nombre='Serum nocturno', categoria='Cremas', descripcion='Retinol',
+                                               precio=1, stock=1, imagen='productos/perfume1.png')])
+        self.assertEqual(self.buscar('serum'), ['Serum facial', 'Serum nocturno'])
+
+        producto.delete()
+        self.assertEqual(self.buscar('serum'), ['Serum nocturno'])
+        Producto.objects.all().delete()
+        self.assertEqual(self.buscar('serum'), [])
+
+    def test_paginacion_conserva_la_busqueda(self):
+        crear_productos(13)
+        respuesta = self.client.get(reverse('productos'), {'q': 'producto', 'orden': 'precio_menor', 'page': 2})
+        self.assertContains(respuesta, 'href="?q=producto&amp;orden=precio_menor&page=1"')
+
+
+class CalificacionesTests(TestCase):
+    """rating_avg y rating_count siguen a las reseñas aprobadas por cada camino."""
+
+    def setUp(self):
+        self.producto, self.otro = crear_productos(2)
+        self.usuario = User.objects.create_user('resenadora')
+
+    def resena(self, calificacion, aprobada=False, producto=None):
+        return Resena.objects.create(producto=producto or self.producto, usuario=self.usuario,
+                                     calificacion=calificacion, comentario='Comentario', aprobada=aprobada)
+
+    def comprobar(self, producto, promedio, cantidad):
+        producto.refresh_from_db()
+        self.assertAlmostEqual(producto.rating_avg, promedio)
+        self.assertEqual(producto.rating_count, cantidad)
+
+    def test_aprobar_desaprobar_editar_y_borrar(self):
+        self.resena(5, aprobada=True)
+        pendiente = self.resena(2)
+        self.comprobar(self.producto, 5, 1)
+
+        pendiente.aprobada = True
+        pendiente.save()
+        self.comprobar(self.producto, 3.5, 2)
+
+        pendiente.calificacion = 3
+        pendiente.save()
+        self.comprobar(self.producto, 4, 2)
+
+        # Pasar la reseña a otro producto recalcula los dos
+        pendiente.producto = self.otro
+        pendiente.save()
+        self.comprobar(self.producto, 5, 1)
+        self.comprobar(self.otro, 3, 1)
+
+        pendiente.aprobada = False
+        pendiente.save()
+        self.comprobar(self.otro, 0, 0)
+
+        pendiente.delete()
+        self.comprobar(self.otro, 0, 0)
+        Resena.objects.get(producto=self.producto).delete()
+        self.comprobar(self.producto, 0, 0)
+
+    def test_escrituras_en_bloque(self):
+        resenas = [self.resena(5), self.resena(3), self.resena(4, producto=self.otro)]
+        Resena.objects.filter(producto=self.producto).update(aprobada=True)
+        self.comprobar(self.producto, 4, 2)
+        self.comprobar(self.otro, 0, 0)
+
+        Resena.objects.filter(pk=resenas[1].pk).update(producto=self.otro, aprobada=True)
+        self.comprobar(self.producto, 5, 1)
+        self.comprobar(self.otro, 3, 1)
+
+        resenas[2].aprobada = True
+        Resena.objects.bulk_update(resenas[2:], ['aprobada'])
+        self.comprobar(self.otro, 3.5, 2)
+
+        # Un solo recalculo para todo el borrado
+        with CaptureQueriesContext(connection) as consultas:
+            Resena.objects.all().delete()
+        self.assertEqual(sum(c['sql'].startswith('UPDATE "productos_producto"') for c in consultas.captured_queries), 1)
+        self.comprobar(self.producto, 0, 0)
+        self.comprobar(self.otro, 0, 0)
+
+    def test_sin_aprobar_no_escribe_el_producto(self):
+        resena = self.resena(1)
+        with self.assertNumQueries(1):
+            resena.comentario = 'Editado'
+            resena.save()
+        self.comprobar(self.producto, 0, 0)
+
+    def test_list_editable_del_admin(self):
+        resenas = [self.resena(4), self.resena(2)]
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'clave'))
+        url = reverse('admin:productos_resena_changelist')
+
+        def aprobar(*aprobadas):
+            datos = {'form-TOTAL_FORMS': len(resenas), 'form-INITIAL_FORMS': len(resenas), '_save': 'Guardar'}
+            for i, resena in enumerate(resenas):
+                datos[f'form-{i}-id'] = resena.pk
+                if resena in aprobadas:
+                    datos[f'form-{i}-aprobada'] = 'on'
+            self.assertEqual(self.client.post(url, datos).status_code, 302)
+
+        aprobar(*resenas)
+        self.comprobar(self.producto, 3, 2)
+        aprobar(resenas[0])
+        self.comprobar(self.producto, 4, 1)
+        aprobar()
+        self.comprobar(self.producto, 0, 0)
+
+
+class CacheCatalogoTests(TestCase):
+    """Listados cacheados por version del catalogo, con contadores de aciertos y fallos."""
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('productos')
+
+    def consultas_productos(self, url):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        return sum('FROM "productos_producto"' in c['sql'] for c in consultas.captured_queries)
+
+    def test_aciertos_fallos_y_version(self):
+        producto = crear_productos(3)[0]
+        version = cache_catalogo.version_catalogo()
+
+        self.assertGreater(self.consultas_productos(self.url), 0)
+        self.assertEqual(self.consultas_productos(self.url), 0)
+        # Filtros equivalentes comparten la entrada
+        self.assertEqual(self.consultas_productos(self.url + '?page=1'), 0)
+        stats = cache_catalogo.estadisticas()
+        self.assertEqual((stats['aciertos'], stats['fallos']), (2, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            producto.nombre = 'Renombrado'
+            producto.save()
+        self.assertEqual(cache_catalogo.version_catalogo(), version + 1)
+        self.assertGreater(self.consultas_productos(self.url), 0)
+        self.assertContains(self.client.get(self.url), 'Renombrado')
+        self.assertEqual(cache_catalogo.estadisticas()['fallos'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            producto.delete()
+        self.assertEqual(cache_catalogo.version_catalogo(), version + 2)
+        self.assertNotContains(self.client.get(self.url), 'Renombrado')
+
+    def test_cambios_de_stock_no_invalidan_los_listados(self):
+        producto = crear_productos(2)[0]
+        version = cache_catalogo.version_catalogo()
+        modificado = cache_catalogo.ultima_modificacion()
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Producto.objects.filter(pk=producto.pk).update(stock=F('stock') - 1)
+        self.assertEqual(cache_catalogo.version_catalogo(), version)
+        self.assertEqual(self.consultas_productos(self.url), 0)
+        # La API (ETag y Last-Modified) y el detalle si lo ven
+        self.assertGreater(cache_catalogo.ultima_modificacion(), modificado)
+        self.assertEqual(cache_productos.obtener(producto.pk).stock, 9)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Producto.objects.filter(pk=producto.pk).update(precio=1)
+        self.assertEqual(cache_catalogo.version_catalogo(), version + 1)
+
+    def test_muchos_productos_cambian_la_generacion(self):
+        productos = crear_productos(cache_productos.MAX_INVALIDAR_POR_ID + 1)
+        for producto in productos[:2]:
+            cache_productos.obtener(producto.pk)
+        generacion = cache_productos._generacion()
+
+        with CaptureQueriesContext(connection) as consultas, self.captureOnCommitCallbacks(execute=True):
+            Producto.objects.filter(categoria='Perfumes').update(stock=0)
+        # Los ids se leen con LIMIT: no hace falta listarlos todos
+        self.assertIn('LIMIT', consultas.captured_queries[0]['sql'])
+        self.assertEqual(cache_productos._generacion(), generacion + 1)
+        self.assertEqual(cache_productos.obtener(productos[0].pk).stock, 0)
+
+    def test_sin_confirmar_no_invalida(self):
+        producto = crear_productos(1)[0]
+        version = cache_catalogo.version_catalogo()
+        with self.captureOnCommitCallbacks(execute=False):
+            producto.save()
+        self.assertEqual(cache_catalogo.version_catalogo(), version)
+
+    def test_comando_estadisticas(self):
+        # El comando corre en otro proceso: con un cache por proceso veria 0/0
+        self.assertNotIn('locmem', settings.CACHES['default']['BACKEND'])
+        crear_productos(1)
+        self.client.get(self.url)
+        self.client.get(self.url)
+        salida = StringIO()
+        call_command('estadisticas_cache_catalogo', '--reiniciar', stdout=salida)
+        self.assertIn('Aciertos: 1', salida.getvalue())
+        self.assertIn('Tasa de aciertos: 50.0%', salida.getvalue())
+        self.assertEqual(cache_catalogo.estadisticas()['aciertos'], 0)
+
+
+class PaginacionKeysetTests(TestCase):
+    """Cursor estable con empates en todos los campos de orden."""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Pocos valores distintos de precio, nombre, rating y fecha: casi todo empata
+        crear_productos(11)
+        Producto.objects.bulk_update([
+            Producto(pk=pk, nombre=f'Producto {i % 2}', precio=1000 * (i % 3),
+                     rating_avg=(i % 2) * 4.5, rating_count=i % 2)
+            for i, pk in enumerate(Producto.objects.values_list('pk', flat=True))
+        ], ['nombre', 'precio', 'rating_avg', 'rating_count'])
+        Producto.objects.filter(pk__gt=Producto.objects.order_by('pk')[5].pk).update(creado=timezone.now())
+
+    def recorrer(self, orden, por_pagina=3):
+        """Ids de cada pagina hacia adelante y de vuelta hacia atras con los cursores."""
+        adelante, pagina = [], paginacion.paginar(Producto.objects.all(), orden, por_pagina=por_pagina)
+        while True:
+            adelante.append([p.pk for p in pagina])
+            if not pagina.has_next():
+                break
+            pagina = paginacion.paginar(Producto.objects.all(), orden, pagina.cursor_siguiente, por_pagina)
+        atras = [[p.pk for p in pagina]]
+        while pagina.has_previous():
+            pagina = paginacion.paginar(Producto.objects.all(), orden, pagina.cursor_anterior, por_pagina)
+            atras.insert(0, [p.pk for p in pagina])
+        return adelante, atras
+
+    def test_ida_y_vuelta_en_cada_orden(self):
+        for orden, campos in paginacion.ORDENES_KEYSET.items():
+            with self.subTest(orden=orden):
+                esperado = list(Producto.objects.order_by(*campos).values_list('pk', flat=True))
+                adelante, atras = self.recorrer(orden)
+                self.assertEqual(sum(adelante, []), esperado)
+                self.assertEqual(atras, adelante)
+
+    def test_desempata_por_id(self):
+        mismos = list(Producto.objects.filter(precio=0).order_by('pk').values_list('pk', flat=True))
+        self.assertGreater(len(mismos), 3)
+        adelante, _ = self.recorrer('precio_menor', por_pagina=2)
+        self.assertEqual(sum(adelante, [])[:len(mismos)], mismos)
+
+    def test_cursor_invalido(self):
+        for cursor in ('basura', paginacion.codificar_cursor(Producto.objects.first(), ('precio', 'id'), 'sig')):
+            with self.subTest(cursor=cursor), self.assertRaises(paginacion.CursorInvalido):
+                paginacion.paginar(Producto.objects.all(), 'mejor_valorados', cursor)
+
+
+class FacetasTests(TestCase):
+    """Categorias con su numero de productos activos, sin consultas mientras no cambie el catalogo."""
+
+    def setUp(self):
+        cache.clear()
+        # La version vuelve a 1 con el cache vacio: que no sirva lo de otra prueba
+        facetas._facetas_en_memoria = (None, None)
+        crear_productos(3)
+        crear_productos(2, categoria='Cremas')
+        crear_productos(1, activo=False)
+        crear_productos(2, categoria='Maquillaje', activo=False)
+
+    def test_conteos(self):
+        with self.assertNumQueries(1):
+            datos = facetas.calcular()
+        self.assertEqual(datos['categorias'], [{'nombre': 'Cremas', 'total': 2}, {'nombre': 'Perfumes', 'total': 3}])
+        self.assertEqual(datos['total'], 5)
+
+    def test_barra_lateral_sin_consultas(self):
+        url = reverse('productos')
+        respuesta = self.client.get(url)
+        self.assertEqual(respuesta.context['total_productos'], 5)
+        self.assertEqual([c['nombre'] for c in respuesta.context['categorias']], ['Cremas', 'Perfumes'])
+        with self.assertNumQueries(0):
+            self.client.get(url)
+        # Otro listado hace sus consultas, pero las facetas salen de memoria
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get(url, {'categoria': 'Cremas'})
+        self.assertFalse(any('GROUP BY' in c['sql'] for c in consultas.captured_queries))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            crear_productos(1, categoria='Cremas')
+        self.assertEqual(self.client.get(url).context['categorias'][0], {'nombre': 'Cremas', 'total': 3})
+
+
+class ResumenCarritoTests(TestCase):
+    """Los totales del carrito se calculan con una consulta, sin importar su tamaño."""
+
+    def preparar_carrito(self, lineas, usuario=None):
+        """Carrito con ``lineas`` productos; devuelve los ids del primer y ultimo item."""
+        if usuario is not None:
+            self.client.force_login(usuario)
+        respuesta = self.client.post(reverse('agregar_al_carrito', args=[self.productos[0].id]), **AJAX)
+        self.assertTrue(respuesta.json()['success'])
+
+        if usuario is None:
+            # Carrito anonimo: las lineas viven en la sesion, el id del item es el del producto
+            session = self.client.session
+            session[CLAVE_SESION_CARRITO] = {
+                **session[CLAVE_SESION_CARRITO],
+                **{str(producto.id): 2 for producto in self.productos[1:lineas]},
+            }
+            session.save()
+            return self.productos[0].id, self.productos[lineas - 1].id
+
+        carrito = Carrito.objects.get(usuario=usuario)
+        ItemCarrito.objects.bulk_create(
+            ItemCarrito(carrito=carrito, producto=producto, cantidad=2)
+            for producto in self.productos[1:lineas]
+        )
+        ids = list(carrito.items.order_by('id').values_list('id', flat=True))
+        return ids[0], ids[-1]
+
+    def contar_consultas(self, metodo, url, **kwargs):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = getattr(self.client, metodo)(url, **kwargs)
+        self.assertLess(respuesta.status_code, 400)
+        return len(consultas)
+
+    def consultas_por_vista(self, lineas, usuario=None):
+        self.client.logout()
+        self.client.cookies.clear()
+        item, ultimo = self.preparar_carrito(lineas, usuario)
+        return {
+            'ver_carrito': self.contar_consultas('get', reverse('ver_carrito')),
+            'agregar': self.contar_consultas('post', reverse('agregar_al_carrito', args=[self.productos[0].id]), **AJAX),
+            'actualizar': self.contar_consultas('post', reverse('actualizar_cantidad', args=[item]), data={'cantidad': 3}, **AJAX),
+            'eliminar': self.contar_consultas('post', reverse('eliminar_del_carrito', args=[ultimo]), **AJAX),
+            'contador': self.contar_consultas('get', reverse('contador_carrito')),
+        }
+
+    def test_consultas_constantes_segun_tamano_del_carrito(self):
+        self.productos = crear_productos(40)
+        pequeno = self.consultas_por_vista(1, User.objects.create_user('uno'))
+        grande = self.consultas_por_vista(40, User.objects.create_user('cuarenta'))
+
+        self.assertEqual(pequeno, grande)
+
+    def test_consultas_constantes_carrito_anonimo(self):
+        self.productos = crear_productos(40)
+        # Con dos lineas: al quitar la unica linea no queda nada que consultar
+        self.assertEqual(self.consultas_por_vista(2), self.consultas_por_vista(40))
+
+    def test_resumen_suma_cantidades_y_precios(self):
+        productos = crear_productos(3)
+        carrito = Carrito.objects.create(session_key='abc')
+        for producto in productos:
+            ItemCarrito.objects.create(carrito=carrito, producto=producto, cantidad=2)
+
+        with self.assertNumQueries(1):
+            resumen = carrito.resumen
+            self.assertEqual(carrito.total_items, 6)
+            self.assertEqual(carrito.total_precio, 2 * (1000 + 2000 + 3000))
+        self.assertEqual(resumen, (6, 12000))
+
+    def test_carrito_vacio(self):
+        carrito = Carrito.objects.create(session_key='vacio')
+        self.assertEqual(carrito.resumen, (0, 0))
+
+
+class CarritoAnonimoTests(TestCase):
+    """El carrito anonimo vive en la sesion y se fusiona al iniciar sesion."""
+
+    def test_agregar_sin_sesion_iniciada_no_crea_filas(self):
+        producto, otro = crear_productos(2)
+        for destino in (producto, producto, otro):
+            self.client.post(reverse('agregar_al_carrito', args=[destino.id]), **AJAX)
+
+        self.assertFalse(Carrito.objects.exists())
+        self.assertFalse(ItemCarrito.objects.exists())
+        self.assertEqual(self.client.get(reverse('contador_carrito')).json(), {'total_items': 3})
+        respuesta = self.client.get(reverse('ver_carrito'))
+        self.assertEqual([(i.producto, i.cantidad) for i in respuesta.context['items']], [(producto, 2), (otro, 1)])
+        self.assertEqual(respuesta.context['total'], 2 * 1000 + 2000)
+
+    def test_ver_carrito_vacio_no_crea_sesion(self):
+        self.client.get(reverse('ver_carrito'))
+        self.assertNotIn('sessionid', self.client.cookies)
+
+    def test_login_fusiona_con_el_carrito_del_usuario(self):
+        comun, nuevo, eliminado = crear_productos(3)
+        usuario = User.objects.create_user('ana', password='secreta-123')
+        carrito = Carrito.objects.create(usuario=usuario)
+        ItemCarrito.objects.create(carrito=carrito, producto=comun, cantidad=1)
+        for destino in (comun, comun, nuevo, eliminado):
+            self.client.post(reverse('agregar_al_carrito', args=[destino.id]), **AJAX)
+        eliminado.delete()
+
+        self.assertTrue(self.client.login(username='ana', password='secreta-123'))
+
+        cantidades = dict(carrito.items.values_list('producto__nombre', 'cantidad'))
+        self.assertEqual(cantidades, {comun.nombre: 3, nuevo.nombre: 1})
+        self.assertNotIn(CLAVE_SESION_CARRITO, self.client.session)
+        # El total fusionado queda en la sesion: el contador no vuelve a sumar
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(self.client.get(reverse('contador_carrito')).json(), {'total_items': 4})
+        self.assertFalse(any('productos_itemcarrito' in c['sql'] for c in consultas.captured_queries))
+
+    def test_fusion_con_un_solo_insert(self):
+        productos = crear_productos(30)
+        usuario = User.objects.create_user('beto')
+        Carrito.objects.create(usuario=usuario)
+        request = RequestFactory().get('/')
+        request.session = SessionStore()
+        request.session[CLAVE_SESION_CARRITO] = {str(p.id): 1 for p in productos}
+
+        with CaptureQueriesContext(connection) as consultas:
+            fusionadas = fusionar_carrito_sesion(request, usuario)
+
+        self.assertEqual(fusionadas, 30)
+        self.assertEqual(len(consultas), 4)  # carrito del usuario + upsert + actividad + total
+        self.assertEqual(request.session[CLAVE_SESION_TOTAL], 30)
+        self.assertEqual(ItemCarrito.objects.filter(carrito__usuario=usuario).count(), 30)
+
+
+class ContadorCarritoTests(TestCase):
+    """El contador del header no escribe: ni sesiones ni filas de Carrito."""
+
+    def setUp(self):
+        cache.clear()
+        self.producto = crear_productos(1)[0]
+        self.paginas = [reverse('home'), reverse('productos'), reverse('producto_detalle', args=[self.producto.id])]
+
+    def contador(self, respuesta):
+        return re.search(r'id="carrito-contador">(\d+)<', respuesta.content.decode()).group(1)
+
+    def test_anonimo_sin_sesion(self):
+        for url in self.paginas:
+            with self.subTest(url=url):
+                self.assertEqual(self.contador(self.client.get(url)), '0')
+        self.assertEqual(self.client.get(reverse('contador_carrito')).json(), {'total_items': 0})
+        self.assertNotIn('sessionid', self.client.cookies)
+        self.assertFalse(Session.objects.exists())
+        self.assertFalse(Carrito.objects.exists())
+
+    def test_anonimo_con_lineas_en_la_sesion(self):
+        self.client.post(reverse('agregar_al_carrito', args=[self.producto.id]), **AJAX)
+        self.client.post(reverse('agregar_al_carrito', args=[self.producto.id]), **AJAX)
+        sesiones = Session.objects.count()
+        for url in self.paginas:
+            with self.subTest(url=url):
+                self.assertEqual(self.contador(self.client.get(url)), '2')
+        self.assertEqual(Session.objects.count(), sesiones)
+        self.assertFalse(Carrito.objects.exists())
+
+    def test_usuario_sin_carrito(self):
+        self.client.force_login(User.objects.create_user('ana'))
+        for url in self.paginas:
+            with self.subTest(url=url):
+                self.assertEqual(self.contador(self.client.get(url)), '0')
+        self.assertEqual(self.client.get(reverse('contador_carrito')).json(), {'total_items': 0})
+        self.assertFalse(Carrito.objects.exists())
+
+    def test_usuario_con_total_en_la_sesion(self):
+        self.client.force_login(User.objects.create_user('beto'))
+        self.client.post(reverse('agregar_al_carrito', args=[self.producto.id]), **AJAX)
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(self.client.get(reverse('contador_carrito')).json(), {'total_items': 1})
+        self.assertFalse(any('productos_itemcarrito' in c['sql'] for c in consultas.captured_queries))
+
+
+class PurgarCarritosTests(TestCase):
+
+    def crear_carrito(self, dias, usuario=None, lineas=2):
+        carrito = Carrito.objects.create(usuario=usuario, session_key=None if usuario else f'sesion{dias}')
+        ItemCarrito.objects.bulk_create(
+            ItemCarrito(carrito=carrito, producto=producto) for producto in self.productos[:lineas]
+        )
+        Carrito.objects.filter(pk=carrito.pk).update(actualizado=timezone.now() - timedelta(days=dias))
+        return carrito
+
+    def test_borra_por_lotes_solo_lo_vencido(self):
+        self.productos = crear_productos(2)
+        viejos = [self.crear_carrito(10 + i) for i in range(5)]
+        reciente = self.crear_carrito(1)
+        usuario_activo = self.crear_carrito(30, User.objects.create_user('activo'))
+        usuario_inactivo = self.crear_carrito(120, User.objects.create_user('inactivo'))
+        ahora = timezone.now()
+        Session.objects.create(session_key='vencida', session_data='', expire_date=ahora - timedelta(days=1))
+        Session.objects.create(session_key='vigente', session_data='', expire_date=ahora + timedelta(days=1))
+
+        salida = StringIO()
+        call_command('purgar_carritos', lote=2, pausa=0, stdout=salida)
+
+        restantes = set(Carrito.objects.values_list('pk', flat=True))
+        self.assertEqual(restantes, {reciente.pk, usuario_activo.pk})
+        self.assertFalse(ItemCarrito.objects.filter(carrito__in=viejos + [usuario_inactivo]).exists())
+        self.assertEqual(list(Session.objects.values_list('pk', flat=True)), ['vigente'])
+        self.assertIn('Borrados: 6 carritos, 12 items, 1 sesiones', salida.getvalue())
+
+    def test_la_actividad_del_carrito_lo_mantiene(self):
+        self.productos = crear_productos(1)
+        usuario = User.objects.create_user('ana')
+        carrito = self.crear_carrito(200, usuario, lineas=0)
+        self.client.force_login(usuario)
+        self.client.post(reverse('agregar_al_carrito', args=[self.productos[0].id]), **AJAX)
+
+        call_command('purgar_carritos', stdout=StringIO())
+
+        self.assertTrue(Carrito.objects.filter(pk=carrito.pk).exists())
+
+
+class SembrarDatosTests(TestCase):
+
+    def test_siembra_coherente(self):
+        from pedidos.models import ContadorPedidos, ItemPedido, Pedido, costo_envio
+        from pedidos.numeracion import AsignadorNumeros
+
+        salida = StringIO()
+        call_command('sembrar_datos', productos=50, usuarios=40, resenas=300, testimonios=10,
+                     carritos=15, pedidos=700, lote=200, clave='clave-carga', forzar=True, stdout=salida)
+
+        self.assertIn('700 pedidos', salida.getvalue())
+        self.assertEqual(Producto.objects.count(), 50)
+        self.assertEqual(User.objects.filter(perfil__isnull=False).count(), 40)
+        self.assertEqual(Carrito.objects.count(), 15)
+        self.assertEqual(Pedido.objects.count(), 700)
+        self.assertFalse(Pedido.objects.filter(items__isnull=True).exists())
+        self.assertEqual(Pedido.objects.values('numero_pedido').distinct().count(), 700)
+        # Las fechas son pasadas, no la del momento de la insercion
+        self.assertLess(Pedido.objects.earliest('creado').creado, timezone.now() - timedelta(days=30))
+        self.assertTrue(ItemPedido.objects.filter(pedido__creado=F('creado')).exists())
+        # Envio calculado como en el checkout
+        for subtotal, envio, total in Pedido.objects.values_list('subtotal', 'costo_envio', 'total')[:100]:
+            self.assertEqual((envio, total), (costo_envio(subtotal), subtotal + envio))
+
+        # El contador quedo al dia: un numero nuevo no choca con los sembrados
+        self.assertEqual(sum(ContadorPedidos.objects.values_list('ultimo', flat=True)), 700)
+        self.assertFalse(Pedido.objects.filter(numero_pedido=AsignadorNumeros().siguiente()).exists())
+
+        # El resumen de calificaciones refleja las reseñas aprobadas
+        producto = Producto.objects.order_by('-rating_count').first()
+        aprobadas = producto.resenas.filter(aprobada=True)
+        self.assertEqual(producto.rating_count, aprobadas.count())
+        self.assertAlmostEqual(producto.rating_avg, aprobadas.aggregate(Avg('calificacion'))['calificacion__avg'])
+
+        usuario = User.objects.filter(pedidos__isnull=False).first()
+        self.assertTrue(self.client.login(username=usuario.username, password='clave-carga'))
+
+
+class DerivadasImagenTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        ajustes = override_settings(MEDIA_ROOT=media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        imagenes.olvidar_srcset()
+        self.addCleanup(imagenes.olvidar_srcset)
+
+    def subir_producto(self, ancho, alto):
+        contenido = BytesIO()
+        Image.new('RGB', (ancho, alto), 'purple').save(contenido, 'PNG')
+        imagen = SimpleUploadedFile('foto.png', contenido.getvalue(), content_type='image/png')
+        with self.captureOnCommitCallbacks(execute=True):
+            return crear_productos(1, imagen=imagen)[0]
+
+    def test_al_subir_genera_webp_sin_ampliar(self):
+        producto = self.subir_producto(500, 250)
+
+        self.assertEqual(imagenes.derivadas_existentes(producto.imagen.name), [160, 320, 500])
+        for ancho in (160, 320, 500):
+            with default_storage.open(imagenes.ruta_derivada(producto.imagen.name, ancho)) as archivo:
+                derivada = Image.open(archivo)
+                self.assertEqual(derivada.format, 'WEBP')
+                self.assertEqual(derivada.width, ancho)
+        self.assertFalse(default_storage.exists(imagenes.ruta_derivada(producto.imagen.name, 640)))
+
+    def test_original_grande_se_queda_en_el_mayor_ancho(self):
+        producto = self.subir_producto(1500, 100)
+        self.assertEqual(imagenes.derivadas_existentes(producto.imagen.name), list(imagenes.ANCHOS))
+
+    def test_tag_srcset(self):
+        producto = self.subir_producto(400, 400)
+        html = Template('{% load imagenes %}{% srcset producto.imagen %}').render(Context({'producto': producto}))
+
+        self.assertEqual(html.count('.webp'), 3)
+        self.assertIn('-160w.webp 160w', html)
+        self.assertIn('-400w.webp 400w', html)
+
+    def test_imagen_inexistente_no_rompe_la_plantilla(self):
+        html = Template('{% load imagenes %}[{% srcset imagen %}]').render(Context({'imagen': None}))
+        self.assertEqual(html, '[]')
+        self.assertEqual(imagenes.srcset('productos/no-existe.png'), '')
+
+    def test_srcset_no_genera_y_no_memoriza_los_fallos(self):
+        nombre = 'productos/tarde.png'
+        contenido = BytesIO()
+        Image.new('RGB', (200, 100), 'purple').save(contenido, 'PNG')
+        default_storage.save(nombre, contenido)
+
+        self.assertEqual(imagenes.srcset(nombre), '')
+        self.assertEqual(imagenes.derivadas_existentes(nombre), [])
+        imagenes.generar_derivadas(nombre)
+        self.assertEqual(imagenes.srcset(nombre).count('.webp'), 2)
+        self.assertIn('-200w.webp 200w', imagenes.srcset(nombre))
+
+    def test_regenerar_olvida_el_srcset_memorizado(self):
+        producto = self.subir_producto(200, 100)
+        nombre = producto.imagen.name
+        self.assertEqual(imagenes.srcset(nombre).count('.webp'), 2)
+        for ancho in (160, 200):
+            default_storage.delete(imagenes.ruta_derivada(nombre, ancho))
+        with self.captureOnCommitCallbacks(execute=True):
+            producto.save()
+        self.assertEqual(imagenes._srcset_generado.cache_info().currsize, 0)
+        self.assertTrue(default_storage.exists(imagenes.ruta_derivada(nombre, 160)))
+
+
+class EstaticosCompiladosTests(TestCase):
+    """collectstatic en modo build: hash, paquetes, .gz y cache inmutable."""
+
+    def setUp(self):
+        destino = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, destino)
+        ajustes = override_settings(
+            STATIC_ROOT=destino,
+            ESTATICOS_COMPILADOS=True,
+            STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+                'staticfiles': {'BACKEND': 'config.estaticos.EstaticosComprimidos'},
+            },
+        )
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        estaticos.nombres_con_hash.cache_clear()
+        self.addCleanup(estaticos.nombres_con_hash.cache_clear)
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def pedir(self, url, codificacion=''):
+        request = RequestFactory().get(url, HTTP_ACCEPT_ENCODING=codificacion)
+        respuesta = estaticos.servir_estatico(request, url.removeprefix('/static/'))
+        self.addCleanup(respuesta.close)
+        return respuesta
+
+    def test_paquete_con_hash_se_sirve_comprimido_e_inmutable(self):
+        html = Template("{% load estaticos %}{% paquete 'css/paquete-inicio.css' %}").render(Context())
+        url = html.split('href="')[1].split('"')[0]
+        self.assertRegex(url, r'^/static/css/paquete-inicio\.[0-9a-f]{12}\.css$')
+
+        respuesta = self.pedir(url, 'gzip, br')
+        self.assertEqual(respuesta['Content-Encoding'], 'gzip')
+        self.assertEqual(respuesta['Cache-Control'], estaticos.CACHE_INMUTABLE)
+        self.assertIn('Accept-Encoding', respuesta['Vary'])
+
+        sin_compresion = self.pedir(url)
+        self.assertFalse(sin_compresion.has_header('Content-Encoding'))
+        self.assertLess(int(respuesta['Content-Length']), int(sin_compresion['Content-Length']))
+
+    def test_nombres_sin_hash_se_revalidan(self):
+        respuesta = self.pedir('/static/css/styles.css', 'gzip')
+        self.assertEqual(respuesta['Cache-Control'], estaticos.CACHE_REVALIDAR)
+
+
+class MetricasTests(TestCase):
+    """Middleware de metricas y su exposicion en formato Prometheus."""
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        ajustes = override_settings(METRICAS_DIRECTORIO=directorio)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.directorio = directorio
+        registro_original = metricas._registro
+        metricas._registro = metricas.Registro()
+        self.addCleanup(setattr, metricas, '_registro', registro_original)
+
+    def valor(self, texto, serie):
+        coincidencia = re.search(rf'^{re.escape(serie)} (\S+)$', texto, re.MULTILINE)
+        self.assertIsNotNone(coincidencia, serie)
+        return float(coincidencia.group(1))
+
+    def test_registra_latencia_consultas_y_tamano_por_vista(self):
+        crear_productos(3)
+        for _ in range(2):
+            self.client.get(reverse('productos'))
+        self.client.get('/no-existe/')
+
+        texto = self.client.get(reverse('metricas')).content.decode()
+
+        self.assertEqual(self.valor(texto, 'vgl_peticiones_total{vista="productos",metodo="GET",estado="2xx"}'), 2)
+        self.assertEqual(self.valor(texto, 'vgl_peticiones_total{vista="<sin_ruta>",metodo="GET",estado="4xx"}'), 1)
+        self.assertEqual(self.valor(texto, 'vgl_peticion_duracion_segundos_count{vista="productos",metodo="GET"}'), 2)
+        self.assertEqual(
+            self.valor(texto, 'vgl_peticion_duracion_segundos_bucket{vista="productos",metodo="GET",le="+Inf"}'), 2,
+        )
+        self.assertGreater(self.valor(texto, 'vgl_peticion_consultas_sql_sum{vista="productos",metodo="GET"}'), 0)
+        self.assertGreater(self.valor(texto, 'vgl_peticion_sql_segundos_sum{vista="productos",metodo="GET"}'), 0)
+        self.assertGreater(self.valor(texto, 'vgl_respuesta_bytes_sum{vista="productos",metodo="GET"}'), 1000)
+        # La propia vista de metricas no se mide
+        self.assertNotIn('vista="metricas"', texto)
+
+    def test_suma_los_archivos_de_todos_los_procesos(self):
+        otro = metricas.Registro()
+        otro.peticion('home', 'GET', '2xx', 0.02, 3, 0.001, 5000)
+        with open(f'{self.directorio}/otro-proceso.json', 'w') as salida:
+            json.dump(otro.exportar(), salida)
+        self.client.get(reverse('home'))
+
+        texto = self.client.get(reverse('metricas')).content.decode()
+
+        self.assertEqual(self.valor(texto, 'vgl_peticiones_total{vista="home",metodo="GET",estado="2xx"}'), 2)
+        self.assertEqual(self.valor(texto, 'vgl_peticion_consultas_sql_count{vista="home",metodo="GET"}'), 2)
+
+    def test_solo_staff_o_localhost(self):
+        url = reverse('metricas')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='203.0.113.5').status_code, 404)
+        # Detras de un proxy local, REMOTE_ADDR no identifica al cliente
+        self.assertEqual(self.client.get(url, HTTP_X_FORWARDED_FOR='203.0.113.5').status_code, 404)
+
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='203.0.113.5').status_code, 200)
+
+    async def test_volcado_asincrono_fuera_del_event_loop(self):
+        hilos = []
+        volcar = metricas.volcar
+
+        def volcar_registrando(*args, **kwargs):
+            hilos.append(threading.current_thread())
+            return volcar(*args, **kwargs)
+
+        metricas.volcar = volcar_registrando
+        self.addCleanup(setattr, metricas, 'volcar', volcar)
+        with override_settings(METRICAS_INTERVALO=0):
+            await self.async_client.get('/carrito/contador/')
+
+        self.assertEqual(len(hilos), 1)
+        self.assertIsNot(hilos[0], threading.current_thread())
+        self.assertTrue(any(nombre.endswith('.json') for nombre in os.listdir(self.directorio)))
+
+
+class DetalleProductoTests(TestCase):
+    """``actualizado`` en cada escritura, cache por producto y GET condicional del detalle."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_actualizado_en_todas_las_escrituras(self):
+        producto = crear_productos(1)[0]
+        marcas = [producto.actualizado]
+
+        def marca():
+            marcas.append(Producto.objects.get(pk=producto.pk).actualizado)
+            self.assertGreater(marcas[-1], marcas[-2])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Producto.objects.filter(pk=producto.pk).update(stock=F('stock') - 1)
+        marca()
+        producto.precio = 500
+        Producto.objects.bulk_update([producto], ['precio'])
+        marca()
+        self.assertEqual(producto.actualizado, marcas[-1])
+        usuario = User.objects.create_user('resenadora')
+        resena = Resena.objects.create(producto=producto, usuario=usuario, calificacion=4, comentario='Bien')
+        self.assertEqual(Producto.objects.get(pk=producto.pk).actualizado, marcas[-1])
+        resena.aprobada = True
+        resena.save()
+        marca()
+        # Editar el texto no cambia el resumen, pero si la pagina
+        resena.comentario = 'Muy bien'
+        resena.save()
+        marca()
+
+    def test_cache_por_producto(self):
+        producto = crear_productos(1)[0]
+        url = reverse('producto_detalle', args=[producto.id])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get(url)
+        self.assertFalse(any('FROM "productos_producto"' in c['sql'] for c in consultas.captured_queries))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Producto.objects.filter(pk=producto.pk).update(stock=3)
+        self.assertEqual(self.client.get(url).context['producto'].stock, 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            producto.delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_revalidacion_con_etag_y_last_modified(self):
+        producto = crear_productos(1)[0]
+        url = reverse('producto_detalle', args=[producto.id])
+        respuesta = self.client.get(url)
+        etag, modificado = respuesta['ETag'], respuesta['Last-Modified']
+        self.assertIn('private', respuesta['Cache-Control'])
+
+        # Sin sesion y con el producto en cache no se consulta nada ni se renderiza
+        with self.assertNumQueries(0):
+            respuesta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 304)
+        self.assertFalse(respuesta.templates)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=modificado).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Producto.objects.filter(pk=producto.pk).update(stock=0)
+        respuesta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        etag = respuesta['ETag']
+
+        # Con usuario la cabecera es personal: otra ETag y sin Last-Modified
+        self.client.force_login(User.objects.create_user('ana'))
+        respuesta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotIn('Last-Modified', respuesta)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=respuesta['ETag']).status_code, 304)
+
+
+class FragmentosPortadaTests(TestCase):
+    """Secciones de la portada cacheadas, invalidadas por señales y sin estampidas."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_portada_cacheada_e_invalidada_por_seccion(self):
+        producto = crear_productos(1)[0]
+        Testimonio.objects.create(nombre='Carla', comentario='Excelente', destacado=True)
+        self.assertContains(self.client.get(reverse('home')), 'Excelente')
+
+        with self.assertNumQueries(0):
+            respuesta = self.client.get(reverse('home'))
+        self.assertContains(respuesta, producto.nombre)
+        # La seccion cacheada es la que se ve: ningun script la reemplaza desde la API
+        self.assertNotContains(respuesta, reverse('api_productos'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            producto.nombre = 'Perfume renovado'
+            producto.save()
+        # Solo la seccion de productos vuelve a consultarse
+        with self.assertNumQueries(1):
+            self.assertContains(self.client.get(reverse('home')), 'Perfume renovado')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Testimonio.objects.all().delete()
+        with self.assertNumQueries(1):
+            self.assertContains(self.client.get(reverse('home')), 'No hay testimonios disponibles.')
+
+        # Un checkout (UPDATE de stock en bloque) no invalida la portada
+        with self.captureOnCommitCallbacks(execute=True):
+            Producto.objects.filter(pk=producto.pk).update(stock=1)
+        with self.assertNumQueries(0):
+            self.client.get(reverse('home'))
+
+    def test_update_en_bloque_de_precio_invalida_la_portada(self):
+        producto = crear_productos(1)[0]
+        self.assertContains(self.client.get(reverse('home')), f'${producto.precio}<')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Producto.objects.filter(pk=producto.pk).update(precio=67890)
+        respuesta = self.client.get(reverse('home'))
+        self.assertContains(respuesta, '$67890<')
+        self.assertNotContains(respuesta, f'${producto.precio}<')
+
+    def test_vencido_se_regenera_una_sola_vez(self):
+        generados = []
+
+        def generar():
+            generados.append(1)
+            return f'version {len(generados)}'
+
+        self.assertEqual(cache_fragmentos.obtener('prueba', generar), 'version 1')
+        clave = f'fragmento:prueba:v{cache_fragmentos._version("prueba")}'
+        cache.set(clave, ('version 1', time.time() - 1))
+
+        # Otra peticion tiene el candado: se sirve la copia vencida sin renderizar
+        cache.add(f'{clave}:candado', 1)
+        self.assertEqual(cache_fragmentos.obtener('prueba', generar), 'version 1')
+        self.assertEqual(len(generados), 1)
+
+        cache.delete(f'{clave}:candado')
+        self.assertEqual(cache_fragmentos.obtener('prueba', generar), 'version 2')
+        self.assertEqual(cache_fragmentos.obtener('prueba', generar), 'version 2')
+
+    def test_sin_copia_se_espera_al_que_renderiza(self):
+        inicio = threading.Event()
+
+        def lento():
+            inicio.set()
+            time.sleep(0.2)
+            return 'fragmento'
+
+        hilo = threading.Thread(target=cache_fragmentos.obtener, args=('prueba', lento))
+        hilo.start()
+        inicio.wait()
+        otros = []
+        self.assertEqual(cache_fragmentos.obtener('prueba', lambda: otros.append(1) or 'otro'), 'fragmento')
+        hilo.join()
+        self.assertEqual(otros, [])
+
+
+@override_settings(CONSULTAS_LENTAS_UMBRAL_MS=0)
+class ConsultasLentasTests(TestCase):
+    """Con umbral 0 toda consulta queda registrada con su vista, linea y plantilla."""
+
+    def setUp(self):
+        cache.clear()
+        consultas_lentas.vaciar()
+        self.addCleanup(consultas_lentas.vaciar)
+
+    def test_registra_vista_origen_y_plantilla(self):
+        producto = crear_productos(1)[0]
+        usuario = User.objects.create_user('resenadora')
+        Resena.objects.create(producto=producto, usuario=usuario, calificacion=5, comentario='Bien', aprobada=True)
+
+        self.client.get(reverse('producto_detalle', args=[producto.id]))
+
+        entradas = consultas_lentas.entradas()
+        self.assertTrue(entradas)
+        self.assertEqual({entrada.vista for entrada in entradas}, {'producto_detalle'})
+        # La lectura del cache de productos que hace la vista
+        producto_sql = next(e for e in entradas if 'FROM "productos_producto"' in e.sql)
+        self.assertRegex(producto_sql.origen, r'^productos/cache_productos\.py:\d+ \(obtener\)$')
+        self.assertIsNone(producto_sql.plantilla)
+        # El queryset de reseñas es perezoso: se evalua en {% if resenas %}
+        resenas_sql = next(e for e in entradas if 'FROM "productos_resena"' in e.sql)
+        self.assertEqual(resenas_sql.plantilla, 'producto_detalle.html')
+
+    @override_settings(CONSULTAS_LENTAS_UMBRAL_MS=None)
+    def test_sin_umbral_no_se_instala(self):
+        producto = crear_productos(1)[0]
+        if consultas_lentas._vigilar_sql in connection.execute_wrappers:
+            connection.execute_wrappers.remove(consultas_lentas._vigilar_sql)
+        consultas_lentas._al_conectar(None, connection)
+        self.client.get(reverse('producto_detalle', args=[producto.id]))
+        self.assertNotIn(consultas_lentas._vigilar_sql, connection.execute_wrappers)
+        self.assertEqual(consultas_lentas.entradas(), [])
+
+    def test_normaliza_literales_y_listas(self):
+        self.assertEqual(
+            consultas_lentas.normalizar('SELECT * FROM t WHERE id IN (%s, %s, %s) AND x = 10 AND y = \'a\''),
+            consultas_lentas.normalizar('SELECT *  FROM t WHERE id IN (%s, %s) AND x = 7 AND y = \'bb\''),
+        )
+
+    def test_pagina_solo_staff_agrupada(self):
+        producto = crear_productos(1)[0]
+        for _ in range(3):
+            self.client.get(reverse('producto_detalle', args=[producto.id]))
+        url = reverse('consultas_lentas')
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        respuesta = self.client.get(url)
+
+        self.assertEqual(respuesta.status_code, 200)
+        grupos = respuesta.context['grupos']
+        totales = [grupo['total_ms'] for grupo in grupos]
+        self.assertEqual(totales, sorted(totales, reverse=True))
+        self.assertTrue(any(grupo['veces'] == 3 and grupo['vistas'] == ['producto_detalle'] for grupo in grupos))
+
+
+@override_settings(ROOT_URLCONF='config.urls_asgi')
+class VistasAsincronasTests(TestCase):
+    """Catalogo y carrito AJAX del despliegue ASGI: mismas respuestas que las sincronas."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_rutas_asincronas(self):
+        for url, vista in (('/productos/', views_async.productos), ('/carrito/contador/', views_async.contador_carrito)):
+            self.assertIs(resolve(url).func, vista)
+        # Lo demas sigue en las vistas sincronas
+        self.assertEqual(resolve('/carrito/').url_name, 'ver_carrito')
+
+    async def test_catalogo_igual_que_el_sincrono(self):
+        await sync_to_async(crear_productos)(30)
+        for parametros in ({'orden': 'precio_menor', 'page': 2}, {'orden': 'nombre', 'page': 99}):
+            with override_settings(ROOT_URLCONF='config.urls'):
+                esperado = await sync_to_async(self.client.get)('/productos/', parametros)
+            await cache.aclear()
+            respuesta = await self.async_client.get('/productos/', parametros)
+
+            self.assertEqual(respuesta.status_code, 200)
+            pagina, pagina_esperada = respuesta.context['productos'], esperado.context['productos']
+            self.assertEqual(pagina.number, pagina_esperada.number)
+            self.assertEqual(list(pagina), list(pagina_esperada))
+            self.assertEqual(respuesta.context['categorias'], esperado.context['categorias'])
+
+        primera = await self.async_client.get('/productos/', {'paginacion': 'cursor', 'orden': 'precio_menor'})
+        cursor = primera.context['productos'].cursor_siguiente
+        segunda = await self.async_client.get('/productos/', {'paginacion': 'cursor', 'orden': 'precio_menor', 'cursor': cursor})
+        self.assertEqual([p.precio for p in segunda.context['productos']], [1000 * i for i in range(13, 25)])
+
+    async def test_detalle_con_resenas(self):
+        producto = (await sync_to_async(crear_productos)(1))[0]
+        usuario = await User.objects.acreate_user('resenadora')
+        await Resena.objects.acreate(producto=producto, usuario=usuario, calificacion=4, comentario='Buena', aprobada=True)
+
+        respuesta = await self.async_client.get(f'/producto/{producto.id}/')
+
+        self.assertContains(respuesta, 'resenadora')
+        self.assertEqual(respuesta.context['total_resenas'], 1)
+        self.assertEqual((await self.async_client.get('/producto/999999/')).status_code, 404)
+
+    async def test_carrito_anonimo(self):
+        producto, otro = await sync_to_async(crear_productos)(2)
+        for destino in (producto, producto, otro):
+            respuesta = await self.async_client.post(f'/carrito/agregar/{destino.id}/', **AJAX_ASYNC)
+        self.assertEqual(respuesta.json()['total_items'], 3)
+        self.assertFalse(await Carrito.objects.aexists())
+        self.assertEqual((await self.async_client.get('/carrito/contador/')).json(), {'total_items': 3})
+
+        respuesta = await self.async_client.post(f'/carrito/actualizar/{producto.id}/', {'cantidad': 5})
+        self.assertEqual(respuesta.json()['total'], 5 * 1000 + 2000)
+        respuesta = await self.async_client.post(f'/carrito/eliminar/{otro.id}/', **AJAX_ASYNC)
+        self.assertEqual(respuesta.json()['total_items'], 5)
+        # La pagina del carrito (sincrona) ve lo mismo
+        respuesta = await self.async_client.get('/carrito/')
+        self.assertEqual([(i.producto, i.cantidad) for i in respuesta.context['items']], [(producto, 5)])
+
+    async def test_carrito_de_usuario(self):
+        producto = (await sync_to_async(crear_productos)(1, stock=2))[0]
+        usuario = await User.objects.acreate_user('ana')
+        await self.async_client.aforce_login(usuario)
+
+        for _ in range(3):
+            respuesta = await self.async_client.post(f'/carrito/agregar/{producto.id}/', **AJAX_ASYNC)
+        self.assertEqual(respuesta.json(), {'success': False, 'message': 'No hay mas stock disponible.'})
+        item = await ItemCarrito.objects.aget(carrito__usuario=usuario)
+        self.assertEqual(item.cantidad, 2)
+        self.assertEqual(await self.async_client.session.aget(CLAVE_SESION_TOTAL), 2)
+
+        respuesta = await self.async_client.post(f'/carrito/actualizar/{item.id}/', {'cantidad': 0})
+        self.assertEqual(respuesta.json()['total_items'], 0)
+        self.assertFalse(await ItemCarrito.objects.aexists())
+        self.assertEqual((await self.async_client.get('/carrito/contador/')).json(), {'total_items': 0})
+
+    async def test_metricas_y_consultas_lentas(self):
+        producto = (await sync_to_async(crear_productos)(1))[0]
+        registro_original, metricas._registro = metricas._registro, metricas.Registro()
+        self.addCleanup(setattr, metricas, '_registro', registro_original)
+        consultas_lentas.vaciar()
+        self.addCleanup(consultas_lentas.vaciar)
+
+        with override_settings(CONSULTAS_LENTAS_UMBRAL_MS=0):
+            # La conexion del hilo del ORM ya estaba abierta, sin umbral
+            await sync_to_async(lambda: consultas_lentas._al_conectar(None, connection))()
+            await self.async_client.get(f'/producto/{producto.id}/')
+
+        # El ORM corrio en otro hilo, pero las consultas cuentan para la peticion
+        consultas = metricas._registro.valores['vgl_peticion_consultas_sql'][('producto_detalle', 'GET')]
+        self.assertGreater(consultas[-1], 0)
+        producto_sql = next(e for e in consultas_lentas.entradas() if 'FROM "productos_producto"' in e.sql)
+        self.assertEqual(producto_sql.vista, 'producto_detalle')
+        self.assertRegex(producto_sql.origen, r'^productos/cache_productos\.py:\d+ \(aobtener\)$')
+
+    async def test_detalle_condicional(self):
+        producto = (await sync_to_async(crear_productos)(1))[0]
+        url = f'/producto/{producto.id}/'
+        respuesta = await self.async_client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn('Last-Modified', respuesta)
+
+        respuesta = await self.async_client.get(url, headers={'If-None-Match': respuesta['ETag']})
+        self.assertEqual(respuesta.status_code, 304)
+
+
+class CompararAsgiTests(TransactionTestCase):
+    """La comparacion llama a los handlers WSGI y ASGI reales (otros hilos: datos confirmados)."""
+
+    def test_ambos_despliegues_sin_errores(self):
+        crear_productos(3)
+        salida = StringIO()
+
+        call_command('comparar_asgi', conexiones=[2], duracion=0.3, hilos=1, latencia_bd=1,
+                     host='testserver', stdout=salida)
+
+        informe = salida.getvalue()
+        for despliegue in ('WSGI', 'ASGI'):
+            self.assertRegex(informe, rf'{despliegue}\s+2\s+[1-9]\d*\s.*\s0\.0%')
+        self.assertIn('2 conexiones: ASGI/WSGI = ', informe)
+
+
+class ApiProductosTests(TestCase):
+    """API de productos: filtros, campos a pedido y GET condicional."""
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('api_productos')
+
+    def test_filtros_y_campos(self):
+        crear_productos(4)  # precios 1000..4000
+        crear_productos(2, categoria='Cremas')
+        crear_productos(1, activo=False)
+
+        datos = self.client.get(self.url, {'categoria': 'Perfumes', 'precio_min': 2000, 'precio_max': 3000,
+                                           'orden': 'precio_menor', 'fields': 'id,nombre,precio'}).json()
+
+        self.assertEqual([p['precio'] for p in datos['results']], [2000, 3000])
+        self.assertEqual(set(datos['results'][0]), {'id', 'nombre', 'precio'})
+        self.assertEqual(len(self.client.get(self.url).json()['results']), 6)
+        self.assertEqual(len(self.client.get(self.url, {'limite': 2}).json()['results']), 2)
+        self.assertEqual(self.client.get(self.url, {'fields': 'id,clave'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'precio_min': 'barato'}).status_code, 400)
+
+    def test_busqueda_y_cursor_con_campos(self):
+        crear_productos(15)
+        Producto.objects.create(nombre='Serum facial', categoria='Cremas', descripcion='Vitamina C',
+                                precio=9000, stock=5, imagen='productos/perfume1.png')
+
+        encontrados = self.client.get(self.url, {'q': 'serum', 'fields': 'nombre'}).json()['results']
+        self.assertEqual(encontrados, [{'nombre': 'Serum facial'}])
+
+        primera = self.client.get(self.url, {'orden': 'precio_menor', 'fields': 'precio'}).json()
+        segunda = self.client.get(primera['next']).json()
+        self.assertEqual([p['precio'] for p in primera['results'] + segunda['results']],
+                         sorted(p.precio for p in Producto.objects.all()))
+
+    def test_revalidacion_con_etag_y_last_modified(self):
+        producto = crear_productos(3)[0]
+        respuesta = self.client.get(self.url, {'fields': 'id'})
+        self.assertEqual(respuesta.status_code, 200)
+        etag, modificado = respuesta['ETag'], respuesta['Last-Modified']
+        self.assertIn('no-cache', respuesta['Cache-Control'])
+        self.assertNotIn('Cookie', respuesta.get('Vary', ''))
+
+        with self.assertNumQueries(0):
+            respuesta = self.client.get(self.url, {'fields': 'id'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 304)
+        self.assertEqual(respuesta['ETag'], etag)
+        self.assertEqual(self.client.get(self.url, {'fields': 'id'}, HTTP_IF_MODIFIED_SINCE=modificado).status_code, 304)
+        # Otros parametros, otra representacion
+        self.assertNotEqual(self.client.get(self.url, {'fields': 'nombre'})['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            producto.precio = 500
+            producto.save()
+        respuesta = self.client.get(self.url, {'fields': 'id'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotEqual(respuesta['ETag'], etag)
@@ -14,4 +14,5 @@ urlpatterns = [
     path('carrito/eliminar/<int:item_id>/', views.eliminar_del_carrito, name='eliminar_del_carrito'),
     path('carrito/vaciar/', views.vaciar_carrito, name='vaciar_carrito'),
     path('carrito/contador/', views.contador_carrito, name='contador_carrito'),
+    path('api/productos/', views.api_productos, name='api_productos'),
 ]
@@ -1,111 +1,331 @@
 
+import hashlib
+
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.cache import cache_control
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import ListAPIView
+from rest_framework.permissions import AllowAny
 from .models import Producto
 from .serializers import ProductoSerializer
 from django.shortcuts import get_object_or_404, redirect, render
-from django.db.models import Avg, Count
-from .models import Testimonio, Producto, Resena, Carrito, ItemCarrito
-from django.core.paginator import Paginator
-from django.views.decorators.http import require_POST
+from django.template.loader import render_to_string
+from .models import Testimonio, Producto, Resena, Carrito
+from . import busqueda as indice_busqueda
+from . import cache_catalogo, cache_fragmentos, cache_productos, facetas, paginacion
+from .carrito import CarritoSesion, resumen_actualizado, total_items_sin_escrituras
+from django.core.paginator import Page, Paginator
+from django.views.decorators.http import condition, require_POST
 
 
 # Create your views here.
-def home (request):
+def _fragmento_productos():
     productos = Producto.objects.filter(activo=True)[:8]  # Mostrar máximo 8 productos
+    return render_to_string('partials/inicio_productos.html', {'productos': productos})
+
+
+def _fragmento_testimonios():
     testimonios = Testimonio.objects.filter(activo=True, destacado=True)[:6]  # Mostrar máximo 6 testimonios
-    
+    return render_to_string('partials/inicio_testimonios.html', {'testimonios': testimonios})
+
+
+def home (request):
+    # Secciones iguales para todos los visitantes: se sirven ya renderizadas
+    # (ver cache_fragmentos); solo la cabecera se arma por peticion
     context = {
-        'productos': productos,
-        'testimonios': testimonios
+        'fragmento_productos': cache_fragmentos.obtener(cache_fragmentos.INICIO_PRODUCTOS, _fragmento_productos),
+        'fragmento_testimonios': cache_fragmentos.obtener(
+            cache_fragmentos.INICIO_TESTIMONIOS, _fragmento_testimonios,
+        ),
     }
     
     return render (request, "index.html", context)
 
 class ProductoListView(ListAPIView):
-    queryset = Producto.objects.all().order_by('id')
+    """
+    Productos activos, paginados por cursor (``orden``, ``cursor``, ``limite``).
+
+    Filtros: ``categoria``, ``precio_min``, ``precio_max`` y ``q`` (indice de
+    texto completo). ``fields=id,nombre,precio`` limita los campos de cada
+    producto y las columnas leidas. Es publica: sin autenticacion no se
+    carga la sesion ni la respuesta varia por cookie.
+    """
     serializer_class = ProductoSerializer
+    pagination_class = paginacion.ProductoCursorPagination
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def campos(self):
+        """Campos pedidos en ``fields`` (None = todos)."""
+        pedidos = self.request.query_params.get('fields')
+        if not pedidos:
+            return None
+        campos = [campo.strip() for campo in pedidos.split(',') if campo.strip()]
+        desconocidos = set(campos) - set(ProductoSerializer.Meta.fields)
+        if desconocidos:
+            raise ValidationError({'fields': f'Campos desconocidos: {", ".join(sorted(desconocidos))}.'})
+        return campos
+
+    def precio(self, nombre):
+        valor = self.request.query_params.get(nombre)
+        if valor in (None, ''):
+            return None
+        try:
+            return int(valor)
+        except ValueError:
+            raise ValidationError({nombre: 'Debe ser un numero entero.'})
+
+    def get_queryset(self):
+        productos = Producto.objects.filter(activo=True)
+        parametros = self.request.query_params
+        if parametros.get('categoria'):
+            productos = productos.filter(categoria=parametros['categoria'])
+        precio_min, precio_max = self.precio('precio_min'), self.precio('precio_max')
+        if precio_min is not None:
+            productos = productos.filter(precio__gte=precio_min)
+        if precio_max is not None:
+            productos = productos.filter(precio__lte=precio_max)
+        if parametros.get('q'):
+            productos = indice_busqueda.filtrar(productos, parametros['q'])
+
+        campos = self.campos()
+        if campos is not None:
+            # La paginacion keyset lee los campos del orden para el cursor
+            orden = paginacion.ORDENES_KEYSET[self.pagination_class.orden(self.request)]
+            productos = productos.only(*{*campos, *(campo.lstrip('-') for campo in orden)})
+        return productos
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('campos', self.campos())
+        return super().get_serializer(*args, **kwargs)
+
+
+def _etag_api_productos(request):
+    """
+    Version y ultima modificacion del catalogo (cambian con cada escritura
+    de productos, stock o calificaciones) + parametros + formato pedido.
+    """
+    partes = (
+        cache_catalogo.version_catalogo(),
+        cache_catalogo.ultima_modificacion().timestamp(),
+        sorted(request.GET.lists()),
+        request.headers.get('Accept', ''),
+    )
+    return hashlib.md5(repr(partes).encode('utf-8')).hexdigest()
+
+
+def _modificacion_api_productos(request):
+    return cache_catalogo.ultima_modificacion()
 
-def producto_detalle(request, id):
-    producto = get_object_or_404(Producto, id=id)
 
-    #Obtener reseñas aprobadas
-    resenas = producto.resenas.filter(aprobada=True)
+# Con If-None-Match / If-Modified-Since vigentes responde 304 sin consultar la
+# base; no-cache: los clientes guardan la respuesta pero la revalidan siempre
+api_productos = cache_control(public=True, no_cache=True)(
+    condition(etag_func=_etag_api_productos, last_modified_func=_modificacion_api_productos)(
+        ProductoListView.as_view()
+    )
+)
+
+def _validadores_detalle(request, producto, usuario, total_items):
+    """
+    ``(etag, last_modified)`` de ``producto_detalle``.
+
+    La pagina depende del producto (``actualizado`` cambia con cualquier
+    escritura, tambien al aprobar o editar una reseña aprobada) y de la
+    cabecera: usuario, articulos del carrito y el token CSRF del formulario.
+    ``Last-Modified`` solo se da si la pagina es la misma para todos
+    (anonimo con el carrito vacio): If-Modified-Since no distingue usuarios.
+    """
+    partes = (
+        producto.pk, producto.actualizado.timestamp(), producto.rating_avg, producto.rating_count,
+        # get_token fija el secreto CSRF que usara el formulario si aun no hay cookie
+        usuario.pk, usuario.get_username(), total_items, get_token(request) and request.META['CSRF_COOKIE'],
+    )
+    etag = quote_etag(hashlib.md5(repr(partes).encode('utf-8')).hexdigest())
+    if usuario.is_authenticated or total_items:
+        return etag, None
+    return etag, producto.actualizado
+
 
-    #Calcular promedio y total de reseñas
-    stats = resenas.aggregate(
-        promedio=Avg('calificacion'),
-        total=Count('id')
+def _no_modificado(request, etag, modificado):
+    """304 si el cliente ya tiene esta version (sin consultar reseñas ni renderizar)."""
+    return get_conditional_response(
+        request, etag=etag, last_modified=int(modificado.timestamp()) if modificado else None,
     )
 
-    context = {
+
+def _con_validadores(response, etag, modificado):
+    response.headers.setdefault('ETag', etag)
+    if modificado:
+        response.headers.setdefault('Last-Modified', http_date(modificado.timestamp()))
+    # Cada usuario ve su cabecera: solo el navegador la guarda, y la revalida
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _contexto_detalle(producto, resenas):
+    #Promedio y total de reseñas (guardados en el producto)
+    return {
         'producto': producto,
         'resenas': resenas,
-        'promedio_calificacion': round(stats['promedio'], 1) if stats['promedio'] else 0,
-        'total_resenas': stats['total']
+        'promedio_calificacion': round(producto.rating_avg, 1),
+        'total_resenas': producto.rating_count
     }
-    
 
-    return render(request, "producto_detalle.html", context)
 
-def productos(request):
+def producto_detalle(request, id):
+    producto = cache_productos.obtener(id)
+    if producto is None:
+        raise Http404('No existe el producto.')
+
+    total_items = total_items_sin_escrituras(request)
+    etag, modificado = _validadores_detalle(request, producto, request.user, total_items)
+    response = _no_modificado(request, etag, modificado)
+    if response is None:
+        #Obtener reseñas aprobadas
+        resenas = producto.resenas.filter(aprobada=True).select_related('usuario')
+        context = _contexto_detalle(producto, resenas)
+        context['carrito_total_items'] = total_items
+        response = render(request, "producto_detalle.html", context)
+    return _con_validadores(response, etag, modificado)
+
+ORDENES_CATALOGO = ('reciente', 'precio_menor', 'precio_mayor', 'nombre', 'mejor_valorados', 'relevancia')
+PRODUCTOS_POR_PAGINA = 12
+
+def _consulta_catalogo(categoria, busqueda, orden):
+    """Productos activos filtrados y ordenados (sin evaluar)."""
     #Obtener todos los productos activos
     productos_list = Producto.objects.filter(activo=True)
 
-    #Filtros
-    categoria = request.GET.get('categoria')
-    busqueda = request.GET.get('q')
-    orden = request.GET.get('orden', 'reciente')
-
     #Aplicar filtro de categoria
     if categoria:
         productos_list = productos_list.filter(categoria=categoria)
     
-    #Aplicar busqueda
-    if busqueda:
-        productos_list = productos_list.filter(
-            nombre__icontains=busqueda
-        ) | productos_list.filter(
-            descripcion__icontains=busqueda
-        )
+    #Aplicar busqueda (indice de texto completo)
+    if busqueda and orden == 'relevancia':
+        productos_list = indice_busqueda.ordenar_por_relevancia(productos_list, busqueda)
+    elif busqueda:
+        productos_list = indice_busqueda.filtrar(productos_list, busqueda)
+
     #Aplicar ordenamiento 
-    if orden == 'precio_menor':
+    if orden == 'relevancia':
+        pass  # ordenado por bm25 en ordenar_por_relevancia
+    elif orden == 'precio_menor':
         productos_list = productos_list.order_by('precio')
     elif orden == 'precio_mayor':
         productos_list = productos_list.order_by('-precio')
     elif orden == 'nombre':
         productos_list = productos_list.order_by('nombre')
+    elif orden == 'mejor_valorados':
+        productos_list = productos_list.order_by('-rating_avg', '-rating_count', '-creado')
     else:  #orden reciente por defecto
         productos_list = productos_list.order_by('-creado')
-    
-    #Paginacion
-    paginator = Paginator(productos_list, 12) #12 productos por pagina
-    page_number = request.GET.get('page')
-    productos_paginados = paginator.get_page(page_number)
+    return productos_list
 
-    #Obtener categorias unicas
-    categorias = Producto.objects.filter(activo=True).values_list('categoria', flat=True).distinct()
+def _listado_productos(categoria, busqueda, orden, pagina, cursor=None):
+    """
+    Calcula una pagina del catalogo; el resultado se guarda en cache_catalogo.
 
-    context = {
+    Con ``cursor`` distinto de None (cadena vacia = primera pagina) se usa
+    paginacion keyset y se devuelve una ``PaginaKeyset``.
+    """
+    productos_list = _consulta_catalogo(categoria, busqueda, orden)
+
+    #Paginacion por cursor: sin COUNT ni OFFSET
+    if cursor is not None:
+        return paginacion.paginar(productos_list, orden, cursor or None, PRODUCTOS_POR_PAGINA)
+
+    #Paginacion por numero de pagina
+    paginator = Paginator(productos_list, PRODUCTOS_POR_PAGINA)
+    pagina_actual = paginator.get_page(pagina)
+
+    return {
+        'productos': list(pagina_actual.object_list),
+        'numero': pagina_actual.number,
+        'total': paginator.count,
+    }
+
+def _sin_parametro(query_dict, nombre):
+    """Querystring actual sin ``nombre``, para construir enlaces de paginacion."""
+    parametros = query_dict.copy()
+    parametros.pop(nombre, None)
+    return parametros.urlencode()
+
+def _filtros_catalogo(request):
+    """``(categoria, busqueda, orden, usar_cursor)`` validados desde el querystring."""
+    categoria = request.GET.get('categoria')
+    busqueda = request.GET.get('q')
+    orden = request.GET.get('orden', 'relevancia' if busqueda else 'reciente')
+    if orden not in ORDENES_CATALOGO or (orden == 'relevancia' and not busqueda):
+        orden = 'reciente'
+
+    #Modo cursor (?paginacion=cursor): no cuenta filas; relevancia no lo admite
+    usar_cursor = request.GET.get('paginacion') == 'cursor' and orden in paginacion.ORDENES_KEYSET
+    return categoria, busqueda, orden, usar_cursor
+
+def _pagina_numerada(listado):
+    """``Page`` para la plantilla a partir del listado cacheado (sin volver a contar)."""
+    paginator = Paginator([], PRODUCTOS_POR_PAGINA)
+    paginator.count = listado['total']
+    return Page(listado['productos'], listado['numero'], paginator)
+
+def _contexto_catalogo(request, productos_paginados, facetas_catalogo, categoria, busqueda, orden, usar_cursor):
+    return {
         'productos': productos_paginados,
-        'categorias': categorias,
+        'categorias': facetas_catalogo['categorias'],
+        'total_productos': facetas_catalogo['total'],
         'categoria_actual': categoria,
         'busqueda': busqueda,
-        'orden': orden
+        'orden': orden,
+        'orden_actual': orden,
+        'paginacion_cursor': usar_cursor,
+        'parametros_sin_cursor': _sin_parametro(request.GET, 'cursor'),
+        'parametros_sin_pagina': _sin_parametro(request.GET, 'page'),
     }
 
+def productos(request):
+    #Filtros
+    categoria, busqueda, orden, usar_cursor = _filtros_catalogo(request)
+
+    #Listado (cacheado por combinacion de filtros y version del catalogo)
+    filtros = cache_catalogo.normalizar_filtros(categoria, busqueda, orden, request.GET.get('page'))
+    if usar_cursor:
+        cursor = request.GET.get('cursor', '')
+        try:
+            productos_paginados = cache_catalogo.obtener(
+                ('cursor',) + filtros[:3] + (cursor,),
+                lambda: _listado_productos(*filtros, cursor=cursor),
+            )
+        except paginacion.CursorInvalido:
+            return redirect(f"{request.path}?{_sin_parametro(request.GET, 'cursor')}")
+    else:
+        listado = cache_catalogo.obtener(('listado',) + filtros, lambda: _listado_productos(*filtros))
+        productos_paginados = _pagina_numerada(listado)
+
+    #Categorias activas con su numero de productos (en memoria)
+    facetas_catalogo = facetas.obtener()
+
+    context = _contexto_catalogo(request, productos_paginados, facetas_catalogo, categoria, busqueda, orden, usar_cursor)
     return render (request, "productos.html", context)
 
 def obtener_carrito(request):
-    """Obtiene o crea el carrito del usuario/sesion."""
+    """
+    Carrito del usuario (se crea si no existe) o, para visitantes anonimos,
+    el carrito guardado en la sesion, que no escribe en la base de datos.
+    Una vez por peticion.
+    """
+    if getattr(request, '_carrito', None) is not None:
+        return request._carrito
+
     if request.user.is_authenticated:
         carrito, created = Carrito.objects.get_or_create(usuario=request.user)
     else:
-        if not request.session.session_key:
-            request.session.create()
-        session_key = request.session.session_key
-        carrito, created = Carrito.objects.get_or_create(session_key=session_key)
+        carrito = CarritoSesion(request.session)
+    request._carrito = carrito
     return carrito
 
 @require_POST
@@ -125,11 +345,7 @@ def agregar_al_carrito(request, producto_id):
     carrito = obtener_carrito(request)
 
     # Obtener o crear item
-    item, created = ItemCarrito.objects.get_or_create(
-        carrito=carrito,
-        producto=producto,
-        defaults={'cantidad': 1}
-    )
+    item, created = carrito.obtener_o_crear_item(producto)
 
     if not created:
         if item.cantidad < producto.stock:
@@ -148,11 +364,13 @@ def agregar_al_carrito(request, producto_id):
     else:
         mensaje = f'{producto.nombre} agregado al carrito.'
 
+    resumen = resumen_actualizado(request, carrito)
+
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({
             'success': True,
             'message': mensaje,
-            'total_items': carrito.total_items,
+            'total_items': resumen.total_items,
         })
     
     messages.success(request, mensaje)
@@ -161,22 +379,24 @@ def agregar_al_carrito(request, producto_id):
 def ver_carrito(request):
     """Ver el contenido del carrito."""
     carrito = obtener_carrito(request)
+    resumen = resumen_actualizado(request, carrito)
 
     context = {
         'carrito': carrito,
-        'items': carrito.items.select_related('producto').all(),
-        'total': carrito.total_precio,
+        'items': carrito.items_con_producto(),
+        'total': resumen.total_precio,
+        'total_items': resumen.total_items,
     }
     return render(request, 'carrito.html', context)
 
 @require_POST
 def actualizar_cantidad(request, item_id):
     """"Actualizar cantidad e un item en el carrito"""
-    item = get_object_or_404(ItemCarrito, id=item_id)
     carrito = obtener_carrito(request)
 
-    # Verificar que el item pertenezca al carrito del usuario/sesion
-    if item.carrito != carrito:
+    # Solo se buscan items del carrito del usuario/sesion
+    item = carrito.item(item_id)
+    if item is None:
         return JsonResponse({'success': False, 'message': 'Item no pertenece al carrito.'})
     
     cantidad = int(request.POST.get('cantidad', 1))
@@ -194,46 +414,49 @@ def actualizar_cantidad(request, item_id):
         item.save()
         mensaje = f'Cantidad de {item.producto.nombre} actualizada a {item.cantidad}.'
 
+    resumen = resumen_actualizado(request, carrito)
+
     return JsonResponse({
         'success': True,
         'message': mensaje,
         'subtotal': item.subtotal if cantidad > 0 else 0,
-        'total': carrito.total_precio,
-        'total_items': carrito.total_items,   
+        'total': resumen.total_precio,
+        'total_items': resumen.total_items,
          })
 
 @require_POST
 def eliminar_del_carrito(request, item_id):
     """Eliminar un item del carrito."""
-    item = get_object_or_404(ItemCarrito, id=item_id)
     carrito = obtener_carrito(request)
 
-    if item.carrito != carrito:
+    item = carrito.item(item_id)
+    if item is None:
         return JsonResponse({'success': False, 'message': 'Item no pertenece al carrito.'}) 
 
     producto_nombre = item.producto.nombre
     item.delete()
+    resumen = resumen_actualizado(request, carrito)
 
     if request.headers.get('x-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({
             'success': True,
             'message': f'{producto_nombre} eliminado del carrito.',
-            'total': carrito.total_precio,
-            'total_items': carrito.total_items,
+            'total': resumen.total_precio,
+            'total_items': resumen.total_items,
         })
 
     messages.success(request, f'{producto_nombre} eliminado del carrito.')
     return redirect('ver_carrito')
 
 def contador_carrito(request):
-    """Obtener numero de items en el carrito (para AJAX)"""
-    carrito = obtener_carrito(request)
-    return JsonResponse({'total_items': carrito.total_items})
+    """Obtener numero de items en el carrito (para AJAX). No crea sesion ni carrito."""
+    return JsonResponse({'total_items': total_items_sin_escrituras(request)})
 
 def vaciar_carrito(request):
     """Vaciar todo el carrito"""
     carrito = obtener_carrito(request)
-    carrito.items.all().delete()
+    carrito.vaciar()
+    resumen_actualizado(request, carrito)
     messages.success(request, 'Carrito vaciado.')
     return redirect('ver_carrito')
 
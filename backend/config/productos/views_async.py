@@ -0,0 +1,222 @@
+"""
+Versiones asincronas del catalogo y del carrito AJAX para el despliegue ASGI.
+
+``config/asgi.py`` usa ``config.urls_asgi``, que enruta estas vistas en las
+mismas URLs y con los mismos nombres que ``views``. Con WSGI siguen
+sirviendose las sincronas (una vista asincrona bajo WSGI necesitaria un
+bucle de eventos por peticion).
+
+Las consultas usan el ORM asincrono (``aget``, ``afirst``, ``async for``...),
+y la sesion, el usuario y el cache sus metodos ``a*``. Las plantillas se
+renderizan en el bucle de eventos, asi que nada de lo que reciben puede
+consultar la base de datos: los querysets se evaluan antes y ``user`` y
+``carrito_total_items`` se pasan ya resueltos (``_contexto_cabecera``).
+"""
+from django.contrib import messages
+from django.http import Http404, JsonResponse
+from django.shortcuts import aget_object_or_404, redirect, render
+from django.views.decorators.http import require_POST
+
+from . import cache_catalogo, cache_productos, facetas, paginacion
+from .carrito import (
+    CLAVE_SESION_CARRITO, CarritoSesion, aresumen_actualizado, atotal_items_sin_escrituras,
+)
+from .models import Carrito, Producto
+from .views import (
+    PRODUCTOS_POR_PAGINA, _con_validadores, _consulta_catalogo, _contexto_catalogo,
+    _contexto_detalle, _filtros_catalogo, _no_modificado, _pagina_numerada, _sin_parametro,
+    _validadores_detalle,
+)
+
+
+def _es_ajax(request):
+    return request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+
+async def _contexto_cabecera(request):
+    """Lo que el header lee de forma perezosa en la version sincrona, ya calculado."""
+    usuario = await request.auser()
+    return {
+        'user': usuario,
+        'carrito_total_items': await atotal_items_sin_escrituras(request, usuario),
+    }
+
+
+async def _listado_productos(categoria, busqueda, orden, pagina, cursor=None):
+    """Version asincrona de ``views._listado_productos`` (mismo resultado cacheado)."""
+    productos_list = _consulta_catalogo(categoria, busqueda, orden)
+    if cursor is not None:
+        return await paginacion.apaginar(productos_list, orden, cursor or None, PRODUCTOS_POR_PAGINA)
+
+    # Como Paginator.get_page: una pagina fuera de rango muestra la ultima
+    total = await productos_list.acount()
+    paginas = max(1, -(-total // PRODUCTOS_POR_PAGINA))
+    numero = min(pagina, paginas)
+    inicio = (numero - 1) * PRODUCTOS_POR_PAGINA
+    return {
+        'productos': [producto async for producto in productos_list[inicio:inicio + PRODUCTOS_POR_PAGINA]],
+        'numero': numero,
+        'total': total,
+    }
+
+
+async def productos(request):
+    categoria, busqueda, orden, usar_cursor = _filtros_catalogo(request)
+
+    filtros = cache_catalogo.normalizar_filtros(categoria, busqueda, orden, request.GET.get('page'))
+    if usar_cursor:
+        cursor = request.GET.get('cursor', '')
+        try:
+            productos_paginados = await cache_catalogo.aobtener(
+                ('cursor',) + filtros[:3] + (cursor,),
+                lambda: _listado_productos(*filtros, cursor=cursor),
+            )
+        except paginacion.CursorInvalido:
+            return redirect(f"{request.path}?{_sin_parametro(request.GET, 'cursor')}")
+    else:
+        listado = await cache_catalogo.aobtener(('listado',) + filtros, lambda: _listado_productos(*filtros))
+        productos_paginados = _pagina_numerada(listado)
+
+    context = _contexto_catalogo(
+        request, productos_paginados, await facetas.aobtener(), categoria, busqueda, orden, usar_cursor,
+    )
+    context.update(await _contexto_cabecera(request))
+    return render(request, 'productos.html', context)
+
+
+async def producto_detalle(request, id):
+    producto = await cache_productos.aobtener(id)
+    if producto is None:
+        raise Http404('No existe el producto.')
+
+    cabecera = await _contexto_cabecera(request)
+    etag, modificado = _validadores_detalle(request, producto, cabecera['user'], cabecera['carrito_total_items'])
+    response = _no_modificado(request, etag, modificado)
+    if response is None:
+        resenas = [
+            resena async for resena in producto.resenas.filter(aprobada=True).select_related('usuario')
+        ]
+        response = render(request, 'producto_detalle.html', {**_contexto_detalle(producto, resenas), **cabecera})
+    return _con_validadores(response, etag, modificado)
+
+
+async def obtener_carrito(request):
+    """Version asincrona de ``views.obtener_carrito``; deja la sesion cargada."""
+    if getattr(request, '_carrito', None) is not None:
+        return request._carrito
+
+    usuario = await request.auser()
+    if usuario.is_authenticated:
+        carrito, created = await Carrito.objects.aget_or_create(usuario=usuario)
+    else:
+        carrito = CarritoSesion(request.session)
+    # CarritoSesion y recordar_total_items usan la sesion de forma sincronica
+    await request.session.aget(CLAVE_SESION_CARRITO)
+    request._carrito = carrito
+    return carrito
+
+
+@require_POST
+async def agregar_al_carrito(request, producto_id):
+    """Agrega un producto al carrito."""
+    producto = await aget_object_or_404(Producto, id=producto_id)
+
+    if producto.stock <= 0:
+        if _es_ajax(request):
+            return JsonResponse({'success': False, 'message': 'Producto agotado.'})
+        messages.error(request, 'Producto agotado.')
+        return redirect('productos')
+
+    carrito = await obtener_carrito(request)
+    item, created = await carrito.aobtener_o_crear_item(producto)
+
+    if not created:
+        if item.cantidad < producto.stock:
+            item.cantidad += 1
+            await item.asave()
+            mensaje = f'{producto.nombre} agregado al carrito (cantidad {item.cantidad}).'
+        else:
+            if _es_ajax(request):
+                return JsonResponse({'success': False, 'message': 'No hay mas stock disponible.'})
+            messages.warning(request, 'No hay mas stock disponible.')
+            return redirect('productos')
+    else:
+        mensaje = f'{producto.nombre} agregado al carrito.'
+
+    resumen = await aresumen_actualizado(request, carrito)
+
+    if _es_ajax(request):
+        return JsonResponse({
+            'success': True,
+            'message': mensaje,
+            'total_items': resumen.total_items,
+        })
+
+    messages.success(request, mensaje)
+    return redirect('productos')
+
+
+@require_POST
+async def actualizar_cantidad(request, item_id):
+    """Actualizar cantidad de un item en el carrito."""
+    carrito = await obtener_carrito(request)
+
+    item = await carrito.aitem(item_id)
+    if item is None:
+        return JsonResponse({'success': False, 'message': 'Item no pertenece al carrito.'})
+
+    cantidad = int(request.POST.get('cantidad', 1))
+
+    if cantidad <= 0:
+        await item.adelete()
+        mensaje = f'{item.producto.nombre} eliminado del carrito.'
+    elif cantidad > item.producto.stock:
+        return JsonResponse({
+            'success': False,
+            'message': f'Solo hay {item.producto.stock} unidades disponibles en stock.'
+        })
+    else:
+        item.cantidad = cantidad
+        await item.asave()
+        mensaje = f'Cantidad de {item.producto.nombre} actualizada a {item.cantidad}.'
+
+    resumen = await aresumen_actualizado(request, carrito)
+
+    return JsonResponse({
+        'success': True,
+        'message': mensaje,
+        'subtotal': item.subtotal if cantidad > 0 else 0,
+        'total': resumen.total_precio,
+        'total_items': resumen.total_items,
+    })
+
+
+@require_POST
+async def eliminar_del_carrito(request, item_id):
+    """Eliminar un item del carrito."""
+    carrito = await obtener_carrito(request)
+
+    item = await carrito.aitem(item_id)
+    if item is None:
+        return JsonResponse({'success': False, 'message': 'Item no pertenece al carrito.'})
+
+    producto_nombre = item.producto.nombre
+    await item.adelete()
+    resumen = await aresumen_actualizado(request, carrito)
+
+    if _es_ajax(request):
+        return JsonResponse({
+            'success': True,
+            'message': f'{producto_nombre} eliminado del carrito.',
+            'total': resumen.total_precio,
+            'total_items': resumen.total_items,
+        })
+
+    messages.success(request, f'{producto_nombre} eliminado del carrito.')
+    return redirect('ver_carrito')
+
+
+async def contador_carrito(request):
+    """Numero de items en el carrito (para AJAX). No crea sesion ni carrito."""
+    usuario = await request.auser()
+    return JsonResponse({'total_items': await atotal_items_sin_escrituras(request, usuario)})